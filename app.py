@@ -1,11 +1,25 @@
-from flask import Flask, render_template, request, redirect, session, url_for, make_response, send_file
+from flask import Flask, Response, render_template, request, redirect, session, url_for, make_response, send_file, g, has_request_context, stream_with_context
 import psycopg2
+import psycopg2.extensions
 from psycopg2 import errors as psycopg2_errors
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_batch, execute_values
 import os
+import queue
+import re
 import json
+import base64
+import csv
+import hashlib
+import math
+import random
+import socket
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import date
-from io import BytesIO
+from decimal import Decimal
+from io import BytesIO, StringIO
 from urllib.parse import quote
 from openpyxl import Workbook
 from openpyxl.utils import get_column_letter
@@ -16,7 +30,7 @@ from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APIStatusError, APITimeoutError
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -62,146 +76,494 @@ else:
     DB_PORT = int(os.getenv("PGPORT", "5432"))
 
 
+# ---- Connection pool (one per worker process) ----
+# Opening a connection to the hosted Postgres costs a TLS handshake plus auth,
+# so connections are borrowed from a per-process pool instead.
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # recycle connections older than this
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))  # ping connections idle longer than this
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection frees up within DB_POOL_TIMEOUT."""
+
+
+def _connect():
+    """Open a brand new Postgres connection."""
+    if DATABASE_URL:
+        return psycopg2.connect(DATABASE_URL)
+    return psycopg2.connect(
+        host=DB_HOST,
+        user=DB_USER,
+        password=DB_PASS,
+        database=DB_NAME,
+        port=DB_PORT,
+    )
+
+
+class ConnectionPool:
+    """
+    Thread-safe Postgres connection pool.
+    - Blocks up to `timeout` seconds when all `max_size` connections are in use.
+    - Pings connections that sat idle for longer than `healthcheck_idle` before handing them out.
+    - Closes and replaces connections older than `max_lifetime`.
+    """
+
+    def __init__(self, max_size, timeout, max_lifetime, healthcheck_idle):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.healthcheck_idle = healthcheck_idle
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, created_at, last_used)]
+        self._created_at = {}  # id(conn) -> created_at for checked-out connections
+        self._in_use = 0
+        self._counters = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "timeouts": 0,
+            "connections_created": 0,
+            "connections_recycled": 0,
+            "healthcheck_failures": 0,
+        }
+
+    def _open(self):
+        conn = _connect()
+        with self._cond:
+            self._counters["connections_created"] += 1
+        return conn, time.monotonic()
+
+    def _healthy(self, conn):
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        entry = None
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._in_use + len(self._idle) < self.max_size:
+                    break  # room to open a new connection
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    raise PoolTimeout(f"No free DB connection after {self.timeout}s (pool size {self.max_size})")
+                waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._counters["checkouts"] += 1
+            if waited:
+                wait = time.monotonic() - start
+                self._counters["waits"] += 1
+                self._counters["wait_seconds_total"] += wait
+                self._counters["wait_seconds_max"] = max(self._counters["wait_seconds_max"], wait)
+
+        try:
+            if entry is not None:
+                conn, created_at, last_used = entry
+                now = time.monotonic()
+                if conn.closed or now - created_at > self.max_lifetime:
+                    self._discard(conn, recycled=True)
+                    conn, created_at = self._open()
+                elif now - last_used > self.healthcheck_idle and not self._healthy(conn):
+                    with self._cond:
+                        self._counters["healthcheck_failures"] += 1
+                    self._discard(conn)
+                    conn, created_at = self._open()
+            else:
+                conn, created_at = self._open()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._created_at[id(conn)] = created_at
+        return conn
+
+    def putconn(self, conn, discard=False):
+        with self._cond:
+            created_at = self._created_at.pop(id(conn), time.monotonic())
+        if not conn.closed and not discard:
+            try:
+                # Never hand out a connection that is still inside a transaction
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        if conn.closed or discard or time.monotonic() - created_at > self.max_lifetime:
+            self._discard(conn, recycled=not discard)
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._in_use -= 1
+            self._cond.notify()
+
+    def _discard(self, conn, recycled=False):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        if recycled:
+            with self._cond:
+                self._counters["connections_recycled"] += 1
+
+    def stats(self):
+        """Snapshot of pool saturation counters."""
+        with self._cond:
+            size = self._in_use + len(self._idle)
+            snapshot = dict(self._counters)
+            snapshot.update({
+                "pid": os.getpid(),
+                "max_size": self.max_size,
+                "size": size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "utilization": round(self._in_use / self.max_size, 3) if self.max_size else 0.0,
+            })
+        return snapshot
+
+
+class PooledConnection:
+    """
+    Wraps a pooled psycopg2 connection so existing `conn.close()` calls hand it back
+    instead of closing the socket. Inside a request the connection is pinned to `g`
+    so nested get_db() calls reuse it; it goes back to the pool once every borrower
+    has closed it (or at teardown), so a route that closes its handle before a long
+    LLM call or stream doesn't hold a pool slot meanwhile.
+    """
+
+    def __init__(self, pool, conn, bound):
+        self._pool = pool
+        self._conn = conn
+        self._bound = bound
+        self._refs = 1
+        self._released = False
+
+    def __getattr__(self, name):
+        if self._released:
+            # Behave like a closed psycopg2 connection; the socket may belong to someone else now
+            if name == "closed":
+                return 1
+            raise psycopg2.InterfaceError("connection already closed")
+        return getattr(self._conn, name)
+
+    @property
+    def raw(self):
+        return self._conn
+
+    def close(self):
+        if self._released:
+            return
+        if not self._bound:
+            self.release()
+            return
+        self._refs = max(0, self._refs - 1)
+        if self._refs == 0:
+            # putconn() rolls back uncommitted work, matching psycopg2 close()
+            if has_request_context() and g.get("_db_conn") is self:
+                g.pop("_db_conn", None)
+            self.release()
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._pool.putconn(self._conn, discard=bool(self._conn.closed))
+
+
+_db_pool = None
+_db_pool_pid = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    """Return this process's pool, creating it lazily so forked workers never share sockets."""
+    global _db_pool, _db_pool_pid
+    pid = os.getpid()
+    if _db_pool is None or _db_pool_pid != pid:
+        with _db_pool_lock:
+            if _db_pool is None or _db_pool_pid != pid:
+                _db_pool = ConnectionPool(
+                    max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    healthcheck_idle=DB_POOL_HEALTHCHECK_IDLE,
+                )
+                _db_pool_pid = pid
+    return _db_pool
+
+
 def get_db():
-    """Create a connection per request. No app-start crash if creds are wrong."""
+    """Borrow a pooled connection. No app-start crash if creds are wrong."""
+    if has_request_context():
+        handle = g.get("_db_conn")
+        if handle is not None:
+            if not handle.raw.closed:
+                handle._refs += 1
+                return handle
+            # Connection dropped mid-request: give the slot back and borrow a fresh one
+            g.pop("_db_conn", None)
+            handle.release()
     try:
-        if DATABASE_URL:
-            conn = psycopg2.connect(DATABASE_URL)
-        else:
-            conn = psycopg2.connect(
-                host=DB_HOST,
-                user=DB_USER,
-                password=DB_PASS,
-                database=DB_NAME,
-                port=DB_PORT,
-        )
-        return conn
+        pool = get_db_pool()
+        conn = pool.getconn()
     except Exception as e:
         print(f"DB connect error: {e}")
         return None
+    handle = PooledConnection(pool, conn, bound=has_request_context())
+    if handle._bound:
+        g._db_conn = handle
+    return handle
 
 
-def update_subawards_status_constraint():
-    """Update subawards status constraint to include 'Paid' status."""
-    conn = get_db()
-    if conn is None:
-        return False
-    
+def get_detached_db():
+    """
+    Borrow a pooled connection that is never pinned to the request, for side work
+    (caches, logging) whose commits must not end the caller's transaction.
+    """
     try:
-        cur = conn.cursor()
-        # Drop existing constraint if it exists
-        cur.execute("ALTER TABLE subawards DROP CONSTRAINT IF EXISTS subawards_status_check")
-        # Add new constraint with 'Paid' status
-        cur.execute(
-            "ALTER TABLE subawards ADD CONSTRAINT subawards_status_check CHECK (status IN ('Pending', 'Approved', 'Paid', 'Declined'))"
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
-        return True
+        pool = get_db_pool()
+        conn = pool.getconn()
     except Exception as e:
-        print(f"Error updating subawards status constraint: {e}")
-        if conn:
-            conn.rollback()
-            conn.close()
+        print(f"DB connect error: {e}")
+        return None
+    return PooledConnection(pool, conn, bound=False)
+
+
+@app.teardown_appcontext
+def release_db(exc):
+    """Return the request's connection to the pool."""
+    handle = g.pop("_db_conn", None)
+    if handle is not None:
+        handle.release()
+
+
+class UnitOfWork:
+    """
+    One connection, one cursor, one transaction.
+    Helpers that accept `uow=` run their queries on the caller's cursor and leave
+    commit/rollback to whoever opened the unit of work.
+    """
+
+    def __init__(self, conn, cur=None):
+        self.conn = conn
+        self.cur = cur if cur is not None else conn.cursor(cursor_factory=RealDictCursor)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        try:
+            self.cur.close()
+        finally:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            self.close()
         return False
 
 
-def update_transactions_status_constraint():
-    """Update transactions table constraint to include 'Paid' status."""
+def open_unit_of_work():
+    """Start a unit of work on a pooled connection, or None if the DB is unreachable."""
     conn = get_db()
     if conn is None:
-        return False
-    
+        return None
+    return UnitOfWork(conn)
+
+
+# ---- Schema migrations ----
+# migrations/NNNN_description.sql files are applied once each, in order, and
+# recorded in schema_migrations with a checksum of the file contents.
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATIONS_LOCK_ID = 7_241_300  # pg_advisory_lock key so only one worker migrates at a time
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
+
+class MigrationError(Exception):
+    """Raised when an applied migration file was edited or a migration fails."""
+
+
+def load_migrations():
+    """Return [(version, name, sql, checksum)] for every migration file, in version order."""
+    migrations = []
+    if not os.path.isdir(MIGRATIONS_DIR):
+        return migrations
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        if not filename.endswith(".sql"):
+            continue
+        prefix = filename.split("_", 1)[0]
+        if not prefix.isdigit():
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, filename), "r", encoding="utf-8") as f:
+            sql = f.read()
+        checksum = hashlib.sha256(sql.encode("utf-8")).hexdigest()
+        migrations.append((int(prefix), filename, sql, checksum))
+    return migrations
+
+
+def _sql_statements(sql):
+    """Split a migration into statements; fine for DDL files without semicolons in strings or bodies."""
+    code = "\n".join(line for line in sql.splitlines() if not line.strip().startswith("--"))
+    return [statement.strip() for statement in code.split(";") if statement.strip()]
+
+
+def _applied_migrations(cur):
+    """{version: checksum} of applied migrations, or None if the table doesn't exist yet."""
+    cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute("SELECT version, checksum FROM schema_migrations")
+    return {version: checksum for version, checksum in cur.fetchall()}
+
+
+def _check_checksums(applied, migrations):
+    for version, filename, _, checksum in migrations:
+        if version in applied and applied[version] != checksum:
+            raise MigrationError(f"{filename} was modified after it was applied; add a new migration instead")
+
+
+def migration_status():
+    """Applied/pending migration versions, without taking any locks."""
+    migrations = load_migrations()
+    conn = get_db()
+    if conn is None:
+        return None
     try:
         cur = conn.cursor()
-        # Drop the old constraint if it exists
-        cur.execute("""
-            ALTER TABLE transactions
-            DROP CONSTRAINT IF EXISTS transactions_status_check
-        """)
-        # Add the new constraint with 'Paid' status
-        cur.execute("""
-            ALTER TABLE transactions
-            ADD CONSTRAINT transactions_status_check
-            CHECK (status IN ('Pending', 'Approved', 'Paid', 'Declined'))
-        """)
-        conn.commit()
+        applied = _applied_migrations(cur) or {}
         cur.close()
+    finally:
         conn.close()
-        print("✓ Transactions status constraint updated to include 'Paid'")
-        return True
-    except Exception as e:
-        print(f"Error updating transactions status constraint: {e}")
-        if conn:
-            try:
-                conn.rollback()
-            except:
-                pass
-            conn.close()
-        return False
+    return {
+        "head": migrations[-1][0] if migrations else 0,
+        "applied": sorted(applied),
+        "pending": [m[1] for m in migrations if m[0] not in applied],
+    }
 
 
-def init_db_if_needed():
-    """Initialize database schema if tables don't exist."""
+def migrate():
+    """
+    Apply pending migrations. Returns the list of applied filenames (empty when already at head).
+    The "already at head" check is a single read with no locks; only when something is
+    pending do we take an advisory lock so concurrent workers don't race.
+    """
+    migrations = load_migrations()
     conn = get_db()
     if conn is None:
-        print("Warning: Could not connect to database. Schema initialization skipped.")
-        return
+        raise MigrationError("Could not connect to database")
 
+    # autocommit has to be set on the psycopg2 connection, not the pool wrapper
+    raw = getattr(conn, "raw", conn)
+    applied_now = []
     try:
-        cur = conn.cursor()
-        schema_file = os.path.join(os.path.dirname(__file__), "schema_postgresql.sql")
-        if os.path.exists(schema_file):
-            with open(schema_file, 'r') as f:
-                schema_sql = f.read()
-            # Execute the entire schema file
-            # PostgreSQL can handle multiple statements if we use execute with the full SQL
-            try:
-                # Remove comments and clean up
-                lines = schema_sql.split('\n')
-                cleaned_lines = []
-                for line in lines:
-                    # Skip comment lines and empty lines
-                    stripped = line.strip()
-                    if stripped and not stripped.startswith('--'):
-                        cleaned_lines.append(line)
-                cleaned_sql = '\n'.join(cleaned_lines)
-                
-                # Execute the cleaned SQL
-                cur.execute(cleaned_sql)
-                conn.commit()
-                print("✓ Database schema initialized")
-            except Exception as schema_error:
-                # If full execution fails, try executing statement by statement
-                print(f"Full schema execution failed, trying statement by statement: {schema_error}")
-                statements = schema_sql.split(';')
-                for statement in statements:
-                    statement = statement.strip()
-                    if statement and not statement.startswith('--') and not statement.upper().startswith('SELECT'):
-                        try:
-                            cur.execute(statement)
-                        except Exception as stmt_error:
-                            # Some statements might fail if tables already exist, that's okay
-                            error_msg = str(stmt_error)
-                            if 'already exists' not in error_msg.lower() and 'duplicate' not in error_msg.lower():
-                                print(f"Statement execution note: {stmt_error}")
-                conn.commit()
-                print("✓ Database schema initialized (statement by statement)")
-        else:
-            print(f"Warning: Schema file {schema_file} not found")
-        cur.close()
-    except Exception as e:
-        print(f"DB init error: {e}")
-        import traceback
-        traceback.print_exc()
-        conn.rollback()
+        cur = raw.cursor()
+        applied = _applied_migrations(cur)
+        raw.rollback()
+        if applied is not None and all(m[0] in applied for m in migrations):
+            _check_checksums(applied, migrations)
+            cur.close()
+            return applied_now
+
+        raw.autocommit = True
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+        try:
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    checksum VARCHAR(64) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    duration_ms INTEGER
+                )
+                """
+            )
+            # Re-read under the lock: another worker may have migrated meanwhile
+            applied = _applied_migrations(cur)
+            _check_checksums(applied, migrations)
+
+            for version, filename, sql, checksum in migrations:
+                if version in applied:
+                    continue
+                started = time.monotonic()
+                if sql.lstrip().startswith(NO_TRANSACTION_MARKER):
+                    # e.g. CREATE INDEX CONCURRENTLY: outside a transaction, one statement at a
+                    # time (a multi-statement query string runs as an implicit transaction block)
+                    for statement in _sql_statements(sql):
+                        cur.execute(statement)
+                    raw.autocommit = False
+                else:
+                    raw.autocommit = False
+                    cur.execute(sql)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, name, checksum, duration_ms) VALUES (%s, %s, %s, %s)",
+                    (version, filename, checksum, int((time.monotonic() - started) * 1000)),
+                )
+                raw.commit()
+                raw.autocommit = True
+                applied_now.append(filename)
+                print(f"✓ Applied migration {filename}")
+        except Exception as e:
+            if not raw.autocommit:
+                raw.rollback()
+                raw.autocommit = True
+            if isinstance(e, MigrationError):
+                raise
+            raise MigrationError(f"Migration failed: {e}") from e
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+            cur.close()
     finally:
+        raw.autocommit = False
         conn.close()
-    
-    # Update transactions and subawards status constraints after schema initialization
-    update_transactions_status_constraint()
-    update_subawards_status_constraint()
+    return applied_now
+
+
+def init_db_if_needed():
+    """Bring the database schema up to the latest migration."""
+    try:
+        applied = migrate()
+        if not applied:
+            print("✓ Database schema already at head")
+    except MigrationError as e:
+        print(f"DB init error: {e}")
+
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Apply pending schema migrations."""
+    init_db_if_needed()
 
 
 @app.route("/")
@@ -283,8 +645,130 @@ def signup():
     return "Signed up"
 
 
+# ========== Pagination ==========
+
+# List pages use keyset pagination: the next page starts strictly after the last row
+# shown, so each page is one index range scan however deep the history goes.
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "50"))
+LIST_PAGE_SIZE_MAX = 200
+TRANSACTION_STATUSES = ("Pending", "Approved", "Paid", "Declined")
+AWARD_STATUSES = ("Draft", "Pending", "Approved", "Declined")
+
+
+def encode_page_cursor(values):
+    """Opaque, URL-safe token for the sort key of the last row on a page."""
+    raw = json.dumps([v.isoformat() if isinstance(v, date) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_page_cursor(token, size):
+    """Sort key values from a cursor token, or None (first page) if missing or malformed."""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def list_page_args():
+    """(cursor, limit) from the query string, with limit clamped to LIST_PAGE_SIZE_MAX."""
+    limit = request.args.get("limit", type=int) or LIST_PAGE_SIZE
+    return request.args.get("cursor") or None, max(1, min(limit, LIST_PAGE_SIZE_MAX))
+
+
+def fetch_keyset_page(cur, sql, order_by, filters=(), cursor=None, limit=LIST_PAGE_SIZE, descending=True):
+    """
+    Run one page of `sql`, which must contain {where}, {order} and {limit} markers.
+    order_by is [(sql_expression, row_key)] ending in a unique column; filters is
+    [(sql_clause, params)]. Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    clauses = [clause for clause, _ in filters]
+    params = [value for _, values in filters for value in values]
+    after = decode_page_cursor(cursor, len(order_by))
+    if after is not None:
+        columns = ", ".join(expr for expr, _ in order_by)
+        marks = ", ".join(["%s"] * len(order_by))
+        clauses.append(f"({columns}) {'<' if descending else '>'} ({marks})")
+        params.extend(after)
+    direction = "DESC" if descending else "ASC"
+    cur.execute(
+        sql.format(
+            where=" AND ".join(clauses) or "TRUE",
+            order=", ".join(f"{expr} {direction}" for expr, _ in order_by),
+            limit="%s",
+        ),
+        tuple(params) + (limit + 1,),
+    )
+    rows = cur.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_page_cursor([rows[-1][key] for _, key in order_by])
+    return rows, next_cursor
+
+
+def page_links(next_cursor):
+    """First/next page URLs for the current view, keeping its filters."""
+    args = request.args.to_dict()
+    on_later_page = bool(args.pop("cursor", None))
+    view_args = dict(request.view_args or {})
+    return {
+        "first_url": url_for(request.endpoint, **{**args, **view_args}) if on_later_page else None,
+        "next_url": url_for(request.endpoint, **{**args, **view_args, "cursor": next_cursor}) if next_cursor else None,
+    }
+
+
+def award_list_filters(alias="a"):
+    """SQL filters for award lists from the query string (currently: status)."""
+    status = request.args.get("status")
+    if status in AWARD_STATUSES:
+        return [(f"{alias}.status = %s", (status,))], {"status": status}
+    return [], {}
+
+
 # ========== Dashboard (PI + Admin) ==========
 
+# The page of awards is picked first and pending counts are aggregated only for those
+# awards, so the admin dashboard costs the same whatever the size of the history.
+ADMIN_DASHBOARD_AWARDS_SQL = """
+    WITH page AS (
+        SELECT a.award_id, a.title, a.created_by_email, a.sponsor_type,
+               a.amount, a.start_date, a.end_date, a.status, a.created_at, a.ai_review_notes
+        FROM awards a
+        WHERE a.status <> 'Draft' AND {where}
+        ORDER BY {order}
+        LIMIT {limit}
+    )
+    SELECT page.*,
+           COALESCE(pt.pending_count, 0) AS pending_transactions,
+           COALESCE(ps.pending_count, 0) AS pending_subawards
+    FROM page
+    LEFT JOIN (
+        SELECT award_id, COUNT(*) AS pending_count
+        FROM transactions
+        WHERE status = 'Pending' AND award_id IN (SELECT award_id FROM page)
+        GROUP BY award_id
+    ) pt ON pt.award_id = page.award_id
+    LEFT JOIN (
+        SELECT award_id, COUNT(*) AS pending_count
+        FROM subawards
+        WHERE status = 'Pending' AND award_id IN (SELECT award_id FROM page)
+        GROUP BY award_id
+    ) ps ON ps.award_id = page.award_id
+    ORDER BY page.created_at DESC, page.award_id DESC
+"""
+AWARDS_KEYSET_ORDER = [("a.created_at", "created_at"), ("a.award_id", "award_id")]
+
+
+def fetch_admin_dashboard_awards(cur, filters=(), cursor=None, limit=LIST_PAGE_SIZE):
+    """One page of non-draft awards with pending_transactions/pending_subawards attached (single query)."""
+    return fetch_keyset_page(cur, ADMIN_DASHBOARD_AWARDS_SQL, AWARDS_KEYSET_ORDER, filters, cursor, limit)
+
+
 @app.route("/dashboard")
 def dashboard():
     """
@@ -295,6 +779,10 @@ def dashboard():
     if not u:
         return render_template("dashboard.html", name="User", role="Guest", awards=[])
 
+    cursor, limit = list_page_args()
+    filters, active_filters = award_list_filters()
+    next_cursor = None
+
     # ---------- Admin dashboard ----------
     if u["role"] == "Admin":
         awards = []
@@ -303,16 +791,7 @@ def dashboard():
         if conn is not None:
             try:
                 cur = conn.cursor(cursor_factory=RealDictCursor)
-                cur.execute(
-                    """
-                    SELECT award_id, title, created_by_email, sponsor_type,
-                        amount, start_date, end_date, status, created_at, ai_review_notes
-                    FROM awards
-                    WHERE status <> 'Draft'
-                    ORDER BY created_at DESC
-                    """
-                )
-                awards = cur.fetchall()
+                awards, next_cursor = fetch_admin_dashboard_awards(cur, filters, cursor, limit)
 
                 # Calculate total approved - sum all approved awards
                 cur.execute(
@@ -328,34 +807,6 @@ def dashboard():
                 else:
                     total_approved = 0.0
                 
-                # Count pending transactions and subawards for each award
-                for award in awards:
-                    award_id = award['award_id']
-                    
-                    # Count pending transactions
-                    cur.execute(
-                        """
-                        SELECT COUNT(*) as count
-                        FROM transactions
-                        WHERE award_id = %s AND status = 'Pending'
-                        """,
-                        (award_id,)
-                    )
-                    txn_result = cur.fetchone()
-                    award['pending_transactions'] = txn_result['count'] if txn_result else 0
-                    
-                    # Count pending subawards
-                    cur.execute(
-                        """
-                        SELECT COUNT(*) as count
-                        FROM subawards
-                        WHERE award_id = %s AND status = 'Pending'
-                        """,
-                        (award_id,)
-                    )
-                    sub_result = cur.fetchone()
-                    award['pending_subawards'] = sub_result['count'] if sub_result else 0
-                
                 cur.close()
             except Exception as e:
                 print(f"DB fetch awards (admin) error: {e}")
@@ -372,6 +823,8 @@ def dashboard():
             awards=awards,
             budget_initial=budget_initial,
             budget_remaining=budget_remaining,
+            filters=active_filters,
+            pager=page_links(next_cursor),
         )
 
     # ---------- PI dashboard ----------
@@ -380,24 +833,31 @@ def dashboard():
     if conn is not None:
         try:
             cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute(
+            awards, next_cursor = fetch_keyset_page(
+                cur,
                 """
                 SELECT award_id, title, sponsor_type, amount,
                        start_date, end_date, status, created_at
-                FROM awards
-                WHERE created_by_email=%s
-                ORDER BY created_at DESC
+                FROM awards a
+                WHERE {where}
+                ORDER BY {order}
+                LIMIT {limit}
                 """,
-                (u["email"],),
+                AWARDS_KEYSET_ORDER,
+                [("a.created_by_email = %s", (u["email"],))] + filters,
+                cursor,
+                limit,
             )
-            awards = cur.fetchall()
             cur.close()
         except Exception as e:
             print(f"DB fetch awards error: {e}")
         finally:
             conn.close()
 
-    return render_template("dashboard.html", name=u["name"], role=u["role"], awards=awards)
+    return render_template(
+        "dashboard.html", name=u["name"], role=u["role"], awards=awards,
+        filters=active_filters, pager=page_links(next_cursor),
+    )
 
 
 # ========== Grants / Awards (PI side) ==========
@@ -518,53 +978,256 @@ def _parse_json_field(field_value):
         return []
 
 
-@app.route("/awards", methods=["POST"])
-def awards_create():
-    """Create a new award (PI submits; status defaults to 'Pending')."""
-    u = session.get("user")
-    if not u:
-        return redirect(url_for("home"))
-    if u["role"] != "PI":
-        return redirect(url_for("dashboard"))
+def _num_or_none(v):
+    """Helper: form value -> float, or None when blank/invalid."""
+    try:
+        return float(v) if v not in (None, "", "null") else None
+    except (TypeError, ValueError):
+        return None
 
-    title = request.form.get("title", "").strip()
-    sponsor = None  # reserved
-    sponsor_type = request.form.get("sponsor_type", "").strip()
-    department = request.form.get("department", "").strip()
-    college = request.form.get("college", "").strip()
-    contact_email = request.form.get("contact_email", "").strip()
-    amount = request.form.get("amount", "").strip()
-    start_date = request.form.get("start_date", "").strip()
-    end_date = request.form.get("end_date", "").strip()
-    abstract = request.form.get("abstract", "").strip()
-    keywords = request.form.get("keywords", "").strip()
-    collaborators = request.form.get("collaborators", "").strip()
 
-    # JSON strings for detailed budget sections
-    personnel_json_str = request.form.get("personnel_json", "")
-    domestic_travel_json_str = request.form.get("domestic_travel_json", "")
-    international_travel_json_str = request.form.get("international_travel_json", "")
-    materials_json_str = request.form.get("materials_json", "")
-    equipment_json_str = request.form.get("equipment_json", "")
-    other_costs_json_str = request.form.get("other_costs_json", "")  # Form uses other_costs_json, DB uses other_direct_json
+def _int_or_none(v):
+    """Helper: form value -> int, or None when blank/invalid."""
+    try:
+        return int(v) if v not in (None, "", "null") else None
+    except (TypeError, ValueError):
+        return None
 
-    # Parse into Python lists (from the JS format)
-    pers_list = _parse_json_field(personnel_json_str)
-    dom_list = _parse_json_field(domestic_travel_json_str)
-    intl_list = _parse_json_field(international_travel_json_str)
-    mat_list = _parse_json_field(materials_json_str)
-    equipment_list = _parse_json_field(equipment_json_str)
-    other_direct_list = _parse_json_field(other_costs_json_str)
 
-    if not title or not sponsor_type or not amount or not start_date or not end_date:
-        return make_response("Missing required fields", 400)
+def normalize_award_detail_rows(pers_list, dom_list, intl_list, mat_list):
+    """
+    Turn the form's JSON budget sections into rows for the detail tables.
+    Returns {"personnel": [...], "travel": [...], "materials": [...]} where each row is a
+    tuple in the column order used by insert_award_detail_rows (award_id excluded).
+    Items without a name/type are skipped, as before.
+    """
+    personnel_rows = []
+    for p in pers_list:
+        if not isinstance(p, dict):
+            continue
+        name_val = (p.get("name") or "").strip()
+        if not name_val:
+            continue
+        position = (p.get("position") or "").strip()
+        same_each_year = bool(p.get("same_each_year", False))
+
+        # p["hours"] is an array of {year, hours}
+        hours_for_years = None
+        hrs = p.get("hours")
+        if isinstance(hrs, list) and hrs:
+            total = 0.0
+            for h in hrs:
+                try:
+                    total += float(h.get("hours", 0) or 0)
+                except Exception:
+                    pass
+            if total > 0:
+                hours_for_years = total
 
-    conn = get_db()
-    if conn is None:
-        return make_response("DB connection failed", 500)
+        personnel_rows.append((name_val, position or None, hours_for_years, same_each_year))
 
-    try:
-        cur = conn.cursor()
+    travel_rows = []
+    for travel_type, items in (("Domestic", dom_list), ("International", intl_list)):
+        for t in items:
+            if not isinstance(t, dict):
+                continue
+            travel_name = (t.get("travel_name") or t.get("name") or "").strip()
+            if not travel_name:
+                continue
+            desc = (t.get("description") or "").strip()
+            travel_rows.append((
+                travel_type,
+                travel_name,
+                desc or None,
+                t.get("year"),
+                t.get("start_date") or t.get("depart") or None,
+                t.get("end_date") or t.get("arrive") or None,
+                _num_or_none(t.get("flight_cost") or t.get("flight")),
+                _num_or_none(t.get("taxi_per_day")),
+                _num_or_none(t.get("food_lodge_per_day") or t.get("food_per_day")),
+                _int_or_none(t.get("days")),
+            ))
+
+    material_rows = []
+    for m in mat_list:
+        if not isinstance(m, dict):
+            continue
+        mtype = (m.get("material_type") or m.get("category") or "").strip()
+        if not mtype:
+            continue
+        desc = (m.get("description") or "").strip()
+        material_rows.append((mtype, _num_or_none(m.get("cost")), desc or None, m.get("year")))
+
+    return {"personnel": personnel_rows, "travel": travel_rows, "materials": material_rows}
+
+
+# Detail table layouts: (table, columns after award_id)
+AWARD_DETAIL_TABLES = {
+    "personnel": ("personnel_expenses",
+                  ("person_name", "position_title", "hours_for_years", "same_each_year")),
+    "travel": ("travel_expenses",
+               ("travel_type", "travel_name", "description", "year", "start_date", "end_date",
+                "flight_cost", "taxi_per_day", "food_lodge_per_day", "num_days")),
+    "materials": ("material_supplies",
+                  ("material_type", "cost", "description", "year")),
+}
+
+
+def insert_award_detail_rows(cur, award_id, detail_rows, page_size=500):
+    """Insert normalized detail rows with one multi-row INSERT per table."""
+    for section, (table, columns) in AWARD_DETAIL_TABLES.items():
+        rows = detail_rows.get(section) or []
+        if not rows:
+            continue
+        execute_values(
+            cur,
+            f"INSERT INTO {table} (award_id, {', '.join(columns)}) VALUES %s",
+            [(award_id,) + tuple(row) for row in rows],
+            page_size=page_size,
+        )
+
+
+# Primary key column of each detail table
+AWARD_DETAIL_ID_COLUMNS = {
+    "personnel": "personnel_id",
+    "travel": "travel_id",
+    "materials": "material_id",
+}
+
+
+def _as_json_list(raw):
+    """Helper: stored JSONB (already decoded, or text) -> list."""
+    if raw is None:
+        return []
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except json.JSONDecodeError:
+            return []
+    return raw if isinstance(raw, list) else []
+
+
+def _canonical_detail_value(value):
+    """Helper: make form values and DB values comparable (1 == '1' == Decimal('1.00'))."""
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (int, float, Decimal)):
+        return f"{float(value):.2f}"
+    text = str(value).strip()
+    try:
+        return f"{float(text):.2f}"
+    except ValueError:
+        return text
+
+
+def _detail_row_key(row):
+    return tuple(_canonical_detail_value(v) for v in row)
+
+
+def sync_award_detail_rows(cur, award_id, old_rows, new_rows):
+    """
+    Bring the detail tables from `old_rows` to `new_rows` (both normalize_award_detail_rows()
+    output) with the fewest writes: unchanged sections are skipped, unchanged rows are kept,
+    changed rows are updated in place, and only the surplus is inserted or deleted.
+    Returns counts of inserted/updated/deleted rows.
+    """
+    counts = {"inserted": 0, "updated": 0, "deleted": 0}
+    to_insert = {}
+    with cur.connection.cursor() as dcur:
+        for section, (table, columns) in AWARD_DETAIL_TABLES.items():
+            old = old_rows.get(section) or []
+            new = new_rows.get(section) or []
+            if Counter(map(_detail_row_key, old)) == Counter(map(_detail_row_key, new)):
+                continue
+
+            id_col = AWARD_DETAIL_ID_COLUMNS[section]
+            dcur.execute(
+                f"SELECT {id_col}, {', '.join(columns)} FROM {table} WHERE award_id = %s ORDER BY {id_col}",
+                (award_id,),
+            )
+            existing = {}
+            for row in dcur.fetchall():
+                existing.setdefault(_detail_row_key(row[1:]), []).append(row[0])
+
+            changed = []
+            for row in new:
+                ids = existing.get(_detail_row_key(row))
+                if ids:
+                    ids.pop(0)  # identical row already stored
+                else:
+                    changed.append(row)
+            stale_ids = sorted(row_id for ids in existing.values() for row_id in ids)
+
+            # Reuse stale rows for changed items, then insert/delete whatever is left over
+            updates = list(zip(stale_ids, changed))
+            if updates:
+                execute_batch(
+                    dcur,
+                    f"UPDATE {table} SET {', '.join(f'{c} = %s' for c in columns)} WHERE {id_col} = %s",
+                    [tuple(row) + (row_id,) for row_id, row in updates],
+                )
+                counts["updated"] += len(updates)
+            surplus_ids = stale_ids[len(updates):]
+            if surplus_ids:
+                dcur.execute(f"DELETE FROM {table} WHERE {id_col} = ANY(%s)", (surplus_ids,))
+                counts["deleted"] += len(surplus_ids)
+            if len(changed) > len(updates):
+                to_insert[section] = changed[len(updates):]
+                counts["inserted"] += len(to_insert[section])
+
+        insert_award_detail_rows(dcur, award_id, to_insert)
+    return counts
+
+
+@app.route("/awards", methods=["POST"])
+def awards_create():
+    """Create a new award (PI submits; status defaults to 'Pending')."""
+    u = session.get("user")
+    if not u:
+        return redirect(url_for("home"))
+    if u["role"] != "PI":
+        return redirect(url_for("dashboard"))
+
+    title = request.form.get("title", "").strip()
+    sponsor = None  # reserved
+    sponsor_type = request.form.get("sponsor_type", "").strip()
+    department = request.form.get("department", "").strip()
+    college = request.form.get("college", "").strip()
+    contact_email = request.form.get("contact_email", "").strip()
+    amount = request.form.get("amount", "").strip()
+    start_date = request.form.get("start_date", "").strip()
+    end_date = request.form.get("end_date", "").strip()
+    abstract = request.form.get("abstract", "").strip()
+    keywords = request.form.get("keywords", "").strip()
+    collaborators = request.form.get("collaborators", "").strip()
+
+    # JSON strings for detailed budget sections
+    personnel_json_str = request.form.get("personnel_json", "")
+    domestic_travel_json_str = request.form.get("domestic_travel_json", "")
+    international_travel_json_str = request.form.get("international_travel_json", "")
+    materials_json_str = request.form.get("materials_json", "")
+    equipment_json_str = request.form.get("equipment_json", "")
+    other_costs_json_str = request.form.get("other_costs_json", "")  # Form uses other_costs_json, DB uses other_direct_json
+
+    # Parse into Python lists (from the JS format)
+    pers_list = _parse_json_field(personnel_json_str)
+    dom_list = _parse_json_field(domestic_travel_json_str)
+    intl_list = _parse_json_field(international_travel_json_str)
+    mat_list = _parse_json_field(materials_json_str)
+    equipment_list = _parse_json_field(equipment_json_str)
+    other_direct_list = _parse_json_field(other_costs_json_str)
+
+    if not title or not sponsor_type or not amount or not start_date or not end_date:
+        return make_response("Missing required fields", 400)
+
+    conn = get_db()
+    if conn is None:
+        return make_response("DB connection failed", 500)
+
+    try:
+        cur = conn.cursor()
 
         # Insert into awards and get award_id
         cur.execute(
@@ -600,133 +1263,11 @@ def awards_create():
         )
         award_id = cur.fetchone()[0]
 
-        # ---- Insert personnel rows (summary into personnel_expenses) ----
-        for p in pers_list:
-            name_val = (p.get("name") or "").strip()
-            if not name_val:
-                continue
-            position = (p.get("position") or "").strip()
-            same_each_year = bool(p.get("same_each_year", False))
-
-            # p["hours"] is an array of {year, hours}
-            hours_for_years = None
-            hrs = p.get("hours")
-            if isinstance(hrs, list) and hrs:
-                total = 0.0
-                for h in hrs:
-                    try:
-                        total += float(h.get("hours", 0) or 0)
-                    except Exception:
-                        pass
-                if total > 0:
-                    hours_for_years = total
-
-            cur.execute(
-                """
-                INSERT INTO personnel_expenses
-                  (award_id, person_name, position_title, hours_for_years, same_each_year)
-                VALUES (%s, %s, %s, %s, %s)
-                """,
-                (award_id, name_val, position or None, hours_for_years, same_each_year),
-            )
-
-        # Helper for numeric conversion
-        def num(v):
-            try:
-                return float(v) if v not in (None, "", "null") else None
-            except (TypeError, ValueError):
-                return None
-
-        # ---- Insert domestic travel rows ----
-        for t in dom_list:
-            travel_name = (t.get("travel_name") or t.get("name") or "").strip()
-            if not travel_name:
-                continue
-            desc = (t.get("description") or "").strip()
-            year = t.get("year")
-            start = t.get("start_date") or t.get("depart") or None
-            end = t.get("end_date") or t.get("arrive") or None
-
-            flight = num(t.get("flight_cost") or t.get("flight"))
-            taxi = num(t.get("taxi_per_day"))
-            food = num(t.get("food_lodge_per_day") or t.get("food_per_day"))
-            days = None
-            try:
-                dval = t.get("days")
-                days = int(dval) if dval not in (None, "", "null") else None
-            except (TypeError, ValueError):
-                days = None
-
-            cur.execute(
-                """
-                INSERT INTO travel_expenses
-                  (award_id, travel_type, travel_name, description, year,
-                   start_date, end_date, flight_cost, taxi_per_day,
-                   food_lodge_per_day, num_days)
-                VALUES (%s, 'Domestic', %s, %s, %s,
-                        %s, %s, %s, %s, %s, %s)
-                """,
-                (
-                    award_id, travel_name, desc or None, year,
-                    start, end, flight, taxi, food, days,
-                ),
-            )
-
-        # ---- Insert international travel rows ----
-        for t in intl_list:
-            travel_name = (t.get("travel_name") or t.get("name") or "").strip()
-            if not travel_name:
-                continue
-            desc = (t.get("description") or "").strip()
-            year = t.get("year")
-            start = t.get("start_date") or t.get("depart") or None
-            end = t.get("end_date") or t.get("arrive") or None
-
-            flight = num(t.get("flight_cost") or t.get("flight"))
-            taxi = num(t.get("taxi_per_day"))
-            food = num(t.get("food_lodge_per_day") or t.get("food_per_day"))
-            days = None
-            try:
-                dval = t.get("days")
-                days = int(dval) if dval not in (None, "", "null") else None
-            except (TypeError, ValueError):
-                days = None
-
-            cur.execute(
-                """
-                INSERT INTO travel_expenses
-                  (award_id, travel_type, travel_name, description, year,
-                   start_date, end_date, flight_cost, taxi_per_day,
-                   food_lodge_per_day, num_days)
-                VALUES (%s, 'International', %s, %s, %s,
-                        %s, %s, %s, %s, %s, %s)
-                """,
-                (
-                    award_id, travel_name, desc or None, year,
-                    start, end, flight, taxi, food, days,
-                ),
-            )
-
-        # ---- Insert materials/supplies rows ----
-        for m in mat_list:
-            mtype = (m.get("material_type") or m.get("category") or "").strip()
-            if not mtype:
-                continue
-            desc = (m.get("description") or "").strip()
-            year = m.get("year")
-            try:
-                cost_val = float(m.get("cost")) if m.get("cost") not in (None, "", "null") else None
-            except (TypeError, ValueError):
-                cost_val = None
-
-            cur.execute(
-                """
-                INSERT INTO material_supplies
-                  (award_id, material_type, cost, description, year)
-                VALUES (%s, %s, %s, %s, %s)
-                """,
-                (award_id, mtype, cost_val, desc or None, year),
-            )
+        # ---- Insert personnel / travel / materials detail rows in bulk ----
+        insert_award_detail_rows(
+            cur, award_id,
+            normalize_award_detail_rows(pers_list, dom_list, intl_list, mat_list),
+        )
 
         conn.commit()
         cur.close()
@@ -1473,16 +2014,23 @@ def award_edit(award_id):
 
         try:
             cur = conn.cursor()
-            
-            # Ensure equipment_json and other_direct_json columns exist (if they don't, this will fail silently)
-            try:
-                cur.execute("ALTER TABLE awards ADD COLUMN IF NOT EXISTS equipment_json JSONB")
-            except Exception:
-                pass  # Column might already exist
-            try:
-                cur.execute("ALTER TABLE awards ADD COLUMN IF NOT EXISTS other_direct_json JSONB")
-            except Exception:
-                pass  # Column might already exist
+
+            # Current JSON sections, used to diff the detail rows below
+            cur.execute(
+                """
+                SELECT personnel_json, domestic_travel_json,
+                       international_travel_json, materials_json
+                FROM awards
+                WHERE award_id=%s AND created_by_email=%s
+                FOR UPDATE
+                """,
+                (award_id, u["email"]),
+            )
+            stored = cur.fetchone()
+            if not stored:
+                cur.close()
+                return "Award not found", 404
+            old_detail_rows = normalize_award_detail_rows(*(_as_json_list(raw) for raw in stored))
 
             # Update master award + JSON blobs
             cur.execute(
@@ -1522,149 +2070,25 @@ def award_edit(award_id):
                 ),
             )
 
-            # Wipe existing detail rows and re-insert
-            cur.execute("DELETE FROM personnel_expenses WHERE award_id=%s", (award_id,))
-            cur.execute("DELETE FROM travel_expenses WHERE award_id=%s", (award_id,))
-            cur.execute("DELETE FROM material_supplies WHERE award_id=%s", (award_id,))
-
-            # Helper for numeric
-            def num(v):
-                try:
-                    return float(v) if v not in (None, "", "null") else None
-                except (TypeError, ValueError):
-                    return None
-
-            # Re-insert personnel
-            for p in pers_list:
-                name_val = (p.get("name") or "").strip()
-                if not name_val:
-                    continue
-                position = (p.get("position") or "").strip()
-                same_each_year = bool(p.get("same_each_year", False))
-
-                hours_for_years = None
-                hrs = p.get("hours")
-                if isinstance(hrs, list) and hrs:
-                    total = 0.0
-                    for h in hrs:
-                        try:
-                            total += float(h.get("hours", 0) or 0)
-                        except Exception:
-                            pass
-                    if total > 0:
-                        hours_for_years = total
-
-                cur.execute(
-                    """
-                    INSERT INTO personnel_expenses
-                      (award_id, person_name, position_title, hours_for_years, same_each_year)
-                    VALUES (%s, %s, %s, %s, %s)
-                    """,
-                    (award_id, name_val, position or None, hours_for_years, same_each_year),
-                )
-
-            # Re-insert domestic travel
-            for t in dom_list:
-                travel_name = (t.get("travel_name") or t.get("name") or "").strip()
-                if not travel_name:
-                    continue
-                desc = (t.get("description") or "").strip()
-                year = t.get("year")
-                start = t.get("start_date") or t.get("depart") or None
-                end = t.get("end_date") or t.get("arrive") or None
-
-                flight = num(t.get("flight_cost") or t.get("flight"))
-                taxi = num(t.get("taxi_per_day"))
-                food = num(t.get("food_lodge_per_day") or t.get("food_per_day"))
-                days = None
-                try:
-                    dval = t.get("days")
-                    days = int(dval) if dval not in (None, "", "null") else None
-                except (TypeError, ValueError):
-                    days = None
-
-                cur.execute(
-                    """
-                    INSERT INTO travel_expenses
-                      (award_id, travel_type, travel_name, description, year,
-                       start_date, end_date, flight_cost, taxi_per_day,
-                       food_lodge_per_day, num_days)
-                    VALUES (%s, 'Domestic', %s, %s, %s,
-                            %s, %s, %s, %s, %s, %s)
-                    """,
-                    (
-                        award_id, travel_name, desc or None, year,
-                        start, end, flight, taxi, food, days,
-                    ),
-                )
-
-            # Re-insert international travel
-            for t in intl_list:
-                travel_name = (t.get("travel_name") or t.get("name") or "").strip()
-                if not travel_name:
-                    continue
-                desc = (t.get("description") or "").strip()
-                year = t.get("year")
-                start = t.get("start_date") or t.get("depart") or None
-                end = t.get("end_date") or t.get("arrive") or None
-
-                flight = num(t.get("flight_cost") or t.get("flight"))
-                taxi = num(t.get("taxi_per_day"))
-                food = num(t.get("food_lodge_per_day") or t.get("food_per_day"))
-                days = None
-                try:
-                    dval = t.get("days")
-                    days = int(dval) if dval not in (None, "", "null") else None
-                except (TypeError, ValueError):
-                    days = None
-
-                cur.execute(
-                    """
-                    INSERT INTO travel_expenses
-                      (award_id, travel_type, travel_name, description, year,
-                       start_date, end_date, flight_cost, taxi_per_day,
-                       food_lodge_per_day, num_days)
-                    VALUES (%s, 'International', %s, %s, %s,
-                            %s, %s, %s, %s, %s, %s)
-                    """,
-                    (
-                        award_id, travel_name, desc or None, year,
-                        start, end, flight, taxi, food, days,
-                    ),
-                )
-
-            # Re-insert materials/supplies
-            for m in mat_list:
-                mtype = (m.get("material_type") or m.get("category") or "").strip()
-                if not mtype:
-                    continue
-                desc = (m.get("description") or "").strip()
-                year = m.get("year")
-                try:
-                    cost_val = float(m.get("cost")) if m.get("cost") not in (None, "", "null") else None
-                except (TypeError, ValueError):
-                    cost_val = None
-
-                cur.execute(
-                    """
-                    INSERT INTO material_supplies
-                      (award_id, material_type, cost, description, year)
-                    VALUES (%s, %s, %s, %s, %s)
-                    """,
-                    (award_id, mtype, cost_val, desc or None, year),
-                )
+            # Write only the detail rows that actually changed
+            sync_award_detail_rows(
+                cur, award_id, old_detail_rows,
+                normalize_award_detail_rows(pers_list, dom_list, intl_list, mat_list),
+            )
 
-            conn.commit()
             cur.close()
             
-            # Recalculate budget lines if award is approved (to reflect updated form data)
+            # Recalculate budget lines if award is approved (to reflect updated form data),
+            # inside the same transaction as the edit
             cur = conn.cursor(cursor_factory=RealDictCursor)
             cur.execute("SELECT status FROM awards WHERE award_id = %s", (award_id,))
             award_status = cur.fetchone()
-            cur.close()
             
             if award_status and award_status['status'] == 'Approved':
-                initialize_budget_lines(award_id)
+                initialize_budget_lines(award_id, uow=UnitOfWork(conn, cur))
+            
+            conn.commit()
+            cur.close()
                 
         except Exception as e:
             print(f"DB update award error: {e}")
@@ -1863,9 +2287,9 @@ def award_approve(award_id):
             "UPDATE awards SET status='Approved' WHERE award_id=%s",
             (award_id,),
         )
+        # Initialize budget lines for approved award in the same transaction
+        initialize_budget_lines(award_id, uow=UnitOfWork(conn, cur))
         conn.commit()
-                        # Initialize budget lines for approved award (must happen after commit)
-        initialize_budget_lines(award_id)
         cur.close()
         conn.close()
     except Exception as e:
@@ -1917,41 +2341,41 @@ def subawards():
     if not u:
         return redirect(url_for("home"))
     
+    cursor, limit = list_page_args()
     conn = get_db()
     approved_awards = []
+    next_cursor = None
     
     if conn is not None:
         try:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             
-            # Get approved awards for the user
-            if u["role"] == "Admin":
-                cur.execute(
-                    """
-                    SELECT award_id, title, amount, status, start_date, end_date
-                    FROM awards
-                    WHERE status = 'Approved'
-                    ORDER BY title
-                    """
-                )
-            else:
-                cur.execute(
-                    """
-                    SELECT award_id, title, amount, status, start_date, end_date
-                    FROM awards
-                    WHERE status = 'Approved' AND created_by_email = %s
-                    ORDER BY title
-                    """,
-                    (u["email"],)
-                )
-            approved_awards = cur.fetchall()
+            # Get approved awards for the user, alphabetically
+            filters = [("a.status = %s", ("Approved",))]
+            if u["role"] != "Admin":
+                filters.append(("a.created_by_email = %s", (u["email"],)))
+            approved_awards, next_cursor = fetch_keyset_page(
+                cur,
+                """
+                SELECT award_id, title, amount, status, start_date, end_date
+                FROM awards a
+                WHERE {where}
+                ORDER BY {order}
+                LIMIT {limit}
+                """,
+                [("a.title", "title"), ("a.award_id", "award_id")],
+                filters,
+                cursor,
+                limit,
+                descending=False,
+            )
             # Convert amounts to float for template rendering
             for award in approved_awards:
                 if award.get('amount'):
                     award['amount'] = float(award['amount'])
             
             # For non-admin users: if only one award, redirect to award-specific page
-            if u["role"] != "Admin" and len(approved_awards) == 1:
+            if u["role"] != "Admin" and len(approved_awards) == 1 and not cursor and not next_cursor:
                 cur.close()
                 conn.close()
                 return redirect(url_for("subawards_by_award", award_id=approved_awards[0]['award_id']))
@@ -1967,10 +2391,12 @@ def subawards():
     
     # If no approved awards, show empty state
     if not approved_awards:
-        return render_template("subawards.html", approved_awards=[], user=u, show_award_selection=True)
+        return render_template("subawards.html", approved_awards=[], user=u, show_award_selection=True,
+                               pager=page_links(None))
     
     # Show award selection page
-    return render_template("subawards.html", approved_awards=approved_awards, user=u, show_award_selection=True)
+    return render_template("subawards.html", approved_awards=approved_awards, user=u, show_award_selection=True,
+                           pager=page_links(next_cursor))
 
 
 @app.route("/subawards/award/<int:award_id>")
@@ -1980,9 +2406,13 @@ def subawards_by_award(award_id):
     if not u:
         return redirect(url_for("home"))
     
+    cursor, limit = list_page_args()
+    status = request.args.get("status")
+    active_filters = {"status": status} if status in TRANSACTION_STATUSES else {}
     conn = get_db()
     award = None
     subawards_list = []
+    next_cursor = None
     
     if conn is not None:
         try:
@@ -2018,18 +2448,25 @@ def subawards_by_award(award_id):
             if award.get('amount'):
                 award['amount'] = float(award['amount'])
             
-            # Get subawards for this award
-            cur.execute(
+            # Get one page of subawards for this award
+            filters = [("s.award_id = %s", (award_id,))]
+            if active_filters:
+                filters.append(("s.status = %s", (status,)))
+            subawards_list, next_cursor = fetch_keyset_page(
+                cur,
                 """
                 SELECT s.*, a.title as award_title
                 FROM subawards s
                 LEFT JOIN awards a ON s.award_id = a.award_id
-                WHERE s.award_id = %s
-                ORDER BY s.created_at DESC
+                WHERE {where}
+                ORDER BY {order}
+                LIMIT {limit}
                 """,
-                (award_id,)
+                [("s.created_at", "created_at"), ("s.subaward_id", "subaward_id")],
+                filters,
+                cursor,
+                limit,
             )
-            subawards_list = cur.fetchall()
             # Convert amounts to float
             for sub in subawards_list:
                 if sub.get('amount'):
@@ -2046,7 +2483,8 @@ def subawards_by_award(award_id):
     if not award:
         return "Award not found", 404
     
-    return render_template("subawards_by_award.html", award=award, subawards=subawards_list, user=u)
+    return render_template("subawards_by_award.html", award=award, subawards=subawards_list, user=u,
+                           filters=active_filters, pager=page_links(next_cursor))
 
 
 @app.route("/subawards/new")
@@ -2218,6 +2656,9 @@ def subaward_create():
         )
         subaward_id = cur.fetchone()['subaward_id']
         
+        # The subaward total is part of the budget revision; rebuild the lines in this transaction
+        initialize_budget_lines(award_id, uow=UnitOfWork(conn, cur))
+        
         conn.commit()
         cur.close()
         
@@ -2226,7 +2667,7 @@ def subaward_create():
         conn.rollback()
         if conn:
             conn.close()
-        return redirect(url_for("admin_init_db"))
+        return redirect(url_for("admin_migrations"))
     except Exception as e:
         print(f"DB create subaward error: {e}")
         import traceback
@@ -2276,7 +2717,7 @@ def subaward_view(subaward_id):
             except psycopg2_errors.UndefinedTable:
                 cur.close()
                 conn.close()
-                return redirect(url_for("admin_init_db"))
+                return redirect(url_for("admin_migrations"))
             except Exception as e:
                 print(f"Error fetching subaward: {e}")
                 cur.close()
@@ -2410,7 +2851,12 @@ def subaward_approve(subaward_id):
         cur = conn.cursor(cursor_factory=RealDictCursor)
         # Get award_id from subaward before approving
         cur.execute(
-            "SELECT award_id FROM subawards WHERE subaward_id = %s",
+            """
+            SELECT s.award_id, a.status AS award_status
+            FROM subawards s
+            LEFT JOIN awards a ON s.award_id = a.award_id
+            WHERE s.subaward_id = %s
+            """,
             (subaward_id,)
         )
         subaward = cur.fetchone()
@@ -2432,6 +2878,8 @@ def subaward_approve(subaward_id):
             "UPDATE subawards SET status = 'Approved' WHERE subaward_id = %s",
             (subaward_id,)
         )
+        if subaward['award_status'] == 'Approved':
+            initialize_budget_lines(award_id, uow=UnitOfWork(conn, cur))
         
         # Add to committed budget for Subawards category
         cur.execute(
@@ -2598,7 +3046,7 @@ def subaward_delete(subaward_id):
         # Get award_id and check permissions
         cur.execute(
             """
-            SELECT s.*, a.created_by_email as award_owner, s.award_id
+            SELECT s.*, a.created_by_email as award_owner, a.status as award_status, s.award_id
             FROM subawards s
             LEFT JOIN awards a ON s.award_id = a.award_id
             WHERE s.subaward_id = %s
@@ -2616,6 +3064,8 @@ def subaward_delete(subaward_id):
             return "Unauthorized", 403
         
         cur.execute("DELETE FROM subawards WHERE subaward_id = %s", (subaward_id,))
+        if subaward['award_status'] == 'Approved':
+            initialize_budget_lines(award_id, uow=UnitOfWork(conn, cur))
         conn.commit()
         cur.close()
         
@@ -2632,14 +3082,19 @@ def subaward_delete(subaward_id):
 
 # ========== TRANSACTION SYSTEM ==========
 
-def get_budget_status(award_id):
-    """Calculate budget status for an award: allocated, committed, spent, remaining by category."""
-    conn = get_db()
-    if conn is None:
-        return {}
+def get_budget_status(award_id, uow=None):
+    """Calculate budget status for an award: allocated, committed, spent, remaining by category.
+
+    Pass `uow` to run inside the caller's transaction instead of borrowing a connection.
+    """
+    owns_uow = uow is None
+    if owns_uow:
+        uow = open_unit_of_work()
+        if uow is None:
+            return {}
     
     try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur = uow.cur
         
         # Get budget lines (allocated amounts by category)
         cur.execute(
@@ -2652,15 +3107,39 @@ def get_budget_status(award_id):
         )
         budget_lines = cur.fetchall()
         
-        # Get transactions
+        # budget_lines are only rewritten on edit/approve; if they predate the
+        # award's current budget revision, derive allocations in memory instead
+        # of writing from a read path.
         cur.execute(
-            """
-            SELECT category, amount, status
-            FROM transactions
+            f"""
+            SELECT status, amount, personnel_json, domestic_travel_json,
+                   international_travel_json, materials_json, budget_lines_revision,
+                   {BUDGET_SUBAWARDS_TOTAL_SQL}
+            FROM awards
             WHERE award_id = %s
             """,
             (award_id,)
         )
+        award = cur.fetchone()
+        if (award and award['status'] == 'Approved'
+                and award.get('budget_lines_revision') != award_budget_revision(award)):
+            allocations = compute_budget_allocations(award)
+            allocations['Subawards'] = float(award['subawards_total'] or 0)
+            budget_lines = [
+                {'category': category, 'allocated_amount': amount}
+                for category, amount in allocations.items()
+                if amount > 0
+            ]
+        
+        # Get per category/status transaction totals (trigger-maintained rollup)
+        cur.execute(
+            """
+            SELECT category, status, total_amount AS amount
+            FROM transaction_rollups
+            WHERE award_id = %s AND txn_count > 0
+            """,
+            (award_id,)
+        )
         transactions = cur.fetchall()
         
         # Calculate by category
@@ -2679,7 +3158,7 @@ def get_budget_status(award_id):
                 "committed": 0,  # Will be calculated from transactions
             }
         
-        # Calculate spent and committed from transactions (source of truth)
+        # Calculate spent and committed from transaction totals (source of truth)
         for txn in transactions:
             cat = txn['category'] or 'Other'
             amount = float(txn['amount'] or 0)
@@ -2712,217 +3191,314 @@ def get_budget_status(award_id):
             # Remaining = allocated - spent - committed - pending (all reduce available budget for checking)
             vals['remaining'] = max(0, vals['allocated'] - vals['spent'] - vals['committed'] - pending_amt)
         
-        cur.close()
         return categories
         
     except Exception as e:
         print(f"Budget status calculation error: {e}")
+        if not owns_uow:
+            raise
         return {}
     finally:
-        conn.close()
+        if owns_uow:
+            uow.close()
+
+
+# Compares transaction_rollups with a fresh GROUP BY over the raw transaction rows
+ROLLUP_RECONCILE_SQL = """
+    WITH raw AS (
+        SELECT award_id,
+               COALESCE(NULLIF(category, ''), 'Other') AS category,
+               COALESCE(status, '') AS status,
+               COALESCE(SUM(amount), 0) AS total_amount,
+               COUNT(*) AS txn_count
+        FROM transactions
+        WHERE award_id IS NOT NULL
+          AND (%(award_id)s::int IS NULL OR award_id = %(award_id)s::int)
+        GROUP BY 1, 2, 3
+    ),
+    rollup AS (
+        SELECT award_id, category, status, total_amount, txn_count
+        FROM transaction_rollups
+        WHERE (txn_count <> 0 OR total_amount <> 0)
+          AND (%(award_id)s::int IS NULL OR award_id = %(award_id)s::int)
+    )
+    SELECT COALESCE(raw.award_id, rollup.award_id) AS award_id,
+           COALESCE(raw.category, rollup.category) AS category,
+           COALESCE(raw.status, rollup.status) AS status,
+           COALESCE(raw.total_amount, 0) AS expected_amount,
+           COALESCE(rollup.total_amount, 0) AS rollup_amount,
+           COALESCE(raw.txn_count, 0) AS expected_count,
+           COALESCE(rollup.txn_count, 0) AS rollup_count
+    FROM raw
+    FULL OUTER JOIN rollup
+      ON raw.award_id = rollup.award_id
+     AND raw.category = rollup.category
+     AND raw.status = rollup.status
+    WHERE raw.award_id IS NULL
+       OR rollup.award_id IS NULL
+       OR raw.total_amount <> rollup.total_amount
+       OR raw.txn_count <> rollup.txn_count
+    ORDER BY 1, 2, 3
+"""
 
 
-def initialize_budget_lines(award_id):
-    """Initialize budget_lines from award's budget breakdown."""
-    conn = get_db()
-    if conn is None:
-        return False
+def reconcile_transaction_rollups(award_id=None, repair=False, uow=None):
+    """Check transaction_rollups against the raw transaction rows.
+
+    Returns the mismatching (award, category, status) groups. With `repair`, the
+    rollups of every affected award are rebuilt from the raw rows.
+    """
+    owns_uow = uow is None
+    if owns_uow:
+        uow = open_unit_of_work()
+        if uow is None:
+            return None
     
     try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Get award details
-        cur.execute(
-            """
-            SELECT amount, budget_personnel, budget_equipment, 
-                   budget_travel, budget_materials, personnel_json,
-                   domestic_travel_json, international_travel_json, materials_json
-            FROM awards
-            WHERE award_id = %s
-            """,
-            (award_id,)
-        )
-        award = cur.fetchone()
+        cur = uow.cur
+        if repair:
+            # Hold off concurrent writers so the rebuild sees a stable set of rows
+            cur.execute("LOCK TABLE transactions IN SHARE MODE")
+        cur.execute(ROLLUP_RECONCILE_SQL, {"award_id": award_id})
+        mismatches = [
+            {
+                "award_id": row["award_id"],
+                "category": row["category"],
+                "status": row["status"],
+                "expected_amount": float(row["expected_amount"]),
+                "rollup_amount": float(row["rollup_amount"]),
+                "expected_count": row["expected_count"],
+                "rollup_count": row["rollup_count"],
+            }
+            for row in cur.fetchall()
+        ]
         
-        if not award:
-            cur.close()
-            return False
-        
-        # Calculate budget by category from JSON data
-        categories = {}
-        total_award = float(award['amount'] or 0)
-        def parse_json_field(raw):
-            if not raw:
-                return []
-            if isinstance(raw, (list, dict)):
-                return raw
-            try:
-                return json.loads(raw)
-            except (TypeError, json.JSONDecodeError):
-                return []
-        # Personnel - use rate_per_hour * hours from form
-        personnel = parse_json_field(award.get('personnel_json'))
-        personnel_total = 0
-        personnel_items = []
-        for p in personnel:
-            if isinstance(p, dict):
-                hours_list = p.get('hours', [])
-                rate_per_hour = float(p.get('rate_per_hour', 0) or 0)
-                total_from_form = float(p.get('total', 0) or 0)
-                
-                # If total is provided, use it; otherwise calculate from hours * rate
-                if total_from_form > 0:
-                    personnel_total += total_from_form
-                elif isinstance(hours_list, list) and rate_per_hour > 0:
-                    total_hours = sum(float(h.get('hours', 0) or 0) for h in hours_list if isinstance(h, dict))
-                    personnel_total += total_hours * rate_per_hour
-                
-                personnel_items.append({
-                    'name': p.get('name', 'Unknown'),
-                    'position': p.get('position', 'N/A'),
-                    'total': total_from_form if total_from_form > 0 else (sum(float(h.get('hours', 0) or 0) for h in hours_list if isinstance(h, dict)) * rate_per_hour if rate_per_hour > 0 else 0)
-                })
-        categories['Personnel'] = personnel_total
-        
-        # Travel - use total_amount from new simplified structure
-        dom_travel = parse_json_field(award.get('domestic_travel_json'))
-        intl_travel = parse_json_field(award.get('international_travel_json'))
-        travel_total = 0
-        travel_items = []
+        if repair and mismatches:
+            affected = sorted({m["award_id"] for m in mismatches})
+            cur.execute("DELETE FROM transaction_rollups WHERE award_id = ANY(%s)", (affected,))
+            cur.execute(
+                """
+                INSERT INTO transaction_rollups (award_id, category, status, total_amount, txn_count)
+                SELECT t.award_id, COALESCE(NULLIF(t.category, ''), 'Other'), COALESCE(t.status, ''),
+                       COALESCE(SUM(t.amount), 0), COUNT(*)
+                FROM transactions t
+                JOIN awards a ON a.award_id = t.award_id
+                WHERE t.award_id = ANY(%s)
+                GROUP BY 1, 2, 3
+                """,
+                (affected,)
+            )
         
-        # Handle new structure (total_amount) and old structure (flight/taxi/food)
-        for t in dom_travel + intl_travel:
-            if isinstance(t, dict):
-                # New structure: total_amount
-                total_amount = float(t.get('total_amount', 0) or 0)
-                if total_amount > 0:
-                    travel_total += total_amount
-                    travel_items.append({
-                        'description': t.get('description', 'N/A'),
-                        'type': 'Domestic' if t in dom_travel else 'International',
-                        'amount': total_amount
-                    })
-                else:
-                    # Old structure fallback
-                    flight = float(t.get("flight_cost") or t.get("flight") or 0)
-                    taxi = float(t.get("taxi_per_day") or t.get("taxi") or 0)
-                    food = float(t.get("food_lodge_per_day") or t.get("food_per_day") or t.get("food") or 0)
-                    days = float(t.get("days", 0) or 0)
-                    old_total = flight + (taxi + food) * days
-                    if old_total > 0:
-                        travel_total += old_total
-                        travel_items.append({
-                            'description': t.get('description', 'N/A'),
-                            'type': 'Domestic' if t in dom_travel else 'International',
-                            'amount': old_total
-                        })
-        categories["Travel"] = travel_total
+        if owns_uow:
+            uow.commit()
+        return mismatches
+    
+    except Exception as e:
+        print(f"Rollup reconciliation error: {e}")
+        if not owns_uow:
+            raise
+        uow.rollback()
+        return None
+    finally:
+        if owns_uow:
+            uow.close()
+
+
+# Award columns that feed compute_budget_allocations(), plus the subaward total that
+# initialize_budget_lines() writes as the Subawards line; their hash is the budget revision
+BUDGET_REVISION_FIELDS = (
+    "amount", "personnel_json", "domestic_travel_json",
+    "international_travel_json", "materials_json", "subawards_total",
+)
+# Select-list column adding subawards_total to an unaliased `FROM awards` query
+BUDGET_SUBAWARDS_TOTAL_SQL = """
+    (SELECT COALESCE(SUM(s.amount), 0) FROM subawards s
+     WHERE s.award_id = awards.award_id AND s.status != 'Declined') AS subawards_total
+"""
+
+
+def award_budget_revision(award):
+    """Hash of the award columns budget_lines are derived from."""
+    payload = json.dumps(
+        [award.get(field) for field in BUDGET_REVISION_FIELDS],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def compute_budget_allocations(award):
+    """Allocated amount per budget category, derived from the award's JSON budget sections."""
+    categories = {}
+    total_award = float(award.get('amount') or 0)
+    def parse_json_field(raw):
+        if not raw:
+            return []
+        if isinstance(raw, (list, dict)):
+            return raw
+        try:
+            return json.loads(raw)
+        except (TypeError, json.JSONDecodeError):
+            return []
+    # Personnel - use rate_per_hour * hours from form
+    personnel = parse_json_field(award.get('personnel_json'))
+    personnel_total = 0
+    for p in personnel:
+        if isinstance(p, dict):
+            hours_list = p.get('hours', [])
+            rate_per_hour = float(p.get('rate_per_hour', 0) or 0)
+            total_from_form = float(p.get('total', 0) or 0)
+            
+            # If total is provided, use it; otherwise calculate from hours * rate
+            if total_from_form > 0:
+                personnel_total += total_from_form
+            elif isinstance(hours_list, list) and rate_per_hour > 0:
+                total_hours = sum(float(h.get('hours', 0) or 0) for h in hours_list if isinstance(h, dict))
+                personnel_total += total_hours * rate_per_hour
+    categories['Personnel'] = personnel_total
+    
+    # Travel - use total_amount from new simplified structure
+    dom_travel = parse_json_field(award.get('domestic_travel_json'))
+    intl_travel = parse_json_field(award.get('international_travel_json'))
+    travel_total = 0
+    
+    # Handle new structure (total_amount) and old structure (flight/taxi/food)
+    for t in dom_travel + intl_travel:
+        if isinstance(t, dict):
+            # New structure: total_amount
+            total_amount = float(t.get('total_amount', 0) or 0)
+            if total_amount > 0:
+                travel_total += total_amount
+            else:
+                # Old structure fallback
+                flight = float(t.get("flight_cost") or t.get("flight") or 0)
+                taxi = float(t.get("taxi_per_day") or t.get("taxi") or 0)
+                food = float(t.get("food_lodge_per_day") or t.get("food_per_day") or t.get("food") or 0)
+                days = float(t.get("days", 0) or 0)
+                old_total = flight + (taxi + food) * days
+                if old_total > 0:
+                    travel_total += old_total
+    categories["Travel"] = travel_total
+    
+    # Materials, Equipment, and Other Direct Costs - separate by type
+    materials_json = parse_json_field(award.get('materials_json'))
+    materials_total = 0
+    equipment_total = 0
+    other_costs_total = 0
+    
+    for m in materials_json:
+        if isinstance(m, dict):
+            cost = float(m.get('cost', 0) or 0)
+            item_type = m.get('type', '')
+            
+            if item_type == 'equipment':
+                equipment_total += cost
+            elif item_type == 'other':
+                other_costs_total += cost
+            else:
+                # Regular materials
+                materials_total += cost
+    
+    categories['Materials'] = materials_total
+    categories["Equipment"] = equipment_total
+    categories['Other Direct Costs'] = other_costs_total
+    
+    # Other (remaining from total)
+    total_allocated = sum(categories.values())
+    categories['Other'] = max(0, total_award - total_allocated)
+    
+    # If no detailed breakdown, allocate everything to "Other"
+    if total_allocated == 0 and total_award > 0:
+        categories = {"Other": total_award}
+    
+    return categories
+
+
+def initialize_budget_lines(award_id, uow=None, force=False):
+    """Initialize budget_lines from award's budget breakdown.
+
+    Only recomputes when the award's budget revision differs from the one the
+    current lines were built from (or `force` is set). All categories are written
+    with a single idempotent upsert on (award_id, category).
+    Pass `uow` to write inside the caller's transaction; the caller then commits.
+    """
+    owns_uow = uow is None
+    if owns_uow:
+        uow = open_unit_of_work()
+        if uow is None:
+            return False
+    
+    try:
+        cur = uow.cur
         
-        # Materials, Equipment, and Other Direct Costs - separate by type
-        materials_json = parse_json_field(award.get('materials_json'))
-        materials_total = 0
-        equipment_total = 0
-        other_costs_total = 0
-        materials_items = []
-        equipment_items = []
-        other_costs_items = []
+        # Get award details
+        cur.execute(
+            f"""
+            SELECT amount, personnel_json, domestic_travel_json,
+                   international_travel_json, materials_json, budget_lines_revision,
+                   {BUDGET_SUBAWARDS_TOTAL_SQL}
+            FROM awards
+            WHERE award_id = %s
+            """,
+            (award_id,)
+        )
+        award = cur.fetchone()
         
-        for m in materials_json:
-            if isinstance(m, dict):
-                cost = float(m.get('cost', 0) or 0)
-                item_type = m.get('type', '')
-                
-                if item_type == 'equipment':
-                    equipment_total += cost
-                    equipment_items.append({
-                        'description': m.get('description', 'N/A'),
-                        'amount': cost
-                    })
-                elif item_type == 'other':
-                    other_costs_total += cost
-                    other_costs_items.append({
-                        'description': m.get('description', 'N/A'),
-                        'amount': cost
-                    })
-                else:
-                    # Regular materials
-                    materials_total += cost
-                    materials_items.append({
-                        'description': m.get('description', 'N/A'),
-                        'amount': cost
-                    })
+        if not award:
+            return False
         
-        categories['Materials'] = materials_total
-        categories["Equipment"] = equipment_total
-        categories['Other Direct Costs'] = other_costs_total
+        revision = award_budget_revision(award)
+        if not force and award.get('budget_lines_revision') == revision:
+            return True
         
-        # Other (remaining from total)
-        total_allocated = sum(categories.values())
-        categories['Other'] = max(0, total_award - total_allocated)
+        categories = compute_budget_allocations(award)
         
-        # If no detailed breakdown, allocate everything to "Other"
-        if total_allocated == 0 and total_award > 0:
-            categories = {"Other": total_award}
+        # Subawards total is part of the revision, so a changed subaward rebuilds the lines
+        subawards_total = float(award['subawards_total'] or 0)
+        if subawards_total > 0:
+            categories['Subawards'] = subawards_total
         
-        # Get subawards total
+        # Upsert allocated amounts (preserve spent/committed from transactions)
+        rows = [(award_id, category, amount) for category, amount in categories.items() if amount > 0]
+        if rows:
+            execute_values(
+                cur,
+                """
+                INSERT INTO budget_lines (award_id, category, allocated_amount, spent_amount, committed_amount)
+                VALUES %s
+                ON CONFLICT (award_id, category)
+                DO UPDATE SET allocated_amount = EXCLUDED.allocated_amount
+                """,
+                rows,
+                template="(%s, %s, %s, 0, 0)",
+            )
+        # Categories that dropped to nothing (e.g. the last subaward was deleted) keep their
+        # spent/committed history but no longer have an allocation
         cur.execute(
             """
-            SELECT COALESCE(SUM(amount), 0) as total_subawards
-            FROM subawards
-            WHERE award_id = %s AND status != 'Declined'
+            UPDATE budget_lines SET allocated_amount = 0
+            WHERE award_id = %s AND allocated_amount <> 0 AND NOT (category = ANY(%s))
             """,
-            (award_id,)
+            (award_id, [row[1] for row in rows])
+        )
+        cur.execute(
+            "UPDATE awards SET budget_lines_revision = %s WHERE award_id = %s",
+            (revision, award_id)
         )
-        subaward_result = cur.fetchone()
-        subawards_total = float(subaward_result['total_subawards'] or 0) if subaward_result else 0
-        if subawards_total > 0:
-            categories['Subawards'] = subawards_total
-        
-        # Insert/update budget_lines
-        for category, amount in categories.items():
-            if amount > 0:
-                # Check if exists
-                cur.execute(
-                    """
-                    SELECT line_id FROM budget_lines
-                    WHERE award_id = %s AND category = %s
-                    """,
-                    (award_id, category)
-                )
-                exists = cur.fetchone()
-                
-                if exists:
-                    # Update allocated amount (preserve spent/committed from transactions)
-                    # Recalculate remaining based on new allocated amount
-                    cur.execute(
-                        """
-                        UPDATE budget_lines
-                        SET allocated_amount = %s
-                        WHERE award_id = %s AND category = %s
-                        """,
-                        (amount, award_id, category)
-                    )
-                else:
-                    # Insert new budget line
-                    cur.execute(
-                        """
-                        INSERT INTO budget_lines (award_id, category, allocated_amount, spent_amount, committed_amount)
-                        VALUES (%s, %s, %s, 0, 0)
-                        """,
-                        (award_id, category, amount)
-                    )
-        
         
-        conn.commit()
-        cur.close()
+        if owns_uow:
+            uow.commit()
         return True
         
     except Exception as e:
         print(f"Initialize budget lines error: {e}")
-        conn.rollback()
+        if not owns_uow:
+            raise
+        uow.rollback()
         return False
     finally:
-        conn.close()
+        if owns_uow:
+            uow.close()
 
 
 @app.route("/transactions/new")
@@ -2936,13 +3512,13 @@ def transaction_new():
     if not award_id:
         return redirect(url_for("dashboard"))
     
-    # Get award details
-    conn = get_db()
+    # Get award details and budget status in one unit of work
+    uow = open_unit_of_work()
     award = None
-    if conn is not None:
+    budget_status = {}
+    if uow is not None:
         try:
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute(
+            uow.cur.execute(
                 """
                 SELECT award_id, title, amount, status
                 FROM awards
@@ -2950,12 +3526,13 @@ def transaction_new():
                 """,
                 (award_id, u["email"], u["role"])
             )
-            award = cur.fetchone()
-            cur.close()
+            award = uow.cur.fetchone()
+            if award and award['status'] == 'Approved':
+                budget_status = get_budget_status(award_id, uow=uow)
         except Exception as e:
             print(f"DB fetch award error: {e}")
         finally:
-            conn.close()
+            uow.close()
     
     if not award:
         return "Award not found", 404
@@ -2963,9 +3540,6 @@ def transaction_new():
     if award['status'] != 'Approved':
         return "Only approved awards can have transactions", 400
     
-    # Get budget status
-    budget_status = get_budget_status(award_id)
-    
     # Get error message from query parameter if present
     error_message = request.args.get("error", "")
     
@@ -3021,13 +3595,17 @@ def transaction_create():
     
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
+        uow = UnitOfWork(conn, cur)
         
-        # Verify award exists and is approved
+        # Verify award exists and is approved. The row lock serializes concurrent
+        # submissions against the same award so the budget check below stays valid
+        # until this transaction's insert commits.
         cur.execute(
             """
             SELECT award_id, status, created_by_email
             FROM awards
             WHERE award_id = %s
+            FOR UPDATE
             """,
             (award_id,)
         )
@@ -3065,7 +3643,7 @@ def transaction_create():
             transaction_category = 'Other Direct Costs'
         
         # Check budget availability (only if budget has been allocated)
-        budget_status = get_budget_status(award_id)
+        budget_status = get_budget_status(award_id, uow=uow)
         cat_budget = budget_status.get(transaction_category, {})
         allocated = cat_budget.get('allocated', 0)
         remaining = cat_budget.get('remaining', 0)
@@ -3125,96 +3703,84 @@ def transaction_create():
     return redirect(url_for("transactions_list", award_id=award_id))
 
 
+TRANSACTIONS_LIST_SQL = """
+    SELECT t.*, a.title as award_title, u.name as user_name,
+           EXISTS (
+               SELECT 1 FROM compliance_jobs j
+               WHERE j.kind = 'transaction' AND j.subject_id = t.transaction_id
+                 AND j.status IN ('queued', 'running')
+           ) AS compliance_pending
+    FROM transactions t
+    LEFT JOIN awards a ON t.award_id = a.award_id
+    LEFT JOIN users u ON t.user_id = u.user_id
+    WHERE {where}
+    ORDER BY {order}
+    LIMIT {limit}
+"""
+TRANSACTIONS_KEYSET_ORDER = [("t.date_submitted", "date_submitted"), ("t.transaction_id", "transaction_id")]
+TRAVEL_DETAIL_FIELDS = ("travel_flight", "travel_ground_transportation", "travel_lodging", "travel_meals", "travel_other")
+
+
+def transaction_list_filters():
+    """SQL filters for transaction lists from the query string: status, category, date range."""
+    filters, active = [], {}
+    status = request.args.get("status")
+    if status in TRANSACTION_STATUSES:
+        filters.append(("t.status = %s", (status,)))
+        active["status"] = status
+    category = (request.args.get("category") or "").strip()
+    if category:
+        filters.append(("t.category = %s", (category,)))
+        active["category"] = category
+    for arg, op in (("date_from", ">="), ("date_to", "<=")):
+        try:
+            value = date.fromisoformat(request.args.get(arg) or "")
+        except ValueError:
+            continue
+        filters.append((f"t.date_submitted {op} %s", (value,)))
+        active[arg] = value.isoformat()
+    return filters, active
+
+
 @app.route("/transactions")
 def transactions_list():
-    """List all transactions for an award or user."""
+    """List transactions for an award or user, one page at a time."""
     u = session.get("user")
     if not u:
         return redirect(url_for("home"))
     
     award_id = request.args.get("award_id", type=int)
+    cursor, limit = list_page_args()
+    filters, active_filters = transaction_list_filters()
     
     conn = get_db()
     transactions = []
     award = None
+    next_cursor = None
     
     if conn is not None:
         try:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             
             if award_id:
-                # Get transactions for specific award (including travel details)
-                cur.execute(
-                    """
-                    SELECT t.*, a.title as award_title, u.name as user_name,
-                           t.travel_flight, t.travel_ground_transportation, 
-                           t.travel_lodging, t.travel_meals, t.travel_other
-                    FROM transactions t
-                    LEFT JOIN awards a ON t.award_id = a.award_id
-                    LEFT JOIN users u ON t.user_id = u.user_id
-                    WHERE t.award_id = %s
-                    ORDER BY t.date_submitted DESC, t.transaction_id DESC
-                    """,
-                    (award_id,)
-                )
-                transactions = cur.fetchall()
-                # Convert travel amounts to float
-                for txn in transactions:
-                    if txn.get('travel_flight'):
-                        txn['travel_flight'] = float(txn['travel_flight'])
-                    if txn.get('travel_ground_transportation'):
-                        txn['travel_ground_transportation'] = float(txn['travel_ground_transportation'])
-                    if txn.get('travel_lodging'):
-                        txn['travel_lodging'] = float(txn['travel_lodging'])
-                    if txn.get('travel_meals'):
-                        txn['travel_meals'] = float(txn['travel_meals'])
-                    if txn.get('travel_other'):
-                        txn['travel_other'] = float(txn['travel_other'])
-                
+                # Transactions for a specific award
+                filters.insert(0, ("t.award_id = %s", (award_id,)))
+            elif u["role"] != "Admin":
+                # Transactions across the user's own awards
+                filters.insert(0, ("a.created_by_email = %s", (u["email"],)))
+            transactions, next_cursor = fetch_keyset_page(
+                cur, TRANSACTIONS_LIST_SQL, TRANSACTIONS_KEYSET_ORDER, filters, cursor, limit
+            )
+            # Convert travel amounts to float
+            for txn in transactions:
+                for field in TRAVEL_DETAIL_FIELDS:
+                    if txn.get(field):
+                        txn[field] = float(txn[field])
+            
+            if award_id:
                 # Get award details
                 cur.execute("SELECT * FROM awards WHERE award_id = %s", (award_id,))
                 award = cur.fetchone()
-            else:
-                # Get all transactions for user (including travel details)
-                if u["role"] == "Admin":
-                    cur.execute(
-                        """
-                        SELECT t.*, a.title as award_title, u.name as user_name,
-                               t.travel_flight, t.travel_ground_transportation, 
-                               t.travel_lodging, t.travel_meals, t.travel_other
-                        FROM transactions t
-                        LEFT JOIN awards a ON t.award_id = a.award_id
-                        LEFT JOIN users u ON t.user_id = u.user_id
-                        ORDER BY t.date_submitted DESC, t.transaction_id DESC
-                        """
-                    )
-                else:
-                    cur.execute(
-                        """
-                        SELECT t.*, a.title as award_title, u.name as user_name,
-                               t.travel_flight, t.travel_ground_transportation, 
-                               t.travel_lodging, t.travel_meals, t.travel_other
-                        FROM transactions t
-                        LEFT JOIN awards a ON t.award_id = a.award_id
-                        LEFT JOIN users u ON t.user_id = u.user_id
-                        WHERE a.created_by_email = %s
-                        ORDER BY t.date_submitted DESC, t.transaction_id DESC
-                        """,
-                        (u["email"],)
-                    )
-                transactions = cur.fetchall()
-                # Convert travel amounts to float
-                for txn in transactions:
-                    if txn.get('travel_flight'):
-                        txn['travel_flight'] = float(txn['travel_flight'])
-                    if txn.get('travel_ground_transportation'):
-                        txn['travel_ground_transportation'] = float(txn['travel_ground_transportation'])
-                    if txn.get('travel_lodging'):
-                        txn['travel_lodging'] = float(txn['travel_lodging'])
-                    if txn.get('travel_meals'):
-                        txn['travel_meals'] = float(txn['travel_meals'])
-                    if txn.get('travel_other'):
-                        txn['travel_other'] = float(txn['travel_other'])
             
             cur.close()
         except Exception as e:
@@ -3222,88 +3788,132 @@ def transactions_list():
         finally:
             conn.close()
     
-    return render_template("transactions_list.html", transactions=transactions, award=award, user=u)
+    return render_template(
+        "transactions_list.html", transactions=transactions, award=award, user=u,
+        filters=active_filters, pager=page_links(next_cursor),
+    )
 
 
-@app.route("/awards/<int:award_id>/budget")
-def budget_status(award_id):
-    """Show budget status dashboard for an award."""
+# ---- Ledger export ----
+# Rows come off a named (server-side) cursor EXPORT_FETCH_SIZE at a time and are
+# written straight to the response, so memory stays flat however large the ledger.
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "5000"))
+LEDGER_EXPORT_SQL = """
+    SELECT t.transaction_id, t.award_id, a.title AS award_title, a.created_by_email AS pi_email,
+           u.name AS submitted_by, t.category, t.description, t.amount, t.status, t.date_submitted,
+           t.travel_flight, t.travel_ground_transportation, t.travel_lodging, t.travel_meals, t.travel_other
+    FROM transactions t
+    LEFT JOIN awards a ON t.award_id = a.award_id
+    LEFT JOIN users u ON t.user_id = u.user_id
+    WHERE {where}
+    ORDER BY t.date_submitted, t.transaction_id
+"""
+
+
+def _ledger_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def stream_ledger_rows(conn, filters, fmt):
+    """Yield CSV or NDJSON chunks for the transactions matching `filters`, one fetch batch per chunk."""
+    cur = conn.cursor(name=f"ledger_export_{os.getpid()}_{id(conn)}")
+    cur.itersize = EXPORT_FETCH_SIZE
+    try:
+        cur.execute(
+            LEDGER_EXPORT_SQL.format(where=" AND ".join(clause for clause, _ in filters) or "TRUE"),
+            tuple(value for _, values in filters for value in values),
+        )
+        columns = None
+        buf = StringIO()
+        writer = csv.writer(buf)
+        while True:
+            rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+            if columns is None:
+                # Named cursors only fill in description after the first fetch
+                columns = [col[0] for col in cur.description]
+                if fmt == "csv":
+                    writer.writerow(columns)
+            if not rows:
+                break
+            for row in rows:
+                if fmt == "csv":
+                    writer.writerow(row)
+                else:
+                    buf.write(json.dumps(dict(zip(columns, map(_ledger_value, row)))))
+                    buf.write("\n")
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+@app.route("/transactions/export")
+def transactions_export():
+    """
+    Stream the transaction ledger as CSV (default) or NDJSON (?format=ndjson).
+    Scope: ?award_id=..., ?pi=<email> (Admin/Finance), or the whole portfolio (Admin/Finance).
+    PIs only ever get transactions on their own awards. Accepts the same status/category/date
+    filters as the transactions list.
+    """
     u = session.get("user")
     if not u:
         return redirect(url_for("home"))
     
+    fmt = (request.args.get("format") or "csv").lower()
+    if fmt not in ("csv", "ndjson"):
+        return make_response("format must be csv or ndjson", 400)
+    
+    filters, _ = transaction_list_filters()
+    award_id = request.args.get("award_id", type=int)
+    pi_email = (request.args.get("pi") or "").strip()
+    if award_id:
+        filters.insert(0, ("t.award_id = %s", (award_id,)))
+    if u["role"] not in ("Admin", "Finance"):
+        filters.insert(0, ("a.created_by_email = %s", (u["email"],)))
+    elif pi_email:
+        filters.insert(0, ("a.created_by_email = %s", (pi_email,)))
+    
     conn = get_db()
-    award = None
-    budget_status_data = {}
+    if conn is None:
+        return make_response("DB connection failed", 500)
     
-    if conn is not None:
+    def generate():
         try:
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute(
-                """
-                SELECT * FROM awards
-                WHERE award_id = %s AND (created_by_email = %s OR %s = 'Admin')
-                """,
-                (award_id, u["email"], u["role"])
-            )
-            award = cur.fetchone()
-            cur.close()
+            yield from stream_ledger_rows(conn, filters, fmt)
         except Exception as e:
-            print(f"DB fetch award error: {e}")
+            # Headers are already sent, so the best we can do is log and cut the stream short
+            print(f"Ledger export error: {e}")
         finally:
             conn.close()
     
-    if not award:
-        return "Award not found", 404
-    
-    # Initialize/recalculate budget lines if award is approved
-    # This ensures budget always matches the current form data
-    if award['status'] == 'Approved':
-        # Always recalculate from form data - it will update allocated amounts
-        initialize_budget_lines(award_id)
-    
-    budget_status_data = get_budget_status(award_id)
-    
-    # ---- SUBAWARD COMMITTED AND SPENT AMOUNTS ----
-    conn = get_db()
-    subaward_committed = 0.0
-    subaward_spent = 0.0
+    scope = f"award_{award_id}" if award_id else "portfolio"
+    filename = f"transactions_{scope}_{date.today().isoformat()}.{'csv' if fmt == 'csv' else 'ndjson'}"
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv" if fmt == "csv" else "application/x-ndjson",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            # Don't let a reverse proxy buffer the whole export before sending it on
+            "X-Accel-Buffering": "no",
+        },
+    )
 
-    if conn is not None:
-        try:
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            # Committed = Approved subawards (not yet paid)
-            cur.execute(
-                """
-                SELECT COALESCE(SUM(amount), 0) AS subaward_total
-                FROM subawards
-                WHERE award_id = %s
-                  AND status = 'Approved'
-                """,
-                (award_id,)
-            )
-            row = cur.fetchone()
-            subaward_committed = float(row["subaward_total"]) if row else 0.0
-            
-            # Spent = Paid subawards
-            cur.execute(
-                """
-                SELECT COALESCE(SUM(amount), 0) AS subaward_total
-                FROM subawards
-                WHERE award_id = %s
-                  AND status = 'Paid'
-                """,
-                (award_id,)
-            )
-            row = cur.fetchone()
-            subaward_spent = float(row["subaward_total"]) if row else 0.0
-            
-            cur.close()
-        except Exception as e:
-            print(f"DB fetch subaward total error: {e}")
-        finally:
-            conn.close()
 
+@app.route("/awards/<int:award_id>/budget")
+def budget_status(award_id):
+    """Show budget status dashboard for an award."""
+    u = session.get("user")
+    if not u:
+        return redirect(url_for("home"))
+    
     # Helper function to parse JSON fields
     def parse_json_field(raw):
         if not raw:
@@ -3315,8 +3925,14 @@ def budget_status(award_id):
         except (TypeError, json.JSONDecodeError):
             return []
     
-    # Get detailed items for each category
-    conn = get_db()
+    uow = open_unit_of_work()
+    if uow is None:
+        return "Award not found", 404
+    
+    award = None
+    budget_status_data = {}
+    subaward_committed = 0.0
+    subaward_spent = 0.0
     personnel_items = []
     travel_items = []
     materials_items = []
@@ -3324,18 +3940,62 @@ def budget_status(award_id):
     other_costs_items = []
     subawards_list = []
     
-    if conn is not None:
+    # Everything below runs on one connection inside one transaction
+    with uow:
+        cur = uow.cur
         try:
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            
-            # Personnel items
-            personnel_json = parse_json_field(award.get('personnel_json'))
-            for p in personnel_json:
-                if isinstance(p, dict):
-                    hours_list = p.get('hours', [])
-                    rate_per_hour = float(p.get('rate_per_hour', 0) or 0)
-                    total_from_form = float(p.get('total', 0) or 0)
-                    
+            cur.execute(
+                """
+                SELECT * FROM awards
+                WHERE award_id = %s AND (created_by_email = %s OR %s = 'Admin')
+                """,
+                (award_id, u["email"], u["role"])
+            )
+            award = cur.fetchone()
+        except Exception as e:
+            print(f"DB fetch award error: {e}")
+            uow.rollback()
+        
+        if not award:
+            return "Award not found", 404
+        
+        # budget_lines are recomputed on award_edit/award_approve only; this page never writes
+        try:
+            budget_status_data = get_budget_status(award_id, uow=uow)
+        except Exception:
+            uow.rollback()
+            budget_status_data = {}
+        
+        # ---- SUBAWARD COMMITTED AND SPENT AMOUNTS ----
+        try:
+            # Committed = Approved subawards (not yet paid), Spent = Paid subawards
+            cur.execute(
+                """
+                SELECT COALESCE(SUM(amount) FILTER (WHERE status = 'Approved'), 0) AS committed_total,
+                       COALESCE(SUM(amount) FILTER (WHERE status = 'Paid'), 0) AS paid_total
+                FROM subawards
+                WHERE award_id = %s
+                """,
+                (award_id,)
+            )
+            row = cur.fetchone()
+            if row:
+                subaward_committed = float(row["committed_total"])
+                subaward_spent = float(row["paid_total"])
+        except Exception as e:
+            print(f"DB fetch subaward total error: {e}")
+            uow.rollback()
+        
+        # Get detailed items for each category
+        try:
+            # Personnel items
+            personnel_json = parse_json_field(award.get('personnel_json'))
+            for p in personnel_json:
+                if isinstance(p, dict):
+                    hours_list = p.get('hours', [])
+                    rate_per_hour = float(p.get('rate_per_hour', 0) or 0)
+                    total_from_form = float(p.get('total', 0) or 0)
+                    
                     if total_from_form > 0:
                         total = total_from_form
                     elif isinstance(hours_list, list) and rate_per_hour > 0:
@@ -3418,12 +4078,9 @@ def budget_status(award_id):
                 'committed': subaward_committed_calc,
                 'remaining': max(0, subaward_remaining)
             }
-            
-            cur.close()
         except Exception as e:
             print(f"DB fetch items error: {e}")
-        finally:
-            conn.close()
+            uow.rollback()
     
     # Calculate totals (ensure all are floats)
     # Spent = paid expenses (paid transactions + paid subawards)
@@ -3479,7 +4136,7 @@ def transaction_approve(transaction_id):
     
     This moves the transaction from Pending to Approved status.
     Approved transactions are in COMMITTED (not spent) until payment is processed.
-    Policy compliance is checked before approval.
+    Policy compliance is checked asynchronously by the compliance job queue.
     """
     u = session.get("user")
     if not u or u.get("role") not in ("Admin", "Finance"):
@@ -3514,35 +4171,17 @@ def transaction_approve(transaction_id):
         if txn['award_status'] != 'Approved':
             return "Award must be approved", 400
         
-        # Check policy compliance before approval
-        award_data = {
-            'title': txn.get('title', ''),
-            'sponsor_type': txn.get('sponsor_type', ''),
-            'amount': txn.get('award_amount', 0),
-            'start_date': txn.get('start_date', ''),
-            'end_date': txn.get('end_date', '')
-        }
-        compliance_results = check_transaction_compliance(txn, award_data)
-        
-        # Store compliance results as JSON
-        compliance_json = json.dumps(compliance_results)
-        
-        # Check if any policy is non-compliant
-        has_non_compliant = any(
-            result.get('result') == 'non-compliant' 
-            for result in compliance_results.values() 
-            if isinstance(result, dict)
-        )
-        
-        # Update transaction status to Approved and store compliance notes
+        # Update transaction status to Approved. The policy compliance check runs
+        # in the background; its verdict lands in compliance_notes when it completes.
         cur.execute(
             """
             UPDATE transactions 
-            SET status = 'Approved', compliance_notes = %s
+            SET status = 'Approved'
             WHERE transaction_id = %s
             """,
-            (compliance_json, transaction_id)
+            (transaction_id,)
         )
+        enqueue_compliance_job(cur, "transaction", transaction_id)
         
         # Map transaction category to budget category
         txn_category = txn['category'] or 'Other'
@@ -3592,10 +4231,6 @@ def transaction_approve(transaction_id):
         conn.commit()
         cur.close()
         
-        # If non-compliant, warn but still allow approval (admin decision)
-        if has_non_compliant:
-            print(f"WARNING: Transaction {transaction_id} approved despite non-compliant policy check")
-        
     except Exception as e:
         print(f"DB approve transaction error: {e}")
         import traceback
@@ -3825,58 +4460,59 @@ def profile():
     u = session.get("user")
     if not u:
         return redirect(url_for("home"))
+    cursor, limit = list_page_args()
+    filters, active_filters = award_list_filters()
+    # Admin: see all awards; PI: only their own
+    scope = [] if u["role"] == "Admin" else [("a.created_by_email = %s", (u["email"],))]
     awards = []
+    next_cursor = None
+    stats = {"total_awards": 0, "active_awards": 0, "latest_award": None}
     conn = get_db()
     if conn is not None:
         try:
             cur = conn.cursor(cursor_factory=RealDictCursor)
-            if u["role"] == "Admin":
-                # Admin: see all awards
-                cur.execute(
-                    """
-                    SELECT award_id, title, sponsor_type, amount, start_date, end_date, status, created_at
-                    FROM awards
-                    ORDER BY created_at DESC
-                    """
-                )
-            else:
-                # PI: only their own awards
-                cur.execute(
-                    """
-                    SELECT award_id, title, sponsor_type, amount, start_date, end_date, status, created_at
-                    FROM awards
-                    WHERE created_by_email=%s
-                    ORDER BY created_at DESC
-                    """,
-                    (u["email"],),
-                )
-            awards = cur.fetchall()
+            awards, next_cursor = fetch_keyset_page(
+                cur,
+                """
+                SELECT award_id, title, sponsor_type, amount, start_date, end_date, status, created_at
+                FROM awards a
+                WHERE {where}
+                ORDER BY {order}
+                LIMIT {limit}
+                """,
+                AWARDS_KEYSET_ORDER,
+                scope + filters,
+                cursor,
+                limit,
+            )
+            # Stats cover every award in scope, not just the page being shown
+            cur.execute(
+                "SELECT COUNT(*) AS total_awards, COUNT(*) FILTER (WHERE status = 'Approved') AS active_awards "
+                "FROM awards a WHERE " + (" AND ".join(clause for clause, _ in scope) or "TRUE"),
+                tuple(value for _, values in scope for value in values),
+            )
+            stats.update(cur.fetchone())
+            latest, _ = fetch_keyset_page(
+                cur,
+                "SELECT award_id, title, sponsor_type, amount, start_date, end_date, status, created_at "
+                "FROM awards a WHERE {where} ORDER BY {order} LIMIT {limit}",
+                AWARDS_KEYSET_ORDER,
+                scope,
+                limit=1,
+            )
+            stats["latest_award"] = latest[0] if latest else None
             cur.close()
         except Exception as e:
             print(f"DB fetch awards (profile) error: {e}")
         finally:
             conn.close()
-    stats = {
-        "total_awards": len(awards),
-        "active_awards": sum(
-            1 for a in awards
-            if (a.get("status") or "").lower() == "approved"
-        ),
-        "latest_award": awards[0] if awards else None,
-    }
 
-    return render_template("profile.html", user=u, awards=awards, stats=stats)
+    return render_template("profile.html", user=u, awards=awards, stats=stats,
+                           filters=active_filters, pager=page_links(next_cursor))
 
 
-def parse_policy_file(filepath):
-    """Parse a policy text file and extract key summary points."""
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-    except Exception as e:
-        print(f"Error reading policy file {filepath}: {e}")
-        return None
-    
+def parse_policy_text(content):
+    """Extract the title and key summary points from a policy file's text."""
     lines = content.split('\n')
     
     # Extract title (first non-empty line)
@@ -3961,47 +4597,24 @@ def university_policies():
     """Display all policies from the policy files."""
     u = session.get("user")
     
-    # Parse all three policy files
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    policy_files = [
-        {
-            "file": os.path.join(base_dir, "policies", "federal_policy.txt"),
-            "level": "Federal",
-            "order": 1
-        },
-        {
-            "file": os.path.join(base_dir, "policies", "sponsor_policy.txt"),
-            "level": "Sponsor",
-            "order": 2
-        },
-        {
-            "file": os.path.join(base_dir, "policies", "university_policy.txt"),
-            "level": "University",
-            "order": 3
-        }
-    ]
-    
     policy_data = []
-    for pf in policy_files:
-        parsed = parse_policy_file(pf["file"])
-        if parsed:
+    for order, (key, level) in enumerate([("federal", "Federal"), ("sponsor", "Sponsor"), ("university", "University")], 1):
+        doc = policy_store.get(key)
+        if doc:
+            parsed = doc["summary"]
             # Clean up sponsor policy title
             title = parsed["title"]
             if "SPONSOR POLICY" in title.upper():
                 title = "SPONSOR POLICY"
             
             policy_data.append({
-                "level": pf["level"],
+                "level": level,
                 "title": title,
                 "description": parsed["description"],
                 "key_points": parsed["key_points"],
-                "order": pf["order"]
+                "order": order
             })
     
-    # Sort by order
-    policy_data.sort(key=lambda x: x["order"])
-    
     return render_template("policies_university.html", policies=policy_data, user=u or {})
 
 
@@ -4013,596 +4626,2907 @@ def logout():
 
 # ========== LLM POLICY COMPLIANCE CHECKING ==========
 
-def read_policy_file(policy_name):
-    """Read policy text from file."""
-    policy_path = os.path.join("policies", f"{policy_name}_policy.txt")
+# The three policy levels are independent, so they are sent to the LLM concurrently
+# and an admin waits for the slowest call rather than the sum of all three.
+POLICY_LEVELS = [
+    ("university", "University"),
+    ("federal", "Federal"),
+    ("sponsor", "Sponsor"),
+]
+POLICY_PRIORITY_NOTES = {
+    "Federal": "NOTE: Federal policy has HIGHEST PRIORITY. Any violation must result in 'non-compliant'.",
+    "Sponsor": "NOTE: Sponsor policy must follow Federal requirements. Check both Federal and Sponsor rules.",
+    "University": "NOTE: University policy is lowest priority but must still be followed. Check if it conflicts with Federal/Sponsor rules.",
+}
+# Compliance prompts are laid out static instructions first, then one policy level's text,
+# then the award/transaction data. Providers serve long identical prompt prefixes from
+# their prompt cache (OpenAI from 1,024 tokens), so nothing request-specific goes above
+# the policy text. Cached prompt tokens are logged per call in llm_responses.
+COMPLIANCE_SYSTEM_PROMPT = "You are a policy compliance officer. Provide comprehensive, human-like explanations that explain policy compliance in context. Always respond with valid JSON only."
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")  # gpt-4o-mini for cost efficiency
+# Any OpenAI-compatible endpoint, e.g. benchmarks/mock_llm.py for offline load tests;
+# unset uses the SDK default (OPENAI_BASE_URL or api.openai.com)
+LLM_BASE_URL = os.getenv("LLM_BASE_URL") or None
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "30"))
+COMPLIANCE_WORKERS = int(os.getenv("COMPLIANCE_WORKERS", "6"))
+compliance_executor = ThreadPoolExecutor(max_workers=COMPLIANCE_WORKERS, thread_name_prefix="compliance")
+# "per-level" sends one request per policy level; "combined" sends every level that
+# needs the LLM in a single request and gets the verdicts back through a JSON schema.
+# benchmarks/bench_compliance_modes.py compares the two on tokens, latency and agreement.
+COMPLIANCE_MODE = os.getenv("COMPLIANCE_MODE", "per-level")
+
+# One OpenAI client per process so every call reuses its keep-alive connection pool.
+# Transient failures (connection errors, 408/409/429/5xx) are retried with jittered
+# exponential backoff, honoring Retry-After, within LLM_CALL_TIMEOUT overall. After
+# LLM_BREAKER_FAILURES consecutive transient failures the breaker opens and calls fail
+# fast for LLM_BREAKER_COOLDOWN seconds, then a single probe call decides whether it closes.
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))  # first retry delay, doubles each attempt
+LLM_RETRY_BACKOFF_MAX = float(os.getenv("LLM_RETRY_BACKOFF_MAX", "8"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+LLM_RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+LLM_LATENCY_SAMPLES = 500
+# Every provider call is logged to llm_responses; prices are USD per million tokens
+LLM_CALL_LOG_ENABLED = os.getenv("LLM_CALL_LOG", "on").lower() not in ("off", "0", "false")
+LLM_PRICE_INPUT_PER_MTOK = float(os.getenv("LLM_PRICE_INPUT_PER_MTOK", "0.15"))
+LLM_PRICE_OUTPUT_PER_MTOK = float(os.getenv("LLM_PRICE_OUTPUT_PER_MTOK", "0.60"))
+# Prompt tokens the provider served from its prompt cache are billed at this rate instead
+LLM_PRICE_CACHED_INPUT_PER_MTOK = float(os.getenv("LLM_PRICE_CACHED_INPUT_PER_MTOK", "0.075"))
+LLM_DECISIONS = ("compliant", "non-compliant", "unknown")
+# Every process (web workers, job runners) draws from one token bucket per model in
+# llm_rate_buckets, refilled continuously at the per-minute budgets. A call costs one
+# request plus its estimated prompt tokens and max_tokens, the way the provider counts
+# it. A 429 from the provider empties the bucket so every process backs off together.
+# If the database is unreachable calls go through unthrottled for a while.
+LLM_RATE_LIMIT_ENABLED = os.getenv("LLM_RATE_LIMIT", "on").lower() not in ("off", "0", "false")
+LLM_RATE_LIMIT_RPM = float(os.getenv("LLM_RATE_LIMIT_RPM", "500"))
+LLM_RATE_LIMIT_TPM = float(os.getenv("LLM_RATE_LIMIT_TPM", "200000"))
+LLM_RATE_LIMIT_BUCKET = os.getenv("LLM_RATE_LIMIT_BUCKET") or LLM_MODEL
+LLM_RATE_LIMIT_POLL_MAX = 2.0  # longest single sleep while waiting for budget
+LLM_RATE_LIMIT_BYPASS = 30.0  # seconds to skip the shared limiter after a database error
+
+
+class LLMUnavailable(Exception):
+    """Raised without calling the provider while the circuit breaker is open."""
+
+
+class LLMRateLimited(LLMUnavailable):
+    """Raised when the shared rate limit can't admit a call before its deadline."""
+
+
+class LLMRateLimiter:
+    """
+    Client side of the shared llm_rate_buckets token bucket. acquire() blocks until the
+    bucket can pay for a call; waits are counted here (this process) and in the bucket
+    row (all processes).
+    """
+
+    def __init__(self, bucket, rpm, tpm):
+        self.bucket = bucket
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        self._metrics = Counter()
+        self._waits = deque(maxlen=LLM_LATENCY_SAMPLES)  # seconds per acquire, including zero waits
+        self._bypass_until = 0.0
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._metrics[name] += n
+
+    def _bypass(self):
+        print(f"LLM rate limiter unavailable, not throttling for {LLM_RATE_LIMIT_BYPASS:.0f}s")
+        with self._lock:
+            self._metrics["bypassed"] += 1
+            self._bypass_until = time.monotonic() + LLM_RATE_LIMIT_BYPASS
+
+    def _try_take(self, cost, waited):
+        """
+        Take one request and cost tokens if the bucket has them. Returns seconds until it
+        would, 0.0 once taken, or None if the database is unavailable.
+        """
+        conn = get_detached_db()
+        if conn is None:
+            return None
+        try:
+            cur = conn.cursor()
+            select = """
+                SELECT requests, tokens, EXTRACT(EPOCH FROM clock_timestamp() - updated_at)
+                FROM llm_rate_buckets WHERE name = %s FOR UPDATE
+            """
+            cur.execute(select, (self.bucket,))
+            row = cur.fetchone()
+            if row is None:
+                # First call against this bucket: it starts full
+                cur.execute(
+                    "INSERT INTO llm_rate_buckets (name, requests, tokens) VALUES (%s, %s, %s) ON CONFLICT (name) DO NOTHING",
+                    (self.bucket, self.rpm, self.tpm),
+                )
+                cur.execute(select, (self.bucket,))
+                row = cur.fetchone()
+            requests, tokens, elapsed = row
+            requests = min(self.rpm, requests + float(elapsed) * self.rpm / 60)
+            tokens = min(self.tpm, tokens + float(elapsed) * self.tpm / 60)
+            if requests >= 1 and tokens >= cost:
+                cur.execute(
+                    """
+                    UPDATE llm_rate_buckets
+                    SET requests = %s, tokens = %s, updated_at = clock_timestamp(),
+                        granted = granted + 1, waited = waited + %s, wait_ms = wait_ms + %s
+                    WHERE name = %s
+                    """,
+                    (requests - 1, tokens - cost, 1 if waited else 0, int(waited * 1000), self.bucket),
+                )
+                shortfall = 0.0
+            else:
+                shortfall = max((1 - requests) * 60 / self.rpm, (cost - tokens) * 60 / self.tpm)
+            conn.commit()
+            cur.close()
+            return shortfall
+        except Exception as e:
+            print(f"LLM rate limiter error: {e}")
+            conn.rollback()
+            return None
+        finally:
+            conn.close()
+
+    def acquire(self, cost, deadline):
+        """Wait for budget for one call of cost tokens. Returns seconds waited; raises LLMRateLimited at deadline."""
+        if time.monotonic() < self._bypass_until:
+            return 0.0
+        cost = min(cost, self.tpm)  # a call bigger than the whole budget waits for a full bucket
+        start = time.monotonic()
+        waited = 0.0
+        while True:
+            shortfall = self._try_take(cost, waited)
+            if shortfall is None:
+                self._bypass()
+                return 0.0
+            if shortfall == 0.0:
+                with self._lock:
+                    self._metrics["acquired"] += 1
+                    if waited:
+                        self._metrics["waited"] += 1
+                    self._waits.append(waited)
+                return waited
+            # Jitter keeps waiting processes from polling the row in lockstep
+            delay = min(shortfall, LLM_RATE_LIMIT_POLL_MAX) * random.uniform(1.0, 1.2)
+            if time.monotonic() + delay >= deadline:
+                self._count("timeouts")
+                raise LLMRateLimited(f"LLM rate limit ({self.rpm:.0f} requests, {self.tpm:.0f} tokens per minute) "
+                                     f"left no budget within the call deadline")
+            time.sleep(delay)
+            waited = time.monotonic() - start
+
+    def drain(self):
+        """Empty the shared bucket after the provider answered 429."""
+        if time.monotonic() < self._bypass_until:
+            return
+        conn = get_detached_db()
+        if conn is None:
+            return
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE llm_rate_buckets SET requests = 0, tokens = 0, updated_at = clock_timestamp() WHERE name = %s",
+                (self.bucket,),
+            )
+            conn.commit()
+            cur.close()
+            self._count("drains")
+        except Exception as e:
+            print(f"LLM rate limiter error: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+
+    def stats(self):
+        """This process's acquire counters and wait times, plus the shared bucket row."""
+        with self._lock:
+            waits = sorted(self._waits)
+            metrics = dict(self._metrics)
+
+        def pct(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 1) if waits else None
+
+        shared = None
+        conn = get_detached_db()
+        if conn is not None:
+            try:
+                cur = conn.cursor(cursor_factory=RealDictCursor)
+                cur.execute("SELECT * FROM llm_rate_buckets WHERE name = %s", (self.bucket,))
+                shared = cur.fetchone()
+                cur.close()
+                conn.rollback()
+            except Exception as e:
+                print(f"Error reading LLM rate bucket: {e}")
+                conn.rollback()
+            finally:
+                conn.close()
+        return {
+            "bucket": self.bucket,
+            "requests_per_minute": self.rpm,
+            "tokens_per_minute": self.tpm,
+            "counters": metrics,
+            "wait_ms": {"samples": len(waits), "p50": pct(0.5), "p95": pct(0.95),
+                        "max": round(waits[-1] * 1000, 1) if waits else None},
+            "shared": shared,
+        }
+
+
+def _retry_after_seconds(error):
+    """Seconds the provider asked us to wait, from Retry-After(-ms) headers, or None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
     try:
-        with open(policy_path, "r", encoding="utf-8") as f:
-            return f.read()
-    except FileNotFoundError:
-        print(f"Policy file not found: {policy_path}")
-        return ""
-    except Exception as e:
-        print(f"Error reading policy file {policy_path}: {e}")
-        return ""
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass  # HTTP-date form: fall back to our own backoff
+    return None
+
+
+class LLMClient:
+    """Process-wide OpenAI client with retries, a circuit breaker and latency/error counters."""
+
+    def __init__(self, api_key):
+        # Retries are ours (see complete()), so the SDK's own are turned off
+        self._client = OpenAI(api_key=api_key, base_url=LLM_BASE_URL, max_retries=0, timeout=LLM_CALL_TIMEOUT)
+        self._lock = threading.Lock()
+        self._metrics = Counter()
+        self._latencies = deque(maxlen=LLM_LATENCY_SAMPLES)  # seconds, successful attempts only
+        self._consecutive_failures = 0
+        self._opened_at = None  # monotonic time the breaker opened; None while closed
+        self._probing = False
+        self.rate_limiter = (LLMRateLimiter(LLM_RATE_LIMIT_BUCKET, LLM_RATE_LIMIT_RPM, LLM_RATE_LIMIT_TPM)
+                             if LLM_RATE_LIMIT_ENABLED else None)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._metrics[name] += n
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self._opened_at < LLM_BREAKER_COOLDOWN else "half-open"
+
+    def _admit(self):
+        """Whether an attempt may go out now; in half-open state only one probe at a time."""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._probing:
+                self._probing = True
+                return True
+            self._metrics["fast_failures"] += 1
+            return False
 
+    def _record(self, ok, elapsed=None):
+        with self._lock:
+            self._probing = False
+            if ok:
+                if elapsed is not None:
+                    self._latencies.append(elapsed)
+                if self._opened_at is not None:
+                    print("LLM circuit breaker closed")
+                self._consecutive_failures = 0
+                self._opened_at = None
+                return
+            self._consecutive_failures += 1
+            if self._opened_at is not None or self._consecutive_failures >= LLM_BREAKER_FAILURES:
+                if self._opened_at is None:
+                    print(f"LLM circuit breaker opened after {self._consecutive_failures} consecutive failures")
+                    self._metrics["breaker_opens"] += 1
+                self._opened_at = time.monotonic()
+
+    def complete(self, **kwargs):
+        """
+        chat.completions.create() with retries, each attempt paid for from the shared rate
+        limit. Raises LLMUnavailable while the breaker is open, LLMRateLimited when the
+        rate limit has no budget before the deadline.
+        """
+        deadline = time.monotonic() + kwargs.pop("timeout", LLM_CALL_TIMEOUT)
+        cost = sum(approx_token_count(m.get("content") or "") for m in kwargs.get("messages", []))
+        cost += kwargs.get("max_tokens") or 0
+        self._count("requests")
+        attempt = 0
+        while True:
+            if not self._admit():
+                raise LLMUnavailable(f"LLM provider unavailable; circuit breaker open for up to {LLM_BREAKER_COOLDOWN:.0f}s")
+            if self.rate_limiter is not None:
+                try:
+                    self.rate_limiter.acquire(cost, deadline)
+                except LLMRateLimited:
+                    with self._lock:
+                        self._probing = False
+                        self._metrics["rate_limited"] += 1
+                    raise
+            self._count("attempts")
+            start = time.monotonic()
+            try:
+                response = self._client.chat.completions.create(timeout=max(1.0, deadline - start), **kwargs)
+            except APIStatusError as e:
+                retryable = e.status_code in LLM_RETRY_STATUSES
+                self._count(f"status_{e.status_code}")
+                if e.status_code == 429 and self.rate_limiter is not None:
+                    self.rate_limiter.drain()
+                error = e
+            except APIConnectionError as e:
+                retryable = True
+                self._count("timeouts" if isinstance(e, APITimeoutError) else "connection_errors")
+                error = e
+            else:
+                self._record(True, time.monotonic() - start)
+                return response
+            if not retryable:
+                # The provider answered; a bad request says nothing about its health
+                self._record(True)
+                raise error
+            self._record(False)
+            backoff = random.uniform(0, min(LLM_RETRY_BACKOFF * 2 ** attempt, LLM_RETRY_BACKOFF_MAX))
+            delay = max(_retry_after_seconds(error) or 0, backoff)
+            attempt += 1
+            if attempt > LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+                self._count("gave_up")
+                raise error
+            self._count("retries")
+            time.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            state = self._state()
+            metrics = dict(self._metrics)
+            failures = self._consecutive_failures
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1) if latencies else None
 
-def format_award_for_llm(award, personnel, domestic_travel, international_travel, materials, equipment=None, other_direct=None):
-    """Format award data into a structured text for LLM analysis."""
-    
-    # Calculate personnel budget from personnel data
-    personnel_budget = 0.0
-    if personnel:
-        for p in personnel:
-            if isinstance(p, dict):
-                # Use total if provided, otherwise calculate from hours * rate
-                total_from_form = float(p.get('total', 0) or 0)
-                if total_from_form > 0:
-                    personnel_budget += total_from_form
-                else:
-                    hours_list = p.get('hours', [])
-                    rate_per_hour = float(p.get('rate_per_hour', 0) or 0)
-                    if isinstance(hours_list, list) and rate_per_hour > 0:
-                        total_hours = sum(float(h.get('hours', 0) or 0) for h in hours_list if isinstance(h, dict))
-                        personnel_budget += total_hours * rate_per_hour
-    
-    # Calculate travel budget
-    travel_budget = 0.0
-    if domestic_travel:
-        for t in domestic_travel:
-            if isinstance(t, dict):
-                total_amount = float(t.get('total_amount', 0) or 0)
-                if total_amount > 0:
-                    travel_budget += total_amount
-    if international_travel:
-        for t in international_travel:
-            if isinstance(t, dict):
-                total_amount = float(t.get('total_amount', 0) or 0)
-                if total_amount > 0:
-                    travel_budget += total_amount
-    
-    # Calculate equipment budget from equipment_json
-    equipment_budget = 0.0
-    if equipment:
-        for e in equipment:
-            if isinstance(e, dict):
-                cost = float(e.get('cost', 0) or 0)
-                equipment_budget += cost
-    
-    # Calculate materials budget from materials_json
-    materials_budget = 0.0
-    if materials:
-        for m in materials:
-            if isinstance(m, dict):
-                cost = float(m.get('cost', 0) or 0)
-                materials_budget += cost
-    
-    # Calculate other direct costs budget
-    other_direct_budget = 0.0
-    if other_direct:
-        for o in other_direct:
-            if isinstance(o, dict):
-                cost = float(o.get('cost', 0) or 0)
-                other_direct_budget += cost
-    
-    award_text = f"""
-AWARD INFORMATION:
-- Title: {award.get('title', 'N/A')}
-- Sponsor Type: {award.get('sponsor_type', 'N/A')}
-- Total Amount: ${float(award.get('amount', 0) or 0):,.2f}
-- Start Date: {award.get('start_date', 'N/A')}
-- End Date: {award.get('end_date', 'N/A')}
-- Department: {award.get('department', 'N/A')}
-- College: {award.get('college', 'N/A')}
+        return {
+            "breaker": state,
+            "consecutive_failures": failures,
+            "rate_limit": self.rate_limiter.stats() if self.rate_limiter is not None else None,
+            "counters": metrics,
+            "latency_ms": {
+                "samples": len(latencies),
+                "p50": pct(0.5),
+                "p95": pct(0.95),
+                "max": round(latencies[-1] * 1000, 1) if latencies else None,
+            },
+        }
 
-BUDGET BREAKDOWN (TOTALS - for reference only):
-- Personnel Budget: ${personnel_budget:,.2f}
-- Equipment Budget: ${equipment_budget:,.2f}
-- Travel Budget: ${travel_budget:,.2f}
-- Materials Budget: ${materials_budget:,.2f}
-- Other Direct Costs Budget: ${other_direct_budget:,.2f}
 
-IMPORTANT: The budget totals above are for reference. Policy compliance is checked PER ITEM, not by total budget.
-Equipment items are checked individually against $8,000 per item.
-Materials items are checked individually against $5,000 per item.
-Travel is checked per trip against $5,000 per trip.
-"""
-    
-    if personnel:
-        award_text += "\nPERSONNEL DETAILS:\n"
-        for p in personnel:
-            if isinstance(p, dict):
-                name = p.get('name', 'Unknown')
-                role = p.get('position', 'N/A') or p.get('role', 'N/A')
-                hours_list = p.get('hours', [])
-                rate_per_hour = float(p.get('rate_per_hour', 0) or 0)
-                total_from_form = float(p.get('total', 0) or 0)
-                
-                total_hours = 0
-                if isinstance(hours_list, list):
-                    for h in hours_list:
-                        if isinstance(h, dict):
-                            total_hours += float(h.get('hours', 0) or 0)
-                
-                # Calculate total if not provided
-                if total_from_form > 0:
-                    personnel_total = total_from_form
-                elif total_hours > 0 and rate_per_hour > 0:
-                    personnel_total = total_hours * rate_per_hour
-                else:
-                    personnel_total = 0
-                
-                award_text += f"- {name} ({role}): {total_hours} hours"
-                if rate_per_hour > 0:
-                    award_text += f", Rate: ${rate_per_hour:,.2f}/hour"
-                if personnel_total > 0:
-                    award_text += f", Total: ${personnel_total:,.2f}"
-                award_text += "\n"
-    
-    if domestic_travel:
-        award_text += "\nDOMESTIC TRAVEL:\n"
-        for t in domestic_travel:
-            if isinstance(t, dict):
-                description = t.get('description', 'N/A')
-                total_amount = float(t.get('total_amount', 0) or 0)
-                if total_amount > 0:
-                    award_text += f"- {description}: Total Estimated Amount: ${total_amount:,.2f}\n"
-                else:
-                    # Fallback to old format if total_amount not available
-                    flight = t.get('flight', 0) or t.get('flight_cost', 0)
-                    taxi = t.get('taxi', 0) or t.get('taxi_per_day', 0)
-                    food = t.get('food', 0) or t.get('food_per_day', 0)
-                    days = t.get('days', 0) or t.get('num_days', 0)
-                    award_text += f"- {description}: Flight: ${float(flight or 0):,.2f}, Taxi/day: ${float(taxi or 0):,.2f}, Food/day: ${float(food or 0):,.2f}, Days: {days}\n"
-    
-    if international_travel:
-        award_text += "\nINTERNATIONAL TRAVEL:\n"
-        for t in international_travel:
-            if isinstance(t, dict):
-                description = t.get('description', 'N/A')
-                total_amount = float(t.get('total_amount', 0) or 0)
-                if total_amount > 0:
-                    award_text += f"- {description}: Total Estimated Amount: ${total_amount:,.2f}\n"
-                else:
-                    # Fallback to old format if total_amount not available
-                    flight = t.get('flight', 0) or t.get('flight_cost', 0)
-                    taxi = t.get('taxi', 0) or t.get('taxi_per_day', 0)
-                    food = t.get('food', 0) or t.get('food_per_day', 0)
-                    days = t.get('days', 0) or t.get('num_days', 0)
-                    award_text += f"- {description}: Flight: ${float(flight or 0):,.2f}, Taxi/day: ${float(taxi or 0):,.2f}, Food/day: ${float(food or 0):,.2f}, Days: {days}\n"
-    
-    if equipment:
-        award_text += "\nEQUIPMENT (Section 2 - $8,000 per item threshold):\n"
-        for e in equipment:
-            if isinstance(e, dict):
-                description = e.get('description', 'N/A')
-                cost = float(e.get('cost', 0) or 0)
-                award_text += f"- Item: {description}, Cost: ${cost:,.2f} (check if this INDIVIDUAL item exceeds $8,000)\n"
-        award_text += "NOTE: Check each equipment item INDIVIDUALLY against the $8,000 per item threshold. Do NOT sum all equipment items.\n"
-    
-    if materials:
-        award_text += "\nMATERIALS & SUPPLIES (Section 4 - $5,000 per item threshold):\n"
-        for m in materials:
-            if isinstance(m, dict):
-                description = m.get('description', 'N/A')
-                cost = float(m.get('cost', 0) or 0)
-                award_text += f"- Item: {description}, Cost: ${cost:,.2f} (check if this INDIVIDUAL item exceeds $5,000)\n"
-        award_text += "NOTE: Check each materials item INDIVIDUALLY against the $5,000 per item threshold. Do NOT sum all materials items.\n"
-    
-    if other_direct:
-        award_text += "\nOTHER DIRECT COSTS:\n"
-        for o in other_direct:
-            if isinstance(o, dict):
-                description = o.get('description', 'N/A')
-                cost = float(o.get('cost', 0) or 0)
-                award_text += f"- {description}, Cost: ${cost:,.2f}\n"
-    
-    return award_text
+_llm_client = {"pid": None, "client": None, "api_key": None}
+_llm_client_lock = threading.Lock()
 
 
-def check_policy_compliance(award, personnel, domestic_travel, international_travel, materials, equipment=None, other_direct=None):
-    """
-    Check award compliance against University, Sponsor, and Federal policies using LLM.
-    Returns a dict with compliance results for each policy level.
-    """
-    # Read policy files
-    university_policy = read_policy_file("university")
-    federal_policy = read_policy_file("federal")
-    sponsor_policy = read_policy_file("sponsor")
-    
-    # Format award data
-    award_text = format_award_for_llm(award, personnel, domestic_travel, international_travel, materials, equipment, other_direct)
-    
-    # Get OpenAI API key from environment
+def get_llm_client():
+    """This process's shared LLMClient, or None when OPENAI_API_KEY isn't set."""
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
-        return {
-            "error": "OpenAI API key not configured",
-            "university": {"result": "unknown", "reason": "API key missing"},
-            "federal": {"result": "unknown", "reason": "API key missing"},
-            "sponsor": {"result": "unknown", "reason": "API key missing"}
-        }
-    
-    # Initialize OpenAI client
-    client = OpenAI(api_key=api_key)
-    
-    results = {}
-    
-    # Check each policy level
-    policy_checks = [
-        ("university", "University", university_policy),
-        ("federal", "Federal", federal_policy),
-        ("sponsor", "Sponsor", sponsor_policy)
-    ]
-    
-    for key, name, policy_text in policy_checks:
-        if not policy_text:
-            results[key] = {"result": "unknown", "reason": f"{name} policy text not available"}
-            continue
-        
-        try:
-            # Determine priority level for context
-            priority_note = ""
-            if name == "Federal":
-                priority_note = "NOTE: Federal policy has HIGHEST PRIORITY. Any violation must result in 'non-compliant'."
-            elif name == "Sponsor":
-                priority_note = "NOTE: Sponsor policy must follow Federal requirements. Check both Federal and Sponsor rules."
-            elif name == "University":
-                priority_note = "NOTE: University policy is lowest priority but must still be followed. Check if it conflicts with Federal/Sponsor rules."
-            
-            prompt = f"""You are an AI Policy Compliance Officer for a Post-Award Research Budget Management System.
+        return None
+    with _llm_client_lock:
+        # A forked worker must not share its parent's sockets
+        if _llm_client["pid"] != os.getpid() or _llm_client["api_key"] != api_key:
+            _llm_client.update(pid=os.getpid(), api_key=api_key, client=LLMClient(api_key))
+        return _llm_client["client"]
 
-Your job is to check whether a research award complies with {name} policy.
+# Verdict cache: an in-process LRU in front of the compliance_cache table. Bump
+# COMPLIANCE_PROMPT_VERSION whenever prompt wording or response parsing changes.
+COMPLIANCE_PROMPT_VERSION = "1"
+COMPLIANCE_CACHE_ENABLED = os.getenv("COMPLIANCE_CACHE", "on").lower() not in ("off", "0", "false")
+COMPLIANCE_CACHE_SIZE = int(os.getenv("COMPLIANCE_CACHE_SIZE", "1024"))
+COMPLIANCE_CACHE_TTL = int(os.getenv("COMPLIANCE_CACHE_TTL", str(7 * 24 * 3600)))
 
-CRITICAL: You must base every decision ONLY on the policy text provided. Do not assume or invent any rules.
 
-{priority_note}
+class ComplianceCache:
+    """
+    Two-tier cache of LLM verdicts keyed by compliance_cache_key(). Only definitive
+    verdicts (compliant/non-compliant) are stored, never errors or timeouts.
+    """
 
-═══════════════════════════════════════════════════════════════════════════════
-CRITICAL RULE: THRESHOLDS ARE PER ITEM, NOT TOTAL
-═══════════════════════════════════════════════════════════════════════════════
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at monotonic, result)
+        self._lock = threading.Lock()
+        self._metrics = Counter()
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._metrics[name] += n
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return dict(entry[1])  # callers may annotate their copy
+
+    def _put_local(self, key, result, ttl=None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_many(self, keys):
+        """{key: result} for every key found in memory or Postgres (expired rows are ignored)."""
+        found = {}
+        for key in keys:
+            result = self._get_local(key)
+            if result is not None:
+                found[key] = result
+        self._count("memory_hits", len(found))
+        missing = [key for key in keys if key not in found]
+        if missing:
+            for key, (result, ttl) in self._get_db(missing).items():
+                found[key] = result
+                self._put_local(key, result, ttl)
+                self._count("db_hits")
+        self._count("misses", len(keys) - len(found))
+        return found
+
+    def _get_db(self, keys):
+        conn = get_detached_db()
+        if conn is None:
+            return {}
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                UPDATE compliance_cache
+                SET hit_count = hit_count + 1, last_hit_at = CURRENT_TIMESTAMP
+                WHERE cache_key = ANY(%s) AND expires_at > CURRENT_TIMESTAMP
+                RETURNING cache_key, result, EXTRACT(EPOCH FROM expires_at - CURRENT_TIMESTAMP)
+                """,
+                (list(keys),),
+            )
+            rows = cur.fetchall()
+            conn.commit()
+            cur.close()
+            return {key: (result, float(ttl)) for key, result, ttl in rows}
+        except Exception as e:
+            print(f"Compliance cache read error: {e}")
+            return {}
+        finally:
+            conn.close()
 
-Equipment and Materials & Supplies are COMPLETELY SEPARATE categories with DIFFERENT thresholds:
-- Equipment has a threshold of $8,000 PER ITEM (Section 2 in policies)
-- Materials & Supplies has a threshold of $5,000 PER ITEM (Section 4 in policies)
-- These categories must be evaluated INDEPENDENTLY. Do NOT combine their costs.
-- An equipment item over $8,000 violates Equipment policy, NOT Materials policy.
-- A materials item over $5,000 violates Materials policy, NOT Equipment policy.
-- IMPORTANT: The threshold is PER ITEM, NOT the total. Each individual item must be checked separately.
-- For example: If you have 3 materials items costing $2,000, $1,500, and $1,800, they are ALL compliant because each is under $5,000 per item.
-- The TOTAL of all items in a category does NOT need to be under the threshold - only each INDIVIDUAL item.
-- Do NOT add up all equipment items and check against $8,000 - check each equipment item individually.
-- Do NOT add up all materials items and check against $5,000 - check each materials item individually.
+    def put_many(self, entries):
+        """Store [(key, policy_level, model, result)]; non-definitive results are skipped."""
+        entries = [e for e in entries if isinstance(e[3], dict) and e[3].get("result") in ("compliant", "non-compliant")]
+        if not entries:
+            return
+        for key, _, _, result in entries:
+            self._put_local(key, result)
+        self._count("stores", len(entries))
+        conn = get_detached_db()
+        if conn is None:
+            return
+        try:
+            cur = conn.cursor()
+            execute_values(
+                cur,
+                """
+                INSERT INTO compliance_cache (cache_key, policy_level, model, result, expires_at)
+                VALUES %s
+                ON CONFLICT (cache_key) DO UPDATE
+                SET result = EXCLUDED.result, created_at = CURRENT_TIMESTAMP, expires_at = EXCLUDED.expires_at
+                """,
+                [(key, level, model, json.dumps(result), self.ttl) for key, level, model, result in entries],
+                template="(%s, %s, %s, %s::jsonb, CURRENT_TIMESTAMP + make_interval(secs => %s))",
+            )
+            conn.commit()
+            cur.close()
+        except Exception as e:
+            print(f"Compliance cache write error: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
 
-EXAMPLE OF CORRECT EVALUATION:
-- If Materials section shows: Item A = $2,000, Item B = $1,500, Item C = $1,800
-  → ALL THREE ITEMS ARE COMPLIANT (each is under $5,000 per item)
-  → The total ($5,300) does NOT matter - only individual items matter
-  
-- If Materials section shows: Item A = $2,000, Item B = $6,000
-  → Item A is COMPLIANT ($2,000 < $5,000)
-  → Item B is NON-COMPLIANT ($6,000 > $5,000 per item threshold)
-  → Report Item B as the violation, NOT the total
+    def clear_local(self):
+        with self._lock:
+            self._entries.clear()
 
-WRONG: "Materials total $8,500 exceeds $5,000 threshold" ❌
-RIGHT: "Each materials item is checked individually. Item X costs $6,200 which exceeds $5,000 per item threshold" ✅
+    def stats(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+            size = len(self._entries)
+        lookups = metrics.get("memory_hits", 0) + metrics.get("db_hits", 0) + metrics.get("misses", 0)
+        hits = lookups - metrics.get("misses", 0)
+        return {
+            "enabled": COMPLIANCE_CACHE_ENABLED,
+            "memory_entries": size,
+            "memory_max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "memory_hits": metrics.get("memory_hits", 0),
+            "db_hits": metrics.get("db_hits", 0),
+            "misses": metrics.get("misses", 0),
+            "stores": metrics.get("stores", 0),
+            "hit_rate": round(hits / lookups, 4) if lookups else None,
+        }
 
-═══════════════════════════════════════════════════════════════════════════════
-CRITICAL RULE: INTERNATIONAL TRAVEL MUST MENTION "FLY AMERICA ACT"
-═══════════════════════════════════════════════════════════════════════════════
 
-For ALL international travel entries:
-- The description field MUST explicitly contain the text "Fly America Act" (case-insensitive).
-- If an international travel description does NOT contain "Fly America Act", the award is NON-COMPLIANT.
-- This is a mandatory requirement - if "Fly America Act" is missing from the description, the travel request violates policy.
-- Check each international travel entry individually - if ANY international travel entry lacks "Fly America Act" in its description, the award is non-compliant.
+compliance_cache = ComplianceCache(COMPLIANCE_CACHE_SIZE, COMPLIANCE_CACHE_TTL)
 
-Example of compliant international travel description:
-- "Attending conference in Paris. Fly America Act compliance confirmed."
-- "Research collaboration in Tokyo following Fly America Act requirements."
 
-Example of NON-COMPLIANT international travel description:
-- "Attending conference in Paris" (missing Fly America Act mention)
-- "Research collaboration in Tokyo" (missing Fly America Act mention)
+def compliance_cache_key(level, prompt, model=None):
+    """Content hash of one policy-level check; the prompt embeds the policy text and the formatted award/transaction."""
+    material = json.dumps(
+        [COMPLIANCE_PROMPT_VERSION, model or LLM_MODEL, level, COMPLIANCE_SYSTEM_PROMPT, prompt],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def parse_compliance_response(response_text):
+    """Parse the LLM's JSON verdict, tolerating a surrounding markdown code block."""
+    response_text = response_text.strip()
+    if response_text.startswith("```"):
+        response_text = response_text.split("```")[1]
+        if response_text.startswith("json"):
+            response_text = response_text[4:]
+        response_text = response_text.strip()
+    return json.loads(response_text)
+
+
+def llm_call_record(name, prompt, elapsed, result=None, error=None, model=None, usage=None):
+    """One llm_responses row (minus award/transaction/route) for a finished or failed call."""
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    # Providers without prompt caching leave prompt_tokens_details out
+    cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+    cost = None
+    if usage is not None:
+        cost = (((prompt_tokens or 0) - (cached_tokens or 0)) * LLM_PRICE_INPUT_PER_MTOK
+                + (cached_tokens or 0) * LLM_PRICE_CACHED_INPUT_PER_MTOK
+                + (completion_tokens or 0) * LLM_PRICE_OUTPUT_PER_MTOK) / 1_000_000
+    decision = result.get("result") if isinstance(result, dict) else None
+    return {
+        "policy_level": name.lower(),
+        "model": model or LLM_MODEL,
+        "prompt_hash": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cached_tokens": cached_tokens,
+        "latency_ms": int(elapsed * 1000),
+        "cost_usd": cost,
+        "llm_decision": decision if decision in LLM_DECISIONS else None,
+        "reason": result.get("reason") if isinstance(result, dict) else None,
+        "error": error,
+    }
 
-═══════════════════════════════════════════════════════════════════════════════
 
-POLICY TEXT:
-{policy_text}
+def record_llm_calls(calls, award_id=None, transaction_id=None):
+    """Insert llm_call_record() rows in one statement; award_id/transaction_id fill rows that lack them."""
+    if not calls or not LLM_CALL_LOG_ENABLED:
+        return
+    route = request.endpoint if has_request_context() else "background"
+    conn = get_detached_db()
+    if conn is None:
+        return
+    try:
+        cur = conn.cursor()
+        execute_values(
+            cur,
+            """
+            INSERT INTO llm_responses (award_id, transaction_id, route, policy_level, model, prompt_hash,
+                                       prompt_tokens, completion_tokens, cached_tokens, latency_ms, cost_usd,
+                                       llm_decision, reason, error)
+            VALUES %s
+            """,
+            [(c.get("award_id", award_id), c.get("transaction_id", transaction_id), route, c["policy_level"],
+              c["model"], c["prompt_hash"], c["prompt_tokens"], c["completion_tokens"], c["cached_tokens"],
+              c["latency_ms"], c["cost_usd"], c["llm_decision"], c["reason"], c["error"]) for c in calls],
+        )
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print(f"Error recording LLM calls: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
 
-AWARD DATA:
-{award_text}
 
-Analyze the award against the {name} policy above. Provide a comprehensive, human-like assessment that:
-1. Explains WHY the award is compliant or non-compliant based on policy requirements
-2. References specific policy sections and requirements
-3. For compliant items: Explain that it follows policy guidelines, meets requirements, and does not violate any rules
-4. For non-compliant items: Clearly state what policy is violated and why
-5. Avoid simply stating budget thresholds (e.g., "below $5000") - instead explain policy compliance in context
-6. CRITICALLY: Evaluate Equipment and Materials & Supplies as SEPARATE categories with their respective thresholds ($8,000 for Equipment, $5,000 for Materials & Supplies)
-7. MOST IMPORTANT: Check each item INDIVIDUALLY. The threshold is PER ITEM, NOT the total. For example:
-   - If you have 5 materials items costing $1,000 each, they are ALL compliant (each is under $5,000)
-   - If you have 1 materials item costing $6,000, it is NON-COMPLIANT (exceeds $5,000 per item)
-   - Do NOT add up all items in a category and check the total - check EACH item separately
-   - Equipment total and Materials total are separate - do NOT combine them
-8. MANDATORY: For international travel, check that each description explicitly contains "Fly America Act" (case-insensitive). If ANY international travel entry lacks "Fly America Act" in its description, the award is NON-COMPLIANT. This is a mandatory requirement - missing "Fly America Act" means the travel request violates policy.
+def partial_json_string(text, field):
+    """
+    The value of string field `field` decoded from a JSON object that may still be
+    arriving (the closing quote and anything after it can be missing), or None.
+    """
+    match = re.search(r'"%s"\s*:\s*"' % re.escape(field), text)
+    if not match:
+        return None
+    raw = []
+    i = match.end()
+    while i < len(text) and text[i] != '"':
+        if text[i] == "\\":
+            width = 6 if text[i + 1:i + 2] == "u" else 2
+            if i + width > len(text):
+                break  # escape sequence not complete yet
+            raw.append(text[i:i + width])
+            i += width
+        else:
+            raw.append(text[i])
+            i += 1
+    try:
+        return json.loads('"' + "".join(raw) + '"')
+    except ValueError:
+        return None
+
+
+def _check_policy_level(client, name, prompt, max_tokens=600, response_format=None, call_log=None, on_reason=None):
+    """
+    One blocking LLM call for one policy level. Never raises; errors become an 'unknown'
+    result. With call_log, an llm_call_record() for the call is appended to it. With
+    on_reason, the response is streamed and on_reason(text) gets each new piece of the
+    "reason" field as it arrives.
+    """
+    response_text = error = model = usage = None
+    extra = {"response_format": response_format} if response_format else {}
+    if on_reason is not None:
+        extra.update(stream=True, stream_options={"include_usage": True})
+    start = time.monotonic()
+    try:
+        response = client.complete(
+            model=LLM_MODEL,
+            messages=[
+                {"role": "system", "content": COMPLIANCE_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.4,  # Slightly higher for more natural language
+            max_tokens=max_tokens,  # 600 leaves room for comprehensive explanations
+            timeout=LLM_CALL_TIMEOUT,
+            **extra,
+        )
+        if on_reason is None:
+            model, usage = response.model, response.usage
+            response_text = response.choices[0].message.content
+        else:
+            parts, sent = [], 0
+            for chunk in response:
+                model = chunk.model or model
+                usage = chunk.usage or usage  # only the final chunk carries usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    reason = partial_json_string("".join(parts), "reason") or ""
+                    if len(reason) > sent:
+                        on_reason(reason[sent:])
+                        sent = len(reason)
+            response_text = "".join(parts)
+        result = parse_compliance_response(response_text)
+    except json.JSONDecodeError as e:
+        print(f"Error parsing JSON response for {name} policy: {e}")
+        print(f"Response was: {response_text if response_text is not None else 'No response received'}")
+        error = f"Error parsing LLM response: {str(e)}"
+    except LLMUnavailable as e:
+        # Failed fast without reaching the provider, so there is no call to log
+        return {"result": "unknown", "reason": str(e)}
+    except Exception as e:
+        print(f"Error checking {name} policy compliance: {e}")
+        import traceback
+        traceback.print_exc()
+        error = f"Error: {str(e)}"
+    if error is not None:
+        result = {"result": "unknown", "reason": error}
+    if call_log is not None:
+        call_log.append(llm_call_record(name, prompt, time.monotonic() - start, result, error, model, usage))
+    return result
+
+
+def combined_verdict_schema(keys):
+    """Structured-output schema for one request that returns a verdict per policy level."""
+    verdict = {
+        "type": "object",
+        "properties": {
+            "result": {"type": "string", "enum": ["compliant", "non-compliant", "unknown"]},
+            "reason": {"type": "string"},
+        },
+        "required": ["result", "reason"],
+        "additionalProperties": False,
+    }
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "policy_verdicts",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {key: verdict for key in keys},
+                "required": list(keys),
+                "additionalProperties": False,
+            },
+        },
+    }
+
 
-Your output must be a JSON object in this exact format:
+def build_combined_prompt(build_prompt, levels):
+    """
+    One prompt covering several policy levels. levels is a list of
+    (key, name, policy_text, rule_note); each level's policy text is labelled so the
+    model can cite it, and the output section asks for one verdict per key.
+    """
+    names = [name for _, name, _, _ in levels]
+    combined_name = ", ".join(names[:-1]) + " and " + names[-1]
+    sections = []
+    for key, name, policy_text, rule_note in levels:
+        sections.append(f"""--- {name.upper()} POLICY (verdict key "{key}") ---
+{POLICY_PRIORITY_NOTES.get(name, "")}
+
+{policy_text}{rule_note}""")
+    priority_note = ("NOTE: Evaluate each policy level SEPARATELY against its own policy text below and give each its own verdict. "
+                     "Federal policy has HIGHEST PRIORITY, Sponsor policy must follow Federal requirements, and University policy is lowest priority.")
+    keys = ", ".join(f'"{key}"' for key, _, _, _ in levels)
+    output_format = f"""Your output must be a JSON object with exactly these keys: {keys}.
+Each key holds that policy level's verdict in this format:
 {{
   "result": "compliant" | "non-compliant" | "unknown",
-  "reason": "Comprehensive explanation that reads naturally, explains policy compliance, references specific policy sections, and explains why the award follows or violates policy requirements. Write as if explaining to a colleague, not just listing thresholds."
+  "reason": "Comprehensive explanation for that policy level only, referencing its policy sections. Write as if explaining to a colleague, not just listing thresholds."
 }}
 
-Example of good explanation for compliant: "This award complies with {name} policy requirements. The personnel expenses are within acceptable limits per person per year as specified in Section 1, and all listed personnel directly contribute to project aims. Travel expenses follow policy guidelines for research-related travel and do not exceed per-trip thresholds. All international travel entries explicitly mention 'Fly America Act' in their descriptions, demonstrating compliance with federal travel requirements. Each equipment item is individually checked and all are under the $8,000 per item threshold. Each materials item is individually checked and all are under the $5,000 per item threshold. The award follows all applicable rules and does not violate any policy restrictions."
-
-Example of good explanation for non-compliant: "This award violates {name} policy in Section 3 (Travel). The international travel entry for 'Conference in Paris' does not mention 'Fly America Act' in its description, which is a mandatory requirement for all international travel as specified in the policy. International travel must explicitly reference Fly America Act compliance in the description to demonstrate adherence to federal travel regulations. Additionally, one equipment item (High-Performance Workstation) costs $9,500, which exceeds the $8,000 per item threshold without prior approval as required by policy. Note: This is checked per item, not by total equipment budget. These violations must be addressed before approval."
-
 Only return the JSON object, nothing else."""
+    return build_prompt(combined_name, "\n\n".join(sections), priority_note, output_format)
 
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",  # Using gpt-4o-mini for cost efficiency
-                messages=[
-                    {"role": "system", "content": "You are a policy compliance officer. Provide comprehensive, human-like explanations that explain policy compliance in context. Always respond with valid JSON only."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.4,  # Slightly higher for more natural language
-                max_tokens=600  # Increased for more comprehensive explanations
-            )
-            
-            # Parse JSON response
-            response_text = response.choices[0].message.content.strip()
-            # Remove markdown code blocks if present
-            if response_text.startswith("```"):
-                response_text = response_text.split("```")[1]
-                if response_text.startswith("json"):
-                    response_text = response_text[4:]
-                response_text = response_text.strip()
-            
-            compliance_result = json.loads(response_text)
-            results[key] = compliance_result
-            
-        except json.JSONDecodeError as e:
-            print(f"Error parsing JSON response for {name} policy: {e}")
-            response_text_str = response_text if 'response_text' in locals() else "No response received"
-            print(f"Response was: {response_text_str}")
-            results[key] = {"result": "unknown", "reason": f"Error parsing LLM response: {str(e)}"}
-        except Exception as e:
-            print(f"Error checking {name} policy compliance: {e}")
-            import traceback
-            traceback.print_exc()
-            results[key] = {"result": "unknown", "reason": f"Error: {str(e)}"}
-    
+
+def _split_combined_verdicts(response, keys):
+    """Per-level results from one combined response; a level the model left out is 'unknown'."""
+    results = {}
+    for key in keys:
+        verdict = response.get(key)
+        if isinstance(verdict, dict) and "result" in verdict:
+            results[key] = verdict
+        elif set(response) == {"result", "reason"}:
+            # The call itself failed (see _check_policy_level): every level gets the same error
+            results[key] = response
+        else:
+            results[key] = {"result": "unknown", "reason": "No verdict returned for this policy level"}
     return results
 
 
-def check_transaction_compliance(transaction, award):
-    """
-    Check transaction compliance against University, Sponsor, and Federal policies using LLM.
-    Returns a dict with compliance results for each policy level.
-    """
-    # Read policy files
-    university_policy = read_policy_file("university")
-    federal_policy = read_policy_file("federal")
-    sponsor_policy = read_policy_file("sponsor")
-    
-    # Format transaction data for LLM
-    transaction_text = f"""
-Transaction Details:
-- Category: {transaction.get('category', 'N/A')}
-- Description: {transaction.get('description', 'N/A')}
-- Amount: ${transaction.get('amount', 0):,.2f}
-- Date Submitted: {transaction.get('date_submitted', 'N/A')}
+# An LLM call is given LLM_CALL_TIMEOUT from the moment a compliance worker starts it,
+# plus a short grace for the thread to hand back its result, so time spent queued
+# behind other calls on the shared executor doesn't count against it. Calls that never
+# get a worker are given up on once the queue could have drained: one call timeout per
+# round of COMPLIANCE_WORKERS calls submitted together.
+LLM_CALL_GRACE = 5
+LLM_DEADLINE_POLL = 1.0  # seconds between deadline checks while waiting for results
 
-Award Context:
-- Title: {award.get('title', 'N/A')}
-- Sponsor: {award.get('sponsor_type', 'N/A')}
-- Amount: ${award.get('amount', 0):,.2f}
-- Start Date: {award.get('start_date', 'N/A')}
-- End Date: {award.get('end_date', 'N/A')}
-"""
-    
-    # Get OpenAI API key from environment
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        return {
-            "error": "OpenAI API key not configured",
-            "university": {"result": "unknown", "reason": "API key missing"},
-            "federal": {"result": "unknown", "reason": "API key missing"},
-            "sponsor": {"result": "unknown", "reason": "API key missing"}
-        }
-    
-    # Initialize OpenAI client
-    client = OpenAI(api_key=api_key)
-    
-    results = {}
-    
-    # Check each policy level
-    policy_checks = [
-        ("university", "University", university_policy),
-        ("federal", "Federal", federal_policy),
-        ("sponsor", "Sponsor", sponsor_policy)
-    ]
-    
-    for key, name, policy_text in policy_checks:
-        if not policy_text:
-            results[key] = {"result": "unknown", "reason": f"{name} policy text not available"}
-            continue
-        
-        try:
-            # Determine priority level for context
-            priority_note = ""
-            if name == "Federal":
-                priority_note = "NOTE: Federal policy has HIGHEST PRIORITY. Any violation must result in 'non-compliant'."
-            elif name == "Sponsor":
-                priority_note = "NOTE: Sponsor policy must follow Federal requirements. Check both Federal and Sponsor rules."
-            elif name == "University":
-                priority_note = "NOTE: University policy is lowest priority but must still be followed. Check if it conflicts with Federal/Sponsor rules."
-            
-            prompt = f"""You are an AI Policy Compliance Officer for a Post-Award Research Budget Management System.
 
-Your job is to check whether a TRANSACTION (spending request) complies with {name} policy.
+def submit_llm_call(executor, fn, *args, **kwargs):
+    """executor.submit() that records in future.started["at"] when the call began running."""
+    started = {"at": None}
 
-CRITICAL: You must base every decision ONLY on the policy text provided. Do not assume or invent any rules.
+    def run():
+        started["at"] = time.monotonic()
+        return fn(*args, **kwargs)
 
+    future = executor.submit(run)
+    future.started = started
+    return future
+
+
+def llm_queue_deadline(calls):
+    """Latest time any of `calls` calls submitted together now may still be waiting for a worker."""
+    rounds = math.ceil(calls / max(COMPLIANCE_WORKERS, 1))
+    return time.monotonic() + rounds * (LLM_CALL_TIMEOUT + LLM_CALL_GRACE)
+
+
+def expired_llm_calls(futures, queue_deadline):
+    """The unfinished submit_llm_call() futures that are past their deadline."""
+    now = time.monotonic()
+    expired = set()
+    for future in futures:
+        if future.done():
+            continue
+        started = future.started["at"]
+        deadline = queue_deadline if started is None else started + LLM_CALL_TIMEOUT + LLM_CALL_GRACE
+        if now >= deadline:
+            expired.add(future)
+    return expired
+
+
+def iter_policy_checks(client, build_prompt, line_items=None, executor=None, use_cache=COMPLIANCE_CACHE_ENABLED,
+                       award_id=None, transaction_id=None, stream_reasons=False, policy_scope=None):
+    """
+    Evaluate every policy level, yielding events as they happen:
+    ("verdict", key, result) once per level, as soon as that level is decided;
+    ("reason", key, text) for each new piece of a level's reason while it is generated
+    (only with stream_reasons, and only for per-level requests); ("error", None, message)
+    when no client is configured.
+
+    Levels the deterministic rules can decide from line_items never reach the LLM.
+    build_prompt(name, policy_text, priority_note, output_format=None) returns the user
+    prompt for the rest, which run concurrently, or, with COMPLIANCE_MODE=combined,
+    together in one request; levels whose exact prompt was answered before come from the
+    verdict cache. A level whose call hasn't finished within LLM_CALL_TIMEOUT of starting
+    comes back as 'unknown'. With no client, levels that need the LLM are 'unknown'. Every LLM call
+    is logged against award_id/transaction_id. policy_scope=(categories, query) narrows
+    the policy text in prompts to policy_excerpt(); None sends whole documents.
+    """
+    executor = executor or compliance_executor
+    pending = []
+    no_client = False
+    for key, name in POLICY_LEVELS:
+        doc = policy_store.get(key)
+        if not doc or not doc["text"]:
+            yield "verdict", key, {"result": "unknown", "reason": f"{name} policy text not available"}
+            continue
+        policy_text = policy_excerpt(doc, *policy_scope) if policy_scope else doc["text"]
+        rule_note = ""
+        if line_items is not None:
+            violations, escalate = evaluate_policy_rules(doc["rules"], line_items)
+            verdict = rule_verdict(name, violations, escalate, len(line_items))
+            if verdict is not None:
+                yield "verdict", key, verdict
+                continue
+            rule_note = ("\n\nAUTOMATED PRE-CHECK: every per-item dollar limit and the Fly America Act description rule "
+                         "were checked in code and passed. Focus on: " + "; ".join(escalate) + ".")
+        if client is None:
+            no_client = True
+            yield "verdict", key, {"result": "unknown", "reason": "API key missing"}
+            continue
+        pending.append((key, name, policy_text, rule_note))
+    if no_client:
+        yield "error", None, "OpenAI API key not configured"
+
+    # Each request is (levels it answers, label, prompt, extra _check_policy_level kwargs)
+    if COMPLIANCE_MODE == "combined" and len(pending) > 1:
+        keys = [key for key, _, _, _ in pending]
+        requests = [(keys, "Combined", build_combined_prompt(build_prompt, pending),
+                     {"max_tokens": 600 * len(keys), "response_format": combined_verdict_schema(keys)})]
+    else:
+        requests = [([key], name, build_prompt(name, policy_text, POLICY_PRIORITY_NOTES.get(name, "")) + rule_note, {})
+                    for key, name, policy_text, rule_note in pending]
+
+    # Identical prompts were already answered: serve those from the cache. Combined
+    # verdicts are cached under their own keys so the two modes never mix.
+    cache_keys = {}
+    for keys, _, prompt, _ in requests:
+        for key in keys:
+            cache_keys[key] = compliance_cache_key(key if len(keys) == 1 else f"{key}@combined", prompt)
+    cached = compliance_cache.get_many(list(cache_keys.values())) if use_cache and cache_keys else {}
+
+    # Worker threads report through one queue: finished futures, and reason text as it streams
+    events = queue.Queue()
+    futures = {}
+    calls = []
+    for keys, name, prompt, kwargs in requests:
+        if all(cache_keys[key] in cached for key in keys):
+            for key in keys:
+                yield "verdict", key, cached[cache_keys[key]]
+            continue
+        if stream_reasons and len(keys) == 1:
+            kwargs = dict(kwargs, on_reason=lambda text, key=keys[0]: events.put(("reason", key, text)))
+        future = submit_llm_call(executor, _check_policy_level, client, name, prompt, call_log=calls, **kwargs)
+        futures[future] = keys
+        future.add_done_callback(events.put)
+
+    fresh = []
+    remaining = set(futures)
+    queue_deadline = llm_queue_deadline(len(futures))
+    try:
+        while remaining:
+            for future in expired_llm_calls(remaining, queue_deadline):
+                remaining.discard(future)
+                future.cancel()
+                for key in futures[future]:
+                    print(f"{key} policy check timed out after {LLM_CALL_TIMEOUT:.0f}s")
+                    yield "verdict", key, {"result": "unknown", "reason": f"Policy check timed out after {LLM_CALL_TIMEOUT:.0f}s"}
+            if not remaining:
+                break
+            try:
+                event = events.get(timeout=LLM_DEADLINE_POLL)
+            except queue.Empty:
+                continue
+            if isinstance(event, tuple):
+                yield event
+                continue
+            if event not in remaining:
+                continue  # finished after it was given up on
+            remaining.discard(event)
+            keys = futures[event]
+            verdicts = {keys[0]: event.result()} if len(keys) == 1 else _split_combined_verdicts(event.result(), keys)
+            for key in keys:
+                fresh.append((key, verdicts[key]))
+                yield "verdict", key, verdicts[key]
+    finally:
+        # Runs even if a streaming client disconnects part way through
+        for future in remaining:
+            future.cancel()
+        if use_cache:
+            compliance_cache.put_many([
+                (cache_keys[key], key, LLM_MODEL, verdict) for key, verdict in fresh
+            ])
+        # Calls still running past the timeout finish unlogged
+        record_llm_calls(list(calls), award_id=award_id, transaction_id=transaction_id)
+
+
+def run_policy_checks(client, build_prompt, line_items=None, executor=None, use_cache=COMPLIANCE_CACHE_ENABLED,
+                      award_id=None, transaction_id=None, policy_scope=None):
+    """
+    iter_policy_checks() collected into {level key: result}, in POLICY_LEVELS order,
+    plus an "error" key when no client is configured.
+    """
+    return collect_policy_results(iter_policy_checks(client, build_prompt, line_items, executor, use_cache,
+                                                     award_id, transaction_id, policy_scope=policy_scope))
+
+
+def collect_policy_results(events):
+    """Policy-check events collected into {level key: result} in POLICY_LEVELS order (plus "error")."""
+    results = {}
+    for kind, key, value in events:
+        if kind == "verdict":
+            results[key] = value
+        elif kind == "error":
+            results["error"] = value
+    ordered = {key: results[key] for key, _ in POLICY_LEVELS}
+    if "error" in results:
+        ordered["error"] = results["error"]
+    return ordered
+
+
+# ---- Policy store ----
+# Policy files are read and parsed once per process. Each file is re-stat'ed at most
+# every POLICY_RELOAD_INTERVAL seconds and reloaded when its mtime or size changes,
+# so edits go live without a restart.
+POLICIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "policies")
+POLICY_RELOAD_INTERVAL = float(os.getenv("POLICY_RELOAD_INTERVAL", "2"))
+
+
+def approx_token_count(text):
+    """Rough prompt-token estimate (about four characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+
+POLICY_HEADING_RE = re.compile(r"^[A-Z][A-Z0-9 /()&:,-]{3,}$")
+
+
+def split_policy_sections(text):
+    """
+    Numbered sections ("1. Personnel & Salary Charges") with their text, budget category
+    and token count. Text outside the numbered sequence (the preamble, headed notes such
+    as POLICY HIERARCHY) becomes unnumbered "general" sections.
+    """
+    sections = []
+    current = None
+    for line in text.splitlines():
+        match = RULE_SECTION_RE.match(line)
+        expected = 1 + max([s["number"] for s in sections if s["number"] is not None], default=0)
+        if match and int(match.group(1)) == expected and (current is None or current["number"] is not None or expected == 1):
+            current = {"number": expected, "title": match.group(2), "lines": [line]}
+            sections.append(current)
+        elif current is None or (POLICY_HEADING_RE.match(line.strip()) and current["number"] is not None):
+            current = {"number": None, "title": line.strip(), "lines": [line]}
+            sections.append(current)
+        else:
+            current["lines"].append(line)
+    result = []
+    for s in sections:
+        section_text = "\n".join(s.pop("lines")).strip()
+        if section_text:
+            s.update(text=section_text, tokens=approx_token_count(section_text),
+                     category=policy_section_category(s["title"]) if s["number"] is not None else "general")
+            result.append(s)
+    return result
+
+
+POLICY_SECTION_RETRIEVAL = os.getenv("POLICY_SECTION_RETRIEVAL", "on").lower() not in ("off", "0", "false")
+POLICY_SECTION_TOP_K = int(os.getenv("POLICY_SECTION_TOP_K", "1"))
+POLICY_SECTION_MIN_SCORE = float(os.getenv("POLICY_SECTION_MIN_SCORE", "2.0"))
+# Sections that apply to every kind of charge
+POLICY_GENERAL_SECTION_TERMS = ("documentation", "recordkeeping")
+POLICY_TERM_RE = re.compile(r"[a-z0-9]+")
+POLICY_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or per that the this to with "
+    "not no any all must may only under over than".split()
+)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def policy_section_category(title):
+    """Budget category a numbered section governs: a RULE_SECTION_CATEGORIES value, "general" or None."""
+    title = title.lower()
+    for word, category in RULE_SECTION_CATEGORIES:
+        if word in title:
+            return category
+    if any(word in title for word in POLICY_GENERAL_SECTION_TERMS):
+        return "general"
+    return None
+
+
+def policy_terms(text):
+    """Lower-cased index terms, stop words dropped and plural -s folded."""
+    terms = []
+    for word in POLICY_TERM_RE.findall(text.lower()):
+        if len(word) < 2 or word in POLICY_STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+class PolicySectionIndex:
+    """BM25 over the numbered sections of one policy document."""
+
+    def __init__(self, sections):
+        self.sections = [s for s in sections if s["number"] is not None]
+        self.term_counts = [Counter(policy_terms(s["text"])) for s in self.sections]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 1.0
+        doc_freq = Counter(term for counts in self.term_counts for term in counts)
+        n = len(self.sections)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    def search(self, query, limit=None):
+        """[(score, section)] best first; sections sharing no term with query are left out."""
+        terms = set(policy_terms(query))
+        scored = []
+        for section, counts, length in zip(self.sections, self.term_counts, self.lengths):
+            score = 0.0
+            for term in terms:
+                tf = counts.get(term)
+                if tf:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.avg_length)
+                    score += self.idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+            if score > 0:
+                scored.append((score, section))
+        scored.sort(key=lambda entry: -entry[0])
+        return scored[:limit] if limit else scored
+
+
+def policy_excerpt(doc, categories, query=""):
+    """
+    The part of a policy document one check needs: its general text and the sections for
+    the given budget categories, in document order, then up to POLICY_SECTION_TOP_K other
+    sections that best match query. The query-dependent part comes last so excerpts for
+    one category share a prefix. The whole text when retrieval is off or no section qualifies.
+    """
+    if not POLICY_SECTION_RETRIEVAL:
+        return doc["text"]
+    chosen = {s["number"] for s in doc["sections"] if s["number"] is not None and s["category"] in categories}
+    matches = []
+    if query:
+        matches = [s for score, s in doc["index"].search(query)
+                   if score >= POLICY_SECTION_MIN_SCORE and s["number"] not in chosen][:POLICY_SECTION_TOP_K]
+    if not chosen and not matches:
+        return doc["text"]
+    parts = [s["text"] for s in doc["sections"] if s["number"] in chosen or s["category"] == "general"]
+    return "\n\n".join(parts + [s["text"] for s in matches])
+
+
+class PolicyStore:
+    """
+    Parsed policy documents by level key ("federal", "sponsor", "university"). A
+    document is {"key", "path", "text", "hash", "mtime", "tokens", "sections",
+    "index", "rules", "summary"}; "hash" is the SHA-256 of the text, usable as a
+    cache key, and "index" the document's PolicySectionIndex.
+    Documents are never mutated: a reload swaps in a new dict.
+    """
+
+    def __init__(self, directory, reload_interval):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._docs = {}  # key -> document, or None when the file is missing/unreadable
+        self._stats = {}  # key -> (mtime_ns, size) the document was loaded from
+        self._checked_at = {}
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}_policy.txt")
+
+    def _load(self, key, stat):
+        path = self.path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except Exception as e:
+            print(f"Error reading policy file {path}: {e}")
+            return None
+        sections = split_policy_sections(text)
+        return {
+            "key": key,
+            "path": path,
+            "text": text,
+            "hash": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            "mtime": stat.st_mtime,
+            "tokens": approx_token_count(text),
+            "sections": sections,
+            "index": PolicySectionIndex(sections),
+            "rules": compile_policy_rules(text),
+            "summary": parse_policy_text(text),
+        }
+
+    def get(self, key, force=False):
+        """The current document for key, or None if its file is missing."""
+        now = time.monotonic()
+        if not force and key in self._docs and now - self._checked_at.get(key, 0) < self.reload_interval:
+            return self._docs[key]
+        with self._lock:
+            try:
+                stat = os.stat(self.path(key))
+                signature = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                stat = signature = None
+            if force or key not in self._docs or signature != self._stats.get(key):
+                if stat is None:
+                    if self._docs.get(key) is not None or key not in self._docs:
+                        print(f"Policy file not found: {self.path(key)}")
+                    doc = None
+                else:
+                    doc = self._load(key, stat)
+                if key in self._docs:
+                    self.reloads += 1
+                    print(f"Reloaded {key} policy ({doc['hash'][:12] if doc else 'missing'})")
+                self._docs[key] = doc
+                self._stats[key] = signature
+            self._checked_at[key] = now
+            return self._docs[key]
+
+    def text(self, key):
+        doc = self.get(key)
+        return doc["text"] if doc else ""
+
+    def reload(self):
+        """Re-read every policy level now. Returns {key: document}."""
+        return {key: self.get(key, force=True) for key, _ in POLICY_LEVELS}
+
+    def info(self):
+        """JSON-safe summary of every loaded policy level."""
+        docs = {key: self.get(key) for key, _ in POLICY_LEVELS}
+        return {
+            "reloads": self.reloads,
+            "policies": {
+                key: None if doc is None else {
+                    "path": doc["path"],
+                    "hash": doc["hash"],
+                    "mtime": doc["mtime"],
+                    "tokens": doc["tokens"],
+                    "sections": [
+                        {"number": s["number"], "title": s["title"], "category": s["category"], "tokens": s["tokens"]}
+                        for s in doc["sections"]
+                    ],
+                }
+                for key, doc in docs.items()
+            },
+        }
+
+
+policy_store = PolicyStore(POLICIES_DIR, POLICY_RELOAD_INTERVAL)
+
+
+# ---- Deterministic policy rules ----
+# Per-item dollar limits and required description phrases are mechanical, so they are
+# compiled from the policy text and checked locally. Any violation decides the level
+# outright; a level with no violations and nothing needing judgment is decided as
+# compliant; everything else still goes to the LLM.
+RULES_DECIDE_COMPLIANT = os.getenv("RULES_DECIDE_COMPLIANT", "on").lower() not in ("off", "0", "false")
+RULE_SECTION_RE = re.compile(r"^\s*(\d+)\.\s+(.+?)\s*$")
+RULE_LIMIT_RE = re.compile(r"(?:exceeding|over|>)\s*\$([\d,]+(?:\.\d+)?)|\$([\d,]+(?:\.\d+)?)\+")
+RULE_PHRASE_RE = re.compile(r'must explicitly mention\s+"([^"]+)"', re.IGNORECASE)
+RULE_SECTION_CATEGORIES = [
+    ("personnel", "personnel"),
+    ("salary", "personnel"),
+    ("equipment", "equipment"),
+    ("travel", "travel"),
+    ("materials", "materials"),
+    ("other direct", "other_direct"),
+]
+RULE_CATEGORY_LABELS = {
+    "personnel": "Personnel (per person per year)",
+    "equipment": "Equipment (per item)",
+    "travel": "Travel (per trip)",
+    "materials": "Materials & Supplies (per item)",
+    "other_direct": "Other Direct Costs (per item)",
+}
+TRANSACTION_RULE_CATEGORIES = {
+    "Personnel": "personnel",
+    "Travel": "travel",
+    "Equipment": "equipment",
+    "Materials": "materials",
+    "Other Direct Costs": "other_direct",
+    "Other": "other_direct",
+}
+# Wording in an item description that calls for judgment even when every number passes
+RULE_ESCALATION_TERMS = (
+    "alcohol", "beer", "wine", "first class", "first-class", "business class", "business-class",
+    "vacation", "personal", "family", "furniture", "gift", "entertainment", "party", "snack", "coffee",
+    "consult", "membership", "dues", "honorari", "retroactive", "foreign airline", "non-u.s.",
+)
+
+
+def compile_policy_rules(policy_text):
+    """
+    Pull the mechanical rules out of one policy file:
+    {"limits": {category: {"limit", "section", "rule"}}, "phrases": {"international_travel": {...}}}.
+    Within a section the lowest dollar figure attached to an "exceeding"/">"/"$X+" rule wins.
+    """
+    rules = {"limits": {}, "phrases": {}}
+    section, category = None, None
+    for line in policy_text.splitlines():
+        heading = RULE_SECTION_RE.match(line)
+        if heading:
+            section = f"Section {heading.group(1)} ({heading.group(2)})"
+            title = heading.group(2).lower()
+            category = next((cat for word, cat in RULE_SECTION_CATEGORIES if word in title), None)
+            continue
+        if category is None:
+            continue
+        text = line.strip().lstrip("-").strip()
+        for match in RULE_LIMIT_RE.finditer(text):
+            limit = float((match.group(1) or match.group(2)).replace(",", ""))
+            current = rules["limits"].get(category)
+            if current is None or limit < current["limit"]:
+                rules["limits"][category] = {"limit": limit, "section": section, "rule": text}
+        phrase = RULE_PHRASE_RE.search(text)
+        if phrase and category == "travel" and "international" in text.lower():
+            rules["phrases"]["international_travel"] = {"phrase": phrase.group(1), "section": section, "rule": text}
+    return rules
+
+
+def _float_or_zero(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+AMOUNT_RE = re.compile(r"(-?)\$?\s*(\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?|\.\d+)")
+
+
+def _parse_amount(value):
+    """Dollar amount from a form value ("6500", "$6,500.00"); None if missing or not a plain number."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        value = float(value)
+        return value if math.isfinite(value) else None
+    match = AMOUNT_RE.fullmatch(str(value).strip())
+    if not match:
+        return None
+    return float(match.group(1) + match.group(2).replace(",", ""))
+
+
+def _travel_trip_total(t):
+    """Trip cost from total_amount or the older flight/per-day fields; None if it can't be worked out."""
+    total = _parse_amount(t.get("total_amount"))
+    if total:
+        return total
+    parts = {
+        "flight": t.get("flight_cost") or t.get("flight"),
+        "taxi": t.get("taxi_per_day") or t.get("taxi"),
+        "food": t.get("food_lodge_per_day") or t.get("food_per_day") or t.get("food"),
+        "days": t.get("days") or t.get("num_days"),
+    }
+    parts = {name: _parse_amount(raw) for name, raw in parts.items() if raw not in (None, "")}
+    if not parts:
+        return total
+    if None in parts.values():
+        return None
+    flight, days = parts.get("flight", 0.0), parts.get("days", 0.0)
+    per_day = parts.get("taxi", 0.0) + parts.get("food", 0.0)
+    return flight + per_day * days if days > 0 else flight
+
+
+def award_line_items(personnel, domestic_travel, international_travel, materials, equipment=None, other_direct=None):
+    """
+    Flatten award JSON into rule-checkable items:
+    {"category", "label", "amount" (None if it can't be worked out), "description", "international",
+    "source" (the form row the item came from)}. Personnel produce one item per person-year;
+    materials rows are split by their "type" into equipment, other direct costs and materials.
+    """
+    items = []
+    for p in personnel or []:
+        if not isinstance(p, dict):
+            continue
+        name = p.get("name") or "Unnamed"
+        rate = _parse_amount(p.get("rate_per_hour")) or 0.0
+        total = _parse_amount(p.get("total")) or 0.0
+        years = [h for h in (p.get("hours") or []) if isinstance(h, dict)]
+        total_hours = sum(_float_or_zero(h.get("hours")) for h in years)
+        for h in years or [{}]:
+            hours = _float_or_zero(h.get("hours"))
+            if rate > 0:
+                amount = hours * rate
+            elif total > 0 and total_hours > 0:
+                amount = total * hours / total_hours
+            elif total > 0 and len(years) <= 1:
+                amount = total
+            else:
+                amount = None
+            label = f"{name}, year {h.get('year')}" if h.get("year") else name
+            items.append({"category": "personnel", "label": label, "amount": amount,
+                          "description": p.get("position") or p.get("role") or "", "international": False,
+                          "source": p})
+    for trips, international in ((domestic_travel, False), (international_travel, True)):
+        for t in trips or []:
+            if isinstance(t, dict):
+                items.append({"category": "travel", "label": t.get("travel_name") or t.get("description") or "Trip",
+                              "amount": _travel_trip_total(t), "description": t.get("description") or "",
+                              "international": international, "source": t})
+    # The grant form stores equipment and other costs in materials_json as type 'equipment' /
+    # 'other' rows; like the award view, those count only when the dedicated list is empty
+    typed = {"equipment": [], "other": [], "": []}
+    for row in materials or []:
+        if isinstance(row, dict):
+            typed.get(str(row.get("type") or "").lower(), typed[""]).append(row)
+    sections = (("equipment", equipment or typed["equipment"]), ("materials", typed[""]),
+                ("other_direct", other_direct or typed["other"]))
+    for category, rows in sections:
+        for row in rows or []:
+            if isinstance(row, dict):
+                items.append({"category": category,
+                              "label": row.get("description") or row.get("material_type") or "Item",
+                              "amount": _parse_amount(row.get("cost")), "description": row.get("description") or "",
+                              "international": False, "source": row})
+    return items
+
+
+def transaction_line_items(transaction):
+    """A transaction is one item; personnel charges and trips of unknown destination need judgment."""
+    category = TRANSACTION_RULE_CATEGORIES.get(transaction.get("category") or "")
+    description = transaction.get("description") or ""
+    return [{
+        "category": category,
+        "label": description or f"Transaction {transaction.get('transaction_id', '')}".strip(),
+        # A single payroll charge isn't a person-year, so it can't be held to that limit
+        "amount": None if category in (None, "personnel") else _parse_amount(transaction.get("amount")),
+        "description": description,
+        "international": None if category == "travel" else False,
+    }]
+
+
+def evaluate_policy_rules(rules, items):
+    """Check items against compiled rules. Returns (violations, reasons the LLM is still needed)."""
+    violations, escalate = [], []
+    phrase_rule = rules["phrases"].get("international_travel")
+    for item in items:
+        label = item["label"]
+        if item["category"] is None:
+            escalate.append(f"'{label}' has no rule-checkable category")
+            continue
+        limit = rules["limits"].get(item["category"])
+        if item["amount"] is None:
+            escalate.append(f"'{label}' amount can't be checked against a fixed limit")
+        elif limit and item["amount"] > limit["limit"]:
+            violations.append({
+                "section": limit["section"],
+                "item": label,
+                "amount": round(item["amount"], 2),
+                "limit": limit["limit"],
+                "rule": f"{RULE_CATEGORY_LABELS[item['category']]} exceeds ${limit['limit']:,.0f} without prior approval",
+            })
+        if phrase_rule and item["category"] == "travel":
+            has_phrase = phrase_rule["phrase"].lower() in item["description"].lower()
+            if item["international"] and not has_phrase:
+                violations.append({
+                    "section": phrase_rule["section"],
+                    "item": label,
+                    "amount": round(item["amount"] or 0, 2),
+                    "limit": None,
+                    "rule": f"International travel description does not mention \"{phrase_rule['phrase']}\"",
+                })
+            elif item["international"] is None and not has_phrase:
+                escalate.append(f"'{label}' may be international travel")
+        if not item["description"].strip():
+            escalate.append(f"'{label}' has no description")
+        elif any(term in item["description"].lower() for term in RULE_ESCALATION_TERMS):
+            escalate.append(f"'{label}' description needs an allowability judgment")
+    return violations, escalate
+
+
+def rule_verdict(name, violations, escalate, item_count):
+    """A final verdict from the rules alone, or None when the LLM has to decide."""
+    if violations:
+        details = "; ".join(
+            f"{v['item']}: {v['rule']}" + (f" (${v['amount']:,.2f})" if v["limit"] else "") + f", {v['section']}"
+            for v in violations
+        )
+        return {
+            "result": "non-compliant",
+            "reason": f"This request violates {name} policy. {details}. These items must be corrected or receive prior approval.",
+            "violations": violations,
+            "source": "rules",
+        }
+    if not escalate and item_count and RULES_DECIDE_COMPLIANT:
+        return {
+            "result": "compliant",
+            "reason": f"All {item_count} line item(s) are within the {name} policy per-item limits, international travel "
+                      f"references the Fly America Act where required, and no description raises an allowability question.",
+            "violations": [],
+            "source": "rules",
+        }
+    return None
+
+
+def format_award_for_llm(award, personnel, domestic_travel, international_travel, materials, equipment=None, other_direct=None):
+    """Format award data into a structured text for LLM analysis."""
+    
+    # Calculate personnel budget from personnel data
+    personnel_budget = 0.0
+    if personnel:
+        for p in personnel:
+            if isinstance(p, dict):
+                # Use total if provided, otherwise calculate from hours * rate
+                total_from_form = float(p.get('total', 0) or 0)
+                if total_from_form > 0:
+                    personnel_budget += total_from_form
+                else:
+                    hours_list = p.get('hours', [])
+                    rate_per_hour = float(p.get('rate_per_hour', 0) or 0)
+                    if isinstance(hours_list, list) and rate_per_hour > 0:
+                        total_hours = sum(float(h.get('hours', 0) or 0) for h in hours_list if isinstance(h, dict))
+                        personnel_budget += total_hours * rate_per_hour
+    
+    # Calculate travel budget
+    travel_budget = 0.0
+    if domestic_travel:
+        for t in domestic_travel:
+            if isinstance(t, dict):
+                total_amount = float(t.get('total_amount', 0) or 0)
+                if total_amount > 0:
+                    travel_budget += total_amount
+    if international_travel:
+        for t in international_travel:
+            if isinstance(t, dict):
+                total_amount = float(t.get('total_amount', 0) or 0)
+                if total_amount > 0:
+                    travel_budget += total_amount
+    
+    # Calculate equipment budget from equipment_json
+    equipment_budget = 0.0
+    if equipment:
+        for e in equipment:
+            if isinstance(e, dict):
+                cost = float(e.get('cost', 0) or 0)
+                equipment_budget += cost
+    
+    # Calculate materials budget from materials_json
+    materials_budget = 0.0
+    if materials:
+        for m in materials:
+            if isinstance(m, dict):
+                cost = float(m.get('cost', 0) or 0)
+                materials_budget += cost
+    
+    # Calculate other direct costs budget
+    other_direct_budget = 0.0
+    if other_direct:
+        for o in other_direct:
+            if isinstance(o, dict):
+                cost = float(o.get('cost', 0) or 0)
+                other_direct_budget += cost
+    
+    award_text = f"""
+AWARD INFORMATION:
+- Title: {award.get('title', 'N/A')}
+- Sponsor Type: {award.get('sponsor_type', 'N/A')}
+- Total Amount: ${float(award.get('amount', 0) or 0):,.2f}
+- Start Date: {award.get('start_date', 'N/A')}
+- End Date: {award.get('end_date', 'N/A')}
+- Department: {award.get('department', 'N/A')}
+- College: {award.get('college', 'N/A')}
+
+BUDGET BREAKDOWN (TOTALS - for reference only):
+- Personnel Budget: ${personnel_budget:,.2f}
+- Equipment Budget: ${equipment_budget:,.2f}
+- Travel Budget: ${travel_budget:,.2f}
+- Materials Budget: ${materials_budget:,.2f}
+- Other Direct Costs Budget: ${other_direct_budget:,.2f}
+
+IMPORTANT: The budget totals above are for reference. Policy compliance is checked PER ITEM, not by total budget.
+Equipment items are checked individually against $8,000 per item.
+Materials items are checked individually against $5,000 per item.
+Travel is checked per trip against $5,000 per trip.
+"""
+    
+    if personnel:
+        award_text += "\nPERSONNEL DETAILS:\n"
+        for p in personnel:
+            if isinstance(p, dict):
+                name = p.get('name', 'Unknown')
+                role = p.get('position', 'N/A') or p.get('role', 'N/A')
+                hours_list = p.get('hours', [])
+                rate_per_hour = float(p.get('rate_per_hour', 0) or 0)
+                total_from_form = float(p.get('total', 0) or 0)
+                
+                total_hours = 0
+                if isinstance(hours_list, list):
+                    for h in hours_list:
+                        if isinstance(h, dict):
+                            total_hours += float(h.get('hours', 0) or 0)
+                
+                # Calculate total if not provided
+                if total_from_form > 0:
+                    personnel_total = total_from_form
+                elif total_hours > 0 and rate_per_hour > 0:
+                    personnel_total = total_hours * rate_per_hour
+                else:
+                    personnel_total = 0
+                
+                award_text += f"- {name} ({role}): {total_hours} hours"
+                if rate_per_hour > 0:
+                    award_text += f", Rate: ${rate_per_hour:,.2f}/hour"
+                if personnel_total > 0:
+                    award_text += f", Total: ${personnel_total:,.2f}"
+                award_text += "\n"
+    
+    if domestic_travel:
+        award_text += "\nDOMESTIC TRAVEL:\n"
+        for t in domestic_travel:
+            if isinstance(t, dict):
+                description = t.get('description', 'N/A')
+                total_amount = float(t.get('total_amount', 0) or 0)
+                if total_amount > 0:
+                    award_text += f"- {description}: Total Estimated Amount: ${total_amount:,.2f}\n"
+                else:
+                    # Fallback to old format if total_amount not available
+                    flight = t.get('flight', 0) or t.get('flight_cost', 0)
+                    taxi = t.get('taxi', 0) or t.get('taxi_per_day', 0)
+                    food = t.get('food', 0) or t.get('food_per_day', 0)
+                    days = t.get('days', 0) or t.get('num_days', 0)
+                    award_text += f"- {description}: Flight: ${float(flight or 0):,.2f}, Taxi/day: ${float(taxi or 0):,.2f}, Food/day: ${float(food or 0):,.2f}, Days: {days}\n"
+    
+    if international_travel:
+        award_text += "\nINTERNATIONAL TRAVEL:\n"
+        for t in international_travel:
+            if isinstance(t, dict):
+                description = t.get('description', 'N/A')
+                total_amount = float(t.get('total_amount', 0) or 0)
+                if total_amount > 0:
+                    award_text += f"- {description}: Total Estimated Amount: ${total_amount:,.2f}\n"
+                else:
+                    # Fallback to old format if total_amount not available
+                    flight = t.get('flight', 0) or t.get('flight_cost', 0)
+                    taxi = t.get('taxi', 0) or t.get('taxi_per_day', 0)
+                    food = t.get('food', 0) or t.get('food_per_day', 0)
+                    days = t.get('days', 0) or t.get('num_days', 0)
+                    award_text += f"- {description}: Flight: ${float(flight or 0):,.2f}, Taxi/day: ${float(taxi or 0):,.2f}, Food/day: ${float(food or 0):,.2f}, Days: {days}\n"
+    
+    if equipment:
+        award_text += "\nEQUIPMENT (Section 2 - $8,000 per item threshold):\n"
+        for e in equipment:
+            if isinstance(e, dict):
+                description = e.get('description', 'N/A')
+                cost = float(e.get('cost', 0) or 0)
+                award_text += f"- Item: {description}, Cost: ${cost:,.2f} (check if this INDIVIDUAL item exceeds $8,000)\n"
+        award_text += "NOTE: Check each equipment item INDIVIDUALLY against the $8,000 per item threshold. Do NOT sum all equipment items.\n"
+    
+    if materials:
+        award_text += "\nMATERIALS & SUPPLIES (Section 4 - $5,000 per item threshold):\n"
+        for m in materials:
+            if isinstance(m, dict):
+                description = m.get('description', 'N/A')
+                cost = float(m.get('cost', 0) or 0)
+                award_text += f"- Item: {description}, Cost: ${cost:,.2f} (check if this INDIVIDUAL item exceeds $5,000)\n"
+        award_text += "NOTE: Check each materials item INDIVIDUALLY against the $5,000 per item threshold. Do NOT sum all materials items.\n"
+    
+    if other_direct:
+        award_text += "\nOTHER DIRECT COSTS:\n"
+        for o in other_direct:
+            if isinstance(o, dict):
+                description = o.get('description', 'N/A')
+                cost = float(o.get('cost', 0) or 0)
+                award_text += f"- {description}, Cost: ${cost:,.2f}\n"
+    
+    return award_text
+
+
+# ---- Incremental award checks ----
+# Award verdicts are built from per-line-item verdicts stored in compliance_item_verdicts.
+# An item is only re-evaluated (rules first, then the LLM with just its policy section)
+# when its content, the award context or that policy section changed since it was last
+# checked; everything else is merged from the stored set.
+COMPLIANCE_INCREMENTAL = os.getenv("COMPLIANCE_INCREMENTAL", "on").lower() not in ("off", "0", "false")
+AWARD_ITEM_CONTEXT_FIELDS = ("sponsor_type", "start_date", "end_date")
+
+
+def award_item_key(level, section_text, award, item):
+    """Content hash identifying one item's verdict under one policy level."""
+    material = json.dumps(
+        [COMPLIANCE_PROMPT_VERSION, LLM_MODEL, level, hashlib.sha256(section_text.encode("utf-8")).hexdigest(),
+         [award.get(field) for field in AWARD_ITEM_CONTEXT_FIELDS], item],
+        sort_keys=True, default=str, ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def build_item_review_prompt(name, section_text, priority_note, award, section_label, entries):
+    """
+    Prompt asking for per-item verdicts on entries = [(number, item, pre-check notes)] of one
+    budget section: static instructions, the section's policy text, then award and items.
+    """
+    listing = ""
+    for number, item, notes in entries:
+        amount = f"${item['amount']:,.2f}" if item["amount"] is not None else "not stated"
+        listing += f"""
+[Item {number}] {item['label']}
+- Amount: {amount}
+- Description: {item['description'] or 'N/A'}
+- Form details: {json.dumps(item.get('source') or {}, default=str)}
+"""
+        if notes:
+            listing += f"- Automated pre-check passed all dollar limits; review: {'; '.join(notes)}\n"
+    return f"""You are an AI Policy Compliance Officer for a Post-Award Research Budget Management System.
+
+Your job is to check whether EACH of the budget items listed at the end of a research award complies with the policy given below.
+Evaluate every item independently. Thresholds are PER ITEM, never a category total.
+
+CRITICAL: You must base every decision ONLY on the policy text provided. Do not assume or invent any rules.
+
+POLICY LEVEL: {name}
+{priority_note}
+
+POLICY TEXT ({section_label} sections):
+{section_text}
+
+For each item explain WHY it is compliant or non-compliant with the {name} policy, referencing specific policy sections.
+
+Your output must be a JSON object in this exact format, with one entry per item listed below:
+{{
+  "results": [
+    {{"item": <number>, "result": "compliant" | "non-compliant" | "unknown", "reason": "Explanation written for a colleague."}}
+  ]
+}}
+
+Only return the JSON object, nothing else.
+
+AWARD CONTEXT:
+- Title: {award.get('title', 'N/A')}
+- Sponsor Type: {award.get('sponsor_type', 'N/A')}
+- Total Amount: ${float(award.get('amount', 0) or 0):,.2f}
+- Start Date: {award.get('start_date', 'N/A')}
+- End Date: {award.get('end_date', 'N/A')}
+
+BUDGET ITEMS:
+{listing}"""
+
+
+def aggregate_item_verdicts(name, entries, reused):
+    """One policy level's award verdict from [(section, item, verdict)], with a per-section breakdown."""
+    sections = {}
+    for section, item, verdict in entries:
+        block = sections.setdefault(section, {"result": "compliant", "items": []})
+        block["items"].append({"label": item["label"], "result": verdict.get("result", "unknown"),
+                               "reason": verdict.get("reason", ""), "source": verdict.get("source", "llm")})
+    for block in sections.values():
+        results = {i["result"] for i in block["items"]}
+        block["result"] = "non-compliant" if "non-compliant" in results else "unknown" if results - {"compliant"} else "compliant"
+
+    flagged = [(section, i) for section, block in sections.items() for i in block["items"] if i["result"] != "compliant"]
+    violations = [(s, i) for s, i in flagged if i["result"] == "non-compliant"]
+    if violations:
+        result = "non-compliant"
+        reason = f"This award violates {name} policy. " + " ".join(
+            f"{RULE_CATEGORY_LABELS.get(s, s)}, '{i['label']}': {i['reason']}" for s, i in violations)
+    elif flagged:
+        result = "unknown"
+        reason = f"{name} policy could not be confirmed for every item. " + " ".join(
+            f"{RULE_CATEGORY_LABELS.get(s, s)}, '{i['label']}': {i['reason']}" for s, i in flagged)
+    else:
+        result = "compliant"
+        reason = (f"All {len(entries)} budget line item(s) comply with {name} policy: each was checked individually "
+                  f"against its section's per-item limits and allowability rules.")
+    return {"result": result, "reason": reason, "sections": sections,
+            "items_checked": len(entries) - reused, "items_reused": reused}
+
+
+def _load_item_verdicts(award_id):
+    """{(policy_level, item_key): verdict} stored for an award; empty if the database is unavailable."""
+    conn = get_detached_db()
+    if conn is None:
+        return {}
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT policy_level, item_key, result FROM compliance_item_verdicts WHERE award_id = %s", (award_id,))
+        rows = cur.fetchall()
+        cur.close()
+        conn.rollback()
+        return {(level, key): result if isinstance(result, dict) else json.loads(result) for level, key, result in rows}
+    except Exception as e:
+        print(f"Error loading item verdicts for award {award_id}: {e}")
+        conn.rollback()
+        return {}
+    finally:
+        conn.close()
+
+
+def _store_item_verdicts(award_id, current_keys, fresh):
+    """
+    Save fresh definitive verdicts [(level, key, section, label, verdict)] and drop rows
+    for items the award no longer has. current_keys is {level: set of item keys}.
+    """
+    conn = get_detached_db()
+    if conn is None:
+        return
+    try:
+        cur = conn.cursor()
+        # Identical line items share a key, and one upsert can't touch the same row twice
+        rows = {(level, key): (award_id, level, key, section, label, json.dumps(verdict))
+                for level, key, section, label, verdict in fresh
+                if verdict.get("result") in ("compliant", "non-compliant")}
+        rows = list(rows.values())
+        if rows:
+            execute_values(
+                cur,
+                """
+                INSERT INTO compliance_item_verdicts (award_id, policy_level, item_key, section, label, result)
+                VALUES %s
+                ON CONFLICT (award_id, policy_level, item_key) DO UPDATE
+                SET result = EXCLUDED.result, label = EXCLUDED.label, checked_at = CURRENT_TIMESTAMP
+                """,
+                rows,
+                template="(%s, %s, %s, %s, %s, %s::jsonb)",
+            )
+        for level, keys in current_keys.items():
+            cur.execute(
+                "DELETE FROM compliance_item_verdicts WHERE award_id = %s AND policy_level = %s AND NOT (item_key = ANY(%s))",
+                (award_id, level, list(keys)),
+            )
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print(f"Error storing item verdicts for award {award_id}: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+
+def iter_award_item_checks(client, award, line_items, executor=None, stream_reasons=False):
+    """
+    iter_policy_checks() for an award, evaluated item by item. Stored verdicts are reused
+    for unchanged items; the rest go through the rule engine and then, one request per
+    (level, budget section, chunk of items), to the LLM with only that section's policy
+    text. Yields ("verdict", key, result) per level and ("error", None, message) when no
+    client is configured. With stream_reasons, also ("reason", key, text) for each item
+    as soon as its verdict is known, ahead of the level's verdict.
+    """
+
+    def item_reason(item, verdict):
+        return f"{item['label']} ({verdict.get('result', 'unknown')}): {verdict.get('reason', '')} "
+
+    executor = executor or compliance_executor
+    award_id = award.get("award_id")
+    stored = _load_item_verdicts(award_id)
+    current_keys, fresh, calls = {}, [], []
+    entries = {}  # level key -> [(section, item, verdict or None)]
+    reused = {}
+    futures = {}
+    events = queue.Queue()  # finished futures, handed over by their done callbacks
+    early_reasons = []  # (key, text) for items decided without the LLM
+    no_client = False
+    try:
+        for key, name in POLICY_LEVELS:
+            doc = policy_store.get(key)
+            if not doc or not doc["text"]:
+                yield "verdict", key, {"result": "unknown", "reason": f"{name} policy text not available"}
+                continue
+            current_keys[key] = set()
+            entries[key], reused[key] = [], 0
+            pending = {}  # section -> [(entry index, item key, item, notes)]
+            for item in line_items:
+                section_text = policy_excerpt(doc, {item["category"]})
+                item_key = award_item_key(key, section_text, award, item)
+                current_keys[key].add(item_key)
+                verdict = stored.get((key, item_key))
+                if verdict is not None:
+                    reused[key] += 1
+                else:
+                    violations, escalate = evaluate_policy_rules(doc["rules"], [item])
+                    verdict = rule_verdict(name, violations, escalate, 1)
+                    if verdict is not None:
+                        fresh.append((key, item_key, item["category"], item["label"], verdict))
+                    elif client is None:
+                        no_client = True
+                        verdict = {"result": "unknown", "reason": "API key missing"}
+                    else:
+                        pending.setdefault(item["category"], []).append((len(entries[key]), item_key, item, escalate))
+                entries[key].append([item["category"], item, verdict])
+                if verdict is not None and stream_reasons:
+                    early_reasons.append((key, item_reason(item, verdict)))
+            for section, waiting in pending.items():
+                section_text = policy_excerpt(doc, {section})
+                for start in range(0, len(waiting), BATCH_COMPLIANCE_CHUNK):
+                    chunk = waiting[start:start + BATCH_COMPLIANCE_CHUNK]
+                    prompt = build_item_review_prompt(
+                        name, section_text, POLICY_PRIORITY_NOTES.get(name, ""), award,
+                        RULE_CATEGORY_LABELS.get(section, section),
+                        [(n + 1, item, notes) for n, (_, _, item, notes) in enumerate(chunk)],
+                    )
+                    future = submit_llm_call(executor, _check_policy_level, client, name, prompt,
+                                             150 * len(chunk) + 100, call_log=calls)
+                    future.add_done_callback(events.put)
+                    futures[future] = (key, chunk)
+        if no_client:
+            yield "error", None, "OpenAI API key not configured"
+        for key, text in early_reasons:
+            yield "reason", key, text
+
+        outstanding = {}
+        for key, _ in futures.values():
+            outstanding[key] = outstanding.get(key, 0) + 1
+        names = dict(POLICY_LEVELS)
+        for key in entries:
+            if not outstanding.get(key):
+                yield "verdict", key, aggregate_item_verdicts(names[key], entries[key], reused[key])
+
+        remaining = set(futures)
+        queue_deadline = llm_queue_deadline(len(futures))
+        while remaining:
+            finished = []
+            for future in expired_llm_calls(remaining, queue_deadline):
+                remaining.discard(future)
+                future.cancel()
+                print(f"{futures[future][0]} item check timed out after {LLM_CALL_TIMEOUT:.0f}s")
+                finished.append((future, {"reason": f"Policy check timed out after {LLM_CALL_TIMEOUT:.0f}s"}))
+            if not finished:
+                try:
+                    future = events.get(timeout=LLM_DEADLINE_POLL)
+                except queue.Empty:
+                    continue
+                if future not in remaining:
+                    continue  # finished after it was given up on
+                remaining.discard(future)
+                finished.append((future, future.result()))
+            for future, response in finished:
+                key, chunk = futures[future]
+                answers = {}
+                for entry in response.get("results") or []:
+                    if isinstance(entry, dict):
+                        try:
+                            answers[int(entry.get("item"))] = {"result": entry.get("result", "unknown"),
+                                                               "reason": entry.get("reason", ""), "source": "llm"}
+                        except (TypeError, ValueError):
+                            continue
+                fallback = {"result": "unknown", "reason": response.get("reason") or "No verdict returned for this item"}
+                for n, (index, item_key, item, _) in enumerate(chunk):
+                    verdict = answers.get(n + 1, fallback)
+                    entries[key][index][2] = verdict
+                    fresh.append((key, item_key, item["category"], item["label"], verdict))
+                    if stream_reasons:
+                        yield "reason", key, item_reason(item, verdict)
+                outstanding[key] -= 1
+                if not outstanding[key]:
+                    yield "verdict", key, aggregate_item_verdicts(names[key], entries[key], reused[key])
+    finally:
+        for future in futures:
+            future.cancel()
+        _store_item_verdicts(award_id, current_keys, fresh)
+        record_llm_calls(list(calls), award_id=award_id)
+
+
+def check_policy_compliance(award, personnel, domestic_travel, international_travel, materials, equipment=None, other_direct=None, stream=False):
+    """
+    Check award compliance against University, Sponsor, and Federal policies using LLM.
+    Returns a dict with compliance results for each policy level, or with stream=True the
+    iter_policy_checks() event generator (reasons streamed as they are generated).
+    """
+    # Format award data
+    award_text = format_award_for_llm(award, personnel, domestic_travel, international_travel, materials, equipment, other_direct)
+    
+    # Without an OpenAI API key only rule-decided levels get a verdict
+    client = get_llm_client()
+    
+    def build_prompt(name, policy_text, priority_note, output_format=None):
+        if output_format is None:
+            output_format = f"""Your output must be a JSON object in this exact format:
+{{
+  "result": "compliant" | "non-compliant" | "unknown",
+  "reason": "Comprehensive explanation that reads naturally, explains policy compliance, references specific policy sections, and explains why the award follows or violates policy requirements. Write as if explaining to a colleague, not just listing thresholds."
+}}
+
+Example of good explanation for compliant: "This award complies with {name} policy requirements. The personnel expenses are within acceptable limits per person per year as specified in Section 1, and all listed personnel directly contribute to project aims. Travel expenses follow policy guidelines for research-related travel and do not exceed per-trip thresholds. All international travel entries explicitly mention 'Fly America Act' in their descriptions, demonstrating compliance with federal travel requirements. Each equipment item is individually checked and all are under the $8,000 per item threshold. Each materials item is individually checked and all are under the $5,000 per item threshold. The award follows all applicable rules and does not violate any policy restrictions."
+
+Example of good explanation for non-compliant: "This award violates {name} policy in Section 3 (Travel). The international travel entry for 'Conference in Paris' does not mention 'Fly America Act' in its description, which is a mandatory requirement for all international travel as specified in the policy. International travel must explicitly reference Fly America Act compliance in the description to demonstrate adherence to federal travel regulations. Additionally, one equipment item (High-Performance Workstation) costs $9,500, which exceeds the $8,000 per item threshold without prior approval as required by policy. Note: This is checked per item, not by total equipment budget. These violations must be addressed before approval."
+
+Only return the JSON object, nothing else."""
+        # Static instructions first, then this level's policy and answer format, then the award:
+        # every prompt for a level shares one long identical prefix the provider can cache
+        return f"""You are an AI Policy Compliance Officer for a Post-Award Research Budget Management System.
+
+Your job is to check whether a research award complies with the policy given below.
+
+CRITICAL: You must base every decision ONLY on the policy text provided. Do not assume or invent any rules.
+
+═══════════════════════════════════════════════════════════════════════════════
+CRITICAL RULE: THRESHOLDS ARE PER ITEM, NOT TOTAL
+═══════════════════════════════════════════════════════════════════════════════
+
+Equipment and Materials & Supplies are COMPLETELY SEPARATE categories with DIFFERENT thresholds:
+- Equipment has a threshold of $8,000 PER ITEM (Section 2 in policies)
+- Materials & Supplies has a threshold of $5,000 PER ITEM (Section 4 in policies)
+- These categories must be evaluated INDEPENDENTLY. Do NOT combine their costs.
+- An equipment item over $8,000 violates Equipment policy, NOT Materials policy.
+- A materials item over $5,000 violates Materials policy, NOT Equipment policy.
+- IMPORTANT: The threshold is PER ITEM, NOT the total. Each individual item must be checked separately.
+- For example: If you have 3 materials items costing $2,000, $1,500, and $1,800, they are ALL compliant because each is under $5,000 per item.
+- The TOTAL of all items in a category does NOT need to be under the threshold - only each INDIVIDUAL item.
+- Do NOT add up all equipment items and check against $8,000 - check each equipment item individually.
+- Do NOT add up all materials items and check against $5,000 - check each materials item individually.
+
+EXAMPLE OF CORRECT EVALUATION:
+- If Materials section shows: Item A = $2,000, Item B = $1,500, Item C = $1,800
+  → ALL THREE ITEMS ARE COMPLIANT (each is under $5,000 per item)
+  → The total ($5,300) does NOT matter - only individual items matter
+  
+- If Materials section shows: Item A = $2,000, Item B = $6,000
+  → Item A is COMPLIANT ($2,000 < $5,000)
+  → Item B is NON-COMPLIANT ($6,000 > $5,000 per item threshold)
+  → Report Item B as the violation, NOT the total
+
+WRONG: "Materials total $8,500 exceeds $5,000 threshold" ❌
+RIGHT: "Each materials item is checked individually. Item X costs $6,200 which exceeds $5,000 per item threshold" ✅
+
+═══════════════════════════════════════════════════════════════════════════════
+CRITICAL RULE: INTERNATIONAL TRAVEL MUST MENTION "FLY AMERICA ACT"
+═══════════════════════════════════════════════════════════════════════════════
+
+For ALL international travel entries:
+- The description field MUST explicitly contain the text "Fly America Act" (case-insensitive).
+- If an international travel description does NOT contain "Fly America Act", the award is NON-COMPLIANT.
+- This is a mandatory requirement - if "Fly America Act" is missing from the description, the travel request violates policy.
+- Check each international travel entry individually - if ANY international travel entry lacks "Fly America Act" in its description, the award is non-compliant.
+
+Example of compliant international travel description:
+- "Attending conference in Paris. Fly America Act compliance confirmed."
+- "Research collaboration in Tokyo following Fly America Act requirements."
+
+Example of NON-COMPLIANT international travel description:
+- "Attending conference in Paris" (missing Fly America Act mention)
+- "Research collaboration in Tokyo" (missing Fly America Act mention)
+
+═══════════════════════════════════════════════════════════════════════════════
+
+Provide a comprehensive, human-like assessment that:
+1. Explains WHY the award is compliant or non-compliant based on policy requirements
+2. References specific policy sections and requirements
+3. For compliant items: Explain that it follows policy guidelines, meets requirements, and does not violate any rules
+4. For non-compliant items: Clearly state what policy is violated and why
+5. Avoid simply stating budget thresholds (e.g., "below $5000") - instead explain policy compliance in context
+6. CRITICALLY: Evaluate Equipment and Materials & Supplies as SEPARATE categories with their respective thresholds ($8,000 for Equipment, $5,000 for Materials & Supplies)
+7. MOST IMPORTANT: Check each item INDIVIDUALLY. The threshold is PER ITEM, NOT the total. For example:
+   - If you have 5 materials items costing $1,000 each, they are ALL compliant (each is under $5,000)
+   - If you have 1 materials item costing $6,000, it is NON-COMPLIANT (exceeds $5,000 per item)
+   - Do NOT add up all items in a category and check the total - check EACH item separately
+   - Equipment total and Materials total are separate - do NOT combine them
+8. MANDATORY: For international travel, check that each description explicitly contains "Fly America Act" (case-insensitive). If ANY international travel entry lacks "Fly America Act" in its description, the award is NON-COMPLIANT. This is a mandatory requirement - missing "Fly America Act" means the travel request violates policy.
+
+POLICY LEVEL: {name}
+{priority_note}
+
+POLICY TEXT:
+{policy_text}
+
+{output_format}
+
+AWARD DATA:
+{award_text}
+
+Analyze the award against the {name} policy above and answer in the JSON format described above."""
+    
+    line_items = award_line_items(personnel, domestic_travel, international_travel, materials, equipment, other_direct)
+    if COMPLIANCE_INCREMENTAL and award.get("award_id") and line_items:
+        events = iter_award_item_checks(client, award, line_items, stream_reasons=stream)
+        return events if stream else collect_policy_results(events)
+    if stream:
+        return iter_policy_checks(client, build_prompt, line_items, award_id=award.get("award_id"), stream_reasons=True)
+    return run_policy_checks(client, build_prompt, line_items, award_id=award.get("award_id"))
+
+
+# Shared by the single-transaction and batch prompts
+TRANSACTION_POLICY_RULES = """- Once a transaction is approved, it is recorded as a committed cost and no longer counted as "requested."
+- Committed costs do NOT increase the spent total until the university actually pays the expense.
+- The remaining balance is immediately reduced by the committed amount to prevent overspending.
+- All approved transactions must undergo a compliance verification before payment (allowable, allocable, reasonable).
+- Payments cannot exceed the approved amount unless a new approval request is submitted.
+- The transaction must follow procurement or travel rules based on category (equipment, supplies, airfare, etc.).
+- All post-approval activities must comply with Federal, Sponsor, and University policies."""
+
+
+def check_transaction_compliance(transaction, award):
+    """
+    Check transaction compliance against University, Sponsor, and Federal policies using LLM.
+    Returns a dict with compliance results for each policy level.
+    """
+    # Format transaction data for LLM
+    transaction_text = f"""
+Transaction Details:
+- Category: {transaction.get('category', 'N/A')}
+- Description: {transaction.get('description', 'N/A')}
+- Amount: ${transaction.get('amount', 0):,.2f}
+- Date Submitted: {transaction.get('date_submitted', 'N/A')}
+
+Award Context:
+- Title: {award.get('title', 'N/A')}
+- Sponsor: {award.get('sponsor_type', 'N/A')}
+- Amount: ${award.get('amount', 0):,.2f}
+- Start Date: {award.get('start_date', 'N/A')}
+- End Date: {award.get('end_date', 'N/A')}
+"""
+    
+    # Without an OpenAI API key only rule-decided levels get a verdict
+    client = get_llm_client()
+    
+    def build_prompt(name, policy_text, priority_note, output_format=None):
+        if output_format is None:
+            output_format = f"""Your output must be a JSON object in this exact format:
+{{
+  "result": "compliant" | "non-compliant" | "unknown",
+  "reason": "Comprehensive explanation that reads naturally, explains policy compliance, references specific policy sections, and explains why the transaction follows or violates policy requirements. Write as if explaining to a colleague, not just listing thresholds."
+}}
+
+Example of good explanation for compliant: "This transaction complies with {name} policy requirements. The expense is necessary for the research project as described, falls within acceptable policy limits, and follows the procurement guidelines specified in Section 2. The amount is reasonable and allocable to the award, and the transaction does not violate any policy restrictions. It is properly categorized and meets all applicable policy requirements."
+
+Example of good explanation for non-compliant: "This transaction violates {name} policy in Section 3 (Travel). The transaction exceeds the $5,000 per-trip threshold without prior approval as required by policy. Additionally, the description suggests personal travel expenses which are explicitly prohibited. These violations must be addressed before approval."
+
+Only return the JSON object, nothing else."""
+        # Same layout as the award prompt: static instructions, this level's policy, then the transaction
+        return f"""You are an AI Policy Compliance Officer for a Post-Award Research Budget Management System.
+
+Your job is to check whether a TRANSACTION (spending request) complies with the policy given below.
+
+CRITICAL: You must base every decision ONLY on the policy text provided. Do not assume or invent any rules.
+
+IMPORTANT TRANSACTION POLICY RULES:
+{TRANSACTION_POLICY_RULES}
+
+Provide a comprehensive, human-like assessment that:
+1. Explains WHY the transaction is compliant or non-compliant based on policy requirements
+2. References specific policy sections and requirements
+3. For compliant items: Explain that it follows policy guidelines, is allowable and reasonable, and does not violate any rules
+4. For non-compliant items: Clearly state what policy is violated and why
+5. Avoid simply stating budget thresholds (e.g., "below $5000") - instead explain policy compliance in context
+6. Consider whether the transaction is necessary for the research, properly categorized, and follows procurement/travel rules
+
+POLICY LEVEL: {name}
 {priority_note}
 
+POLICY TEXT:
+{policy_text}
+
+{output_format}
+
+TRANSACTION DATA:
+{transaction_text}
+
+Analyze the transaction against the {name} policy above and answer in the JSON format described above."""
+    
+    # Only the sections for the transaction's category, plus whichever best matches its description
+    line_items = transaction_line_items(transaction)
+    scope = ({line_items[0]["category"]}, transaction.get("description") or "")
+    return run_policy_checks(client, build_prompt, line_items, award_id=transaction.get("award_id"),
+                             transaction_id=transaction.get("transaction_id"), policy_scope=scope)
+
+
+def award_budget_sections(award):
+    """The award row's JSON budget sections, in check_policy_compliance's argument order."""
+    def parse_json(field_name):
+        raw = award.get(field_name)
+        if raw is None:
+            return []
+        if isinstance(raw, (dict, list)):
+            return raw
+        try:
+            return json.loads(raw)
+        except Exception:
+            return []
+    
+    return [parse_json(field) for field in ("personnel_json", "domestic_travel_json", "international_travel_json",
+                                            "materials_json", "equipment_json", "other_direct_json")]
+
+
+def save_award_compliance_notes(award_id, compliance_results):
+    """Store compliance results in awards.ai_review_notes; failures are logged, not raised."""
+    conn = get_db()
+    if conn is None:
+        return
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE awards SET ai_review_notes = %s WHERE award_id = %s",
+            (json.dumps(compliance_results), award_id)
+        )
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print(f"Error saving compliance results: {e}")
+    finally:
+        conn.close()
+
+
+@app.route("/awards/<int:award_id>/check-compliance", methods=["POST"])
+def check_award_compliance(award_id):
+    """Check policy compliance for an award using LLM."""
+    u = session.get("user")
+    if not u:
+        return make_response(json.dumps({"error": "Not authenticated"}), 401, {"Content-Type": "application/json"})
+    
+    # Only Admin can check compliance
+    if u.get("role") != "Admin":
+        return make_response(json.dumps({"error": "Unauthorized"}), 403, {"Content-Type": "application/json"})
+    
+    conn = get_db()
+    if conn is None:
+        return make_response(json.dumps({"error": "DB connection failed"}), 500, {"Content-Type": "application/json"})
+    
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        # Get award
+        cur.execute("SELECT * FROM awards WHERE award_id=%s", (award_id,))
+        award = cur.fetchone()
+        
+        if not award:
+            cur.close()
+            conn.close()
+            return make_response(json.dumps({"error": "Award not found"}), 404, {"Content-Type": "application/json"})
+        
+        cur.close()
+        conn.close()
+        
+        # Check compliance
+        compliance_results = check_policy_compliance(award, *award_budget_sections(award))
+        
+        # Store results in database (optional - update ai_review_notes)
+        if "error" not in compliance_results:
+            save_award_compliance_notes(award_id, compliance_results)
+        
+        return make_response(json.dumps(compliance_results, indent=2), 200, {"Content-Type": "application/json"})
+        
+    except Exception as e:
+        print(f"Error checking compliance: {e}")
+        return make_response(json.dumps({"error": str(e)}), 500, {"Content-Type": "application/json"})
+
+
+def sse_event(event, data):
+    """One Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.route("/awards/<int:award_id>/check-compliance/stream", methods=["POST"])
+def check_award_compliance_stream(award_id):
+    """
+    check_award_compliance as a text/event-stream: a "verdict" event per policy level as
+    soon as it resolves, "reason" events carrying the reason text while it is generated,
+    and a final "done" event with the full results (stored like the JSON route's).
+    """
+    u = session.get("user")
+    if not u:
+        return make_response(json.dumps({"error": "Not authenticated"}), 401, {"Content-Type": "application/json"})
+    
+    # Only Admin can check compliance
+    if u.get("role") != "Admin":
+        return make_response(json.dumps({"error": "Unauthorized"}), 403, {"Content-Type": "application/json"})
+    
+    conn = get_db()
+    if conn is None:
+        return make_response(json.dumps({"error": "DB connection failed"}), 500, {"Content-Type": "application/json"})
+    
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("SELECT * FROM awards WHERE award_id=%s", (award_id,))
+        award = cur.fetchone()
+        cur.close()
+    except Exception as e:
+        print(f"Error loading award for compliance stream: {e}")
+        return make_response(json.dumps({"error": str(e)}), 500, {"Content-Type": "application/json"})
+    finally:
+        conn.close()
+    if not award:
+        return make_response(json.dumps({"error": "Award not found"}), 404, {"Content-Type": "application/json"})
+    
+    def generate():
+        results = {}
+        try:
+            for kind, key, value in check_policy_compliance(award, *award_budget_sections(award), stream=True):
+                if kind == "verdict":
+                    results[key] = value
+                    yield sse_event("verdict", {"level": key, **value})
+                elif kind == "reason":
+                    yield sse_event("reason", {"level": key, "text": value})
+                else:
+                    results["error"] = value
+                    yield sse_event("error", {"error": value})
+        except Exception as e:
+            print(f"Error streaming compliance check: {e}")
+            yield sse_event("error", {"error": str(e)})
+            return
+        ordered = {key: results[key] for key, _ in POLICY_LEVELS}
+        if "error" in results:
+            ordered["error"] = results["error"]
+        else:
+            save_award_compliance_notes(award_id, ordered)
+        yield sse_event("done", ordered)
+    
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def load_transaction_for_compliance(cur, transaction_id):
+    """(transaction row, award context dict) for check_transaction_compliance, or (None, None)."""
+    cur.execute(
+        """
+        SELECT t.*, a.title, a.sponsor_type, a.amount as award_amount,
+               a.start_date, a.end_date
+        FROM transactions t
+        JOIN awards a ON t.award_id = a.award_id
+        WHERE t.transaction_id = %s
+        """,
+        (transaction_id,)
+    )
+    txn = cur.fetchone()
+    if not txn:
+        return None, None
+    award_data = {
+        'title': txn.get('title', ''),
+        'sponsor_type': txn.get('sponsor_type', ''),
+        'amount': float(txn.get('award_amount', 0) or 0),
+        'start_date': txn.get('start_date', ''),
+        'end_date': txn.get('end_date', '')
+    }
+    return txn, award_data
+
+
+@app.route("/transactions/<int:transaction_id>/check-compliance", methods=["POST"])
+def check_transaction_compliance_route(transaction_id):
+    """Check policy compliance for a transaction using LLM."""
+    u = session.get("user")
+    if not u:
+        return make_response(json.dumps({"error": "Not authenticated"}), 401, {"Content-Type": "application/json"})
+    
+    # Only Admin/Finance can check compliance
+    if u.get("role") not in ("Admin", "Finance"):
+        return make_response(json.dumps({"error": "Unauthorized"}), 403, {"Content-Type": "application/json"})
+    
+    conn = get_db()
+    if conn is None:
+        return make_response(json.dumps({"error": "DB connection failed"}), 500, {"Content-Type": "application/json"})
+    
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        txn, award_data = load_transaction_for_compliance(cur, transaction_id)
+        
+        if not txn:
+            cur.close()
+            conn.close()
+            return make_response(json.dumps({"error": "Transaction not found"}), 404, {"Content-Type": "application/json"})
+        
+        cur.close()
+        conn.close()
+        
+        # Check compliance
+        compliance_results = check_transaction_compliance(txn, award_data)
+        
+        # Store results in database (update compliance_notes)
+        if "error" not in compliance_results:
+            conn = get_db()
+            if conn:
+                try:
+                    cur = conn.cursor()
+                    notes = json.dumps(compliance_results)
+                    cur.execute(
+                        "UPDATE transactions SET compliance_notes = %s WHERE transaction_id = %s",
+                        (notes, transaction_id)
+                    )
+                    conn.commit()
+                    cur.close()
+                except Exception as e:
+                    print(f"Error saving transaction compliance results: {e}")
+                finally:
+                    conn.close()
+        
+        return make_response(json.dumps(compliance_results, indent=2), 200, {"Content-Type": "application/json"})
+        
+    except Exception as e:
+        print(f"Error checking transaction compliance: {e}")
+        import traceback
+        traceback.print_exc()
+        return make_response(json.dumps({"error": str(e)}), 500, {"Content-Type": "application/json"})
+
+
+# ---- Batch transaction compliance ----
+# Pending transactions are grouped by award and policy level, and each group is sent
+# in chunks: the policy text and award context go out once per chunk instead of once
+# per transaction, and the model returns one verdict per transaction id.
+BATCH_COMPLIANCE_CHUNK = int(os.getenv("BATCH_COMPLIANCE_CHUNK", "15"))
+BATCH_COMPLIANCE_MAX_ITEMS = int(os.getenv("BATCH_COMPLIANCE_MAX_ITEMS", "300"))
+
+
+def build_batch_transaction_prompt(name, policy_text, priority_note, award, items):
+    """
+    Prompt asking for per-transaction verdicts on items = [(transaction, pre-check notes)].
+    Laid out static instructions, policy, then award and transactions, like every compliance prompt.
+    """
+    listing = ""
+    for txn, notes in items:
+        listing += f"""
+[Transaction {txn['transaction_id']}]
+- Category: {txn.get('category', 'N/A')}
+- Description: {txn.get('description', 'N/A')}
+- Amount: ${float(txn.get('amount') or 0):,.2f}
+- Date Submitted: {txn.get('date_submitted', 'N/A')}
+"""
+        if notes:
+            listing += f"- Automated pre-check passed all dollar limits; review: {'; '.join(notes)}\n"
+    return f"""You are an AI Policy Compliance Officer for a Post-Award Research Budget Management System.
+
+Your job is to check whether EACH of the TRANSACTIONS (spending requests) listed at the end complies with the policy given below.
+Evaluate every transaction independently.
+
+CRITICAL: You must base every decision ONLY on the policy text provided. Do not assume or invent any rules.
+
 IMPORTANT TRANSACTION POLICY RULES:
-- Once a transaction is approved, it is recorded as a committed cost and no longer counted as "requested."
-- Committed costs do NOT increase the spent total until the university actually pays the expense.
-- The remaining balance is immediately reduced by the committed amount to prevent overspending.
-- All approved transactions must undergo a compliance verification before payment (allowable, allocable, reasonable).
-- Payments cannot exceed the approved amount unless a new approval request is submitted.
-- The transaction must follow procurement or travel rules based on category (equipment, supplies, airfare, etc.).
-- All post-approval activities must comply with Federal, Sponsor, and University policies.
+{TRANSACTION_POLICY_RULES}
+
+POLICY LEVEL: {name}
+{priority_note}
+
+POLICY TEXT:
+{policy_text}
+
+For each transaction explain WHY it is compliant or non-compliant with the {name} policy, referencing specific
+policy sections, whether it is allowable, allocable and reasonable, and whether it follows procurement/travel rules.
+
+Your output must be a JSON object in this exact format, with one entry per transaction listed below:
+{{
+  "results": [
+    {{"transaction_id": <id>, "result": "compliant" | "non-compliant" | "unknown", "reason": "Explanation written for a colleague."}}
+  ]
+}}
+
+Only return the JSON object, nothing else.
+
+AWARD CONTEXT (shared by all transactions):
+- Title: {award.get('title', 'N/A')}
+- Sponsor: {award.get('sponsor_type', 'N/A')}
+- Amount: ${float(award.get('amount') or 0):,.2f}
+- Start Date: {award.get('start_date', 'N/A')}
+- End Date: {award.get('end_date', 'N/A')}
+
+TRANSACTIONS:
+{listing}"""
+
+
+def check_transactions_compliance_batch(transactions, client):
+    """
+    {transaction_id: results} for many transactions (rows from load_transaction_for_compliance's
+    query). Rule-decided levels skip the LLM; the rest go out as one call per
+    (award, level, chunk), all concurrently. Levels whose call timed out carry
+    "timed_out": True. Also returns the number of LLM calls made.
+    """
+    results = {txn["transaction_id"]: {} for txn in transactions}
+    by_award = {}
+    for txn in transactions:
+        by_award.setdefault(txn["award_id"], []).append(txn)
+
+    futures = {}
+    calls_by_award = {}
+    for key, name in POLICY_LEVELS:
+        doc = policy_store.get(key)
+        if not doc or not doc["text"]:
+            for txn_id in results:
+                results[txn_id][key] = {"result": "unknown", "reason": f"{name} policy text not available"}
+            continue
+        rules = doc["rules"]
+        for award_id, award_txns in by_award.items():
+            pending = []
+            for txn in award_txns:
+                violations, escalate = evaluate_policy_rules(rules, transaction_line_items(txn))
+                verdict = rule_verdict(name, violations, escalate, 1)
+                if verdict is not None:
+                    results[txn["transaction_id"]][key] = verdict
+                elif client is None:
+                    results[txn["transaction_id"]][key] = {"result": "unknown", "reason": "API key missing"}
+                    results[txn["transaction_id"]]["error"] = "OpenAI API key not configured"
+                else:
+                    pending.append((txn, escalate))
+            award = {
+                "title": award_txns[0].get("title"),
+                "sponsor_type": award_txns[0].get("sponsor_type"),
+                "amount": award_txns[0].get("award_amount"),
+                "start_date": award_txns[0].get("start_date"),
+                "end_date": award_txns[0].get("end_date"),
+            }
+            for start in range(0, len(pending), BATCH_COMPLIANCE_CHUNK):
+                chunk = pending[start:start + BATCH_COMPLIANCE_CHUNK]
+                policy_text = policy_excerpt(
+                    doc, {TRANSACTION_RULE_CATEGORIES.get(txn.get("category") or "") for txn, _ in chunk},
+                    " ".join(txn.get("description") or "" for txn, _ in chunk),
+                )
+                prompt = build_batch_transaction_prompt(name, policy_text, POLICY_PRIORITY_NOTES.get(name, ""), award, chunk)
+                future = submit_llm_call(compliance_executor, _check_policy_level, client, name, prompt,
+                                         150 * len(chunk) + 100, call_log=calls_by_award.setdefault(award_id, []))
+                futures[future] = (key, [txn["transaction_id"] for txn, _ in chunk])
+
+    # Each chunk gets its own deadline from when a worker picks it up (see submit_llm_call)
+    remaining = set(futures)
+    timed_out = set()
+    queue_deadline = llm_queue_deadline(len(futures))
+    while remaining:
+        expired = expired_llm_calls(remaining, queue_deadline)
+        timed_out |= expired
+        remaining -= expired
+        if remaining:
+            wait(remaining, timeout=LLM_DEADLINE_POLL, return_when=FIRST_COMPLETED)
+            remaining = {future for future in remaining if not future.done()}
+    for future, (key, txn_ids) in futures.items():
+        if future in timed_out:
+            future.cancel()
+            # Marked so the route keeps whatever verdict was stored before for this level
+            fallback = {"result": "unknown", "reason": f"Policy check timed out after {LLM_CALL_TIMEOUT:.0f}s",
+                        "timed_out": True}
+            verdicts = {}
+        else:
+            response = future.result()
+            fallback = {"result": "unknown", "reason": response.get("reason") or "No verdict returned for this transaction"}
+            verdicts = {}
+            for entry in response.get("results") or []:
+                if isinstance(entry, dict):
+                    try:
+                        verdicts[int(entry.get("transaction_id"))] = {
+                            "result": entry.get("result", "unknown"), "reason": entry.get("reason", ""),
+                        }
+                    except (TypeError, ValueError):
+                        continue
+        for txn_id in txn_ids:
+            results[txn_id][key] = verdicts.get(txn_id, fallback)
+    # One call covers several transactions, so batch calls are logged against the award only
+    record_llm_calls([dict(call, award_id=award_id) for award_id, calls in calls_by_award.items() for call in list(calls)])
+
+    ordered = {}
+    for txn_id, levels in results.items():
+        ordered[txn_id] = {key: levels[key] for key, _ in POLICY_LEVELS}
+        if "error" in levels:
+            ordered[txn_id]["error"] = levels["error"]
+    return ordered, len(futures)
+
+
+@app.route("/transactions/check-compliance/batch", methods=["POST"])
+def check_transactions_compliance_batch_route():
+    """
+    Check every pending transaction (optionally ?award_id=...) in one pass and store each
+    transaction's verdict in compliance_notes. Admin/Finance only.
+    """
+    u = session.get("user")
+    if not u:
+        return make_response(json.dumps({"error": "Not authenticated"}), 401, {"Content-Type": "application/json"})
+    if u.get("role") not in ("Admin", "Finance"):
+        return make_response(json.dumps({"error": "Unauthorized"}), 403, {"Content-Type": "application/json"})
+    
+    award_id = request.args.get("award_id", type=int) or request.form.get("award_id", type=int)
+    conn = get_db()
+    if conn is None:
+        return make_response(json.dumps({"error": "DB connection failed"}), 500, {"Content-Type": "application/json"})
+    
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            """
+            SELECT t.*, a.title, a.sponsor_type, a.amount as award_amount,
+                   a.start_date, a.end_date
+            FROM transactions t
+            JOIN awards a ON t.award_id = a.award_id
+            WHERE t.status = 'Pending' AND (%s::int IS NULL OR t.award_id = %s)
+            ORDER BY t.award_id, t.transaction_id
+            LIMIT %s
+            """,
+            (award_id, award_id, BATCH_COMPLIANCE_MAX_ITEMS)
+        )
+        transactions = cur.fetchall()
+        cur.close()
+        # Don't hold the request's connection in a transaction across the LLM calls
+        conn.rollback()
+        
+        client = get_llm_client()
+        results, llm_calls = check_transactions_compliance_batch(transactions, client)
+        
+        # A timed-out level keeps the verdict stored before; a transaction without one is left alone
+        previous = {txn["transaction_id"]: txn.get("compliance_notes") for txn in transactions}
+        stored = []
+        for txn_id, r in results.items():
+            if "error" in r:
+                continue
+            timed_out = [key for key, _ in POLICY_LEVELS if r[key].get("timed_out")]
+            if timed_out:
+                try:
+                    notes = json.loads(previous.get(txn_id) or "")
+                except ValueError:
+                    notes = None
+                if not isinstance(notes, dict) or not all(isinstance(notes.get(key), dict) for key in timed_out):
+                    continue
+                r = dict(r, **{key: notes[key] for key in timed_out})
+            stored.append((txn_id, json.dumps(r)))
+        if stored:
+            cur = conn.cursor()
+            execute_values(
+                cur,
+                """
+                UPDATE transactions AS t SET compliance_notes = v.notes
+                FROM (VALUES %s) AS v(transaction_id, notes)
+                WHERE t.transaction_id = v.transaction_id
+                """,
+                stored,
+            )
+            conn.commit()
+            cur.close()
+    except Exception as e:
+        print(f"Error checking batch transaction compliance: {e}")
+        import traceback
+        traceback.print_exc()
+        conn.rollback()
+        return make_response(json.dumps({"error": str(e)}), 500, {"Content-Type": "application/json"})
+    finally:
+        conn.close()
+    
+    body = {
+        "checked": len(results),
+        "stored": len(stored),
+        "timed_out": sum(any(r[key].get("timed_out") for key, _ in POLICY_LEVELS) for r in results.values()),
+        "llm_calls": llm_calls,
+        "truncated": len(transactions) >= BATCH_COMPLIANCE_MAX_ITEMS,
+        "results": {str(txn_id): r for txn_id, r in results.items()},
+    }
+    return make_response(json.dumps(body, indent=2), 200, {"Content-Type": "application/json"})
+
+
+# ---- Compliance job queue ----
+# transaction_approve commits immediately and enqueues a job in the same transaction;
+# workers claim jobs with FOR UPDATE SKIP LOCKED and attach the verdict to
+# compliance_notes. A claimed job's run_after is its lease expiry, so a job whose
+# worker died is simply due again once the lease runs out.
+COMPLIANCE_JOB_LEASE = int(os.getenv("COMPLIANCE_JOB_LEASE", "120"))  # seconds
+COMPLIANCE_JOB_MAX_ATTEMPTS = int(os.getenv("COMPLIANCE_JOB_MAX_ATTEMPTS", "5"))
+COMPLIANCE_JOB_BACKOFF = int(os.getenv("COMPLIANCE_JOB_BACKOFF", "15"))  # first retry delay, doubles each attempt
+COMPLIANCE_JOB_BACKOFF_MAX = int(os.getenv("COMPLIANCE_JOB_BACKOFF_MAX", "900"))
+COMPLIANCE_WORKER_POLL = float(os.getenv("COMPLIANCE_WORKER_POLL", "2"))
+# In-process worker threads per web worker; set to 0 when running `flask compliance-worker` separately
+COMPLIANCE_WORKER_THREADS = int(os.getenv("COMPLIANCE_WORKER_THREADS", "1"))
+_compliance_workers = {"pid": None}
+_compliance_workers_lock = threading.Lock()
+
+
+class JobSubjectMissing(Exception):
+    """The row a job points at no longer exists; retrying won't help."""
+
+
+def enqueue_compliance_job(cur, kind, subject_id):
+    """Queue a compliance check inside the caller's transaction (no-op if one is already live)."""
+    cur.execute(
+        """
+        INSERT INTO compliance_jobs (kind, subject_id, max_attempts)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (kind, subject_id) WHERE status IN ('queued', 'running') DO NOTHING
+        """,
+        (kind, subject_id, COMPLIANCE_JOB_MAX_ATTEMPTS),
+    )
+
+
+def claim_compliance_job(worker_id):
+    """Lease the next due job to worker_id and return it, or None if nothing is due."""
+    conn = get_detached_db()
+    if conn is None:
+        return None
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        # A job whose last attempt crashed or hung is never claimed again; fail it once its lease runs out
+        cur.execute(
+            """
+            UPDATE compliance_jobs
+            SET status = 'failed', locked_by = NULL, locked_until = NULL,
+                last_error = COALESCE(last_error, 'Lease expired on final attempt'),
+                finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE status IN ('queued', 'running') AND attempts >= max_attempts
+              AND run_after <= CURRENT_TIMESTAMP
+            """
+        )
+        if cur.rowcount:
+            print(f"Compliance jobs: failed {cur.rowcount} job(s) that ran out of attempts")
+        cur.execute(
+            """
+            UPDATE compliance_jobs
+            SET status = 'running', attempts = attempts + 1, locked_by = %s,
+                locked_until = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                run_after = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = (
+                SELECT job_id FROM compliance_jobs
+                WHERE status IN ('queued', 'running') AND run_after <= CURRENT_TIMESTAMP
+                  AND attempts < max_attempts
+                ORDER BY run_after, job_id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING job_id, kind, subject_id, attempts, max_attempts
+            """,
+            (worker_id, COMPLIANCE_JOB_LEASE, COMPLIANCE_JOB_LEASE),
+        )
+        job = cur.fetchone()
+        conn.commit()
+        cur.close()
+        return job
+    except Exception as e:
+        print(f"Compliance job claim error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+
+def _compliance_results_incomplete(results):
+    return any(isinstance(r, dict) and r.get("result") == "unknown" for k, r in results.items() if k != "error")
+
+
+def run_compliance_job(job):
+    """Run the check a job describes and return the results dict (LLM calls happen here, no DB locks held)."""
+    if job["kind"] != "transaction":
+        raise JobSubjectMissing(f"Unknown job kind {job['kind']!r}")
+    conn = get_detached_db()
+    if conn is None:
+        raise RuntimeError("DB connection failed")
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        txn, award_data = load_transaction_for_compliance(cur, job["subject_id"])
+        cur.close()
+    finally:
+        conn.close()
+    if not txn:
+        raise JobSubjectMissing(f"Transaction {job['subject_id']} not found")
+    return check_transaction_compliance(txn, award_data)
+
+
+def finish_compliance_job(job, worker_id, results=None, error=None, retry=True):
+    """
+    Record a job's outcome. Complete results are attached to the transaction and the
+    job is done; otherwise it is retried with exponential backoff until max_attempts,
+    after which whatever results exist are attached and the job is marked failed.
+    Does nothing if the lease was lost to another worker.
+    """
+    incomplete = error is not None or results is None or _compliance_results_incomplete(results)
+    final = not incomplete or not retry or job["attempts"] >= job["max_attempts"]
+    if final:
+        status = "done" if not incomplete else "failed"
+        delay = 0
+    else:
+        status = "queued"
+        delay = min(COMPLIANCE_JOB_BACKOFF * 2 ** (job["attempts"] - 1), COMPLIANCE_JOB_BACKOFF_MAX)
+        delay += random.uniform(0, COMPLIANCE_JOB_BACKOFF)
+    if error is None and incomplete and results is not None:
+        error = "; ".join(
+            f"{k}: {r.get('reason')}" for k, r in results.items()
+            if isinstance(r, dict) and r.get("result") == "unknown"
+        )
+
+    conn = get_detached_db()
+    if conn is None:
+        return  # lease expiry will hand the job to someone else
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE compliance_jobs
+            SET status = %s, result = %s::jsonb, last_error = %s,
+                run_after = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                locked_by = NULL, locked_until = NULL, updated_at = CURRENT_TIMESTAMP,
+                finished_at = CASE WHEN %s THEN CURRENT_TIMESTAMP END
+            WHERE job_id = %s AND locked_by = %s AND status = 'running'
+            """,
+            (status, json.dumps(results) if results is not None else None, error,
+             delay, final, job["job_id"], worker_id),
+        )
+        if cur.rowcount == 0:
+            print(f"Compliance job {job['job_id']}: lease lost, discarding result")
+            conn.rollback()
+            return
+        if final and results is not None and job["kind"] == "transaction":
+            cur.execute(
+                "UPDATE transactions SET compliance_notes = %s WHERE transaction_id = %s",
+                (json.dumps(results), job["subject_id"]),
+            )
+            if any(isinstance(r, dict) and r.get("result") == "non-compliant" for r in results.values()):
+                print(f"WARNING: Transaction {job['subject_id']} approved despite non-compliant policy check")
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print(f"Compliance job {job['job_id']} finish error: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
 
-POLICY TEXT:
-{policy_text}
 
-TRANSACTION DATA:
-{transaction_text}
+def process_next_compliance_job(worker_id):
+    """Claim and process one job. Returns False when the queue had nothing due."""
+    job = claim_compliance_job(worker_id)
+    if job is None:
+        return False
+    try:
+        results = run_compliance_job(job)
+    except JobSubjectMissing as e:
+        finish_compliance_job(job, worker_id, error=str(e), retry=False)
+    except Exception as e:
+        print(f"Compliance job {job['job_id']} error: {e}")
+        finish_compliance_job(job, worker_id, error=str(e))
+    else:
+        finish_compliance_job(job, worker_id, results=results)
+    return True
 
-Analyze the transaction against the {name} policy above. Provide a comprehensive, human-like assessment that:
-1. Explains WHY the transaction is compliant or non-compliant based on policy requirements
-2. References specific policy sections and requirements
-3. For compliant items: Explain that it follows policy guidelines, is allowable and reasonable, and does not violate any rules
-4. For non-compliant items: Clearly state what policy is violated and why
-5. Avoid simply stating budget thresholds (e.g., "below $5000") - instead explain policy compliance in context
-6. Consider whether the transaction is necessary for the research, properly categorized, and follows procurement/travel rules
 
-Your output must be a JSON object in this exact format:
-{{
-  "result": "compliant" | "non-compliant" | "unknown",
-  "reason": "Comprehensive explanation that reads naturally, explains policy compliance, references specific policy sections, and explains why the transaction follows or violates policy requirements. Write as if explaining to a colleague, not just listing thresholds."
-}}
+def run_compliance_worker(worker_id, stop_event=None):
+    """Process jobs until stop_event is set, polling when the queue is empty."""
+    print(f"Compliance worker {worker_id} started")
+    while stop_event is None or not stop_event.is_set():
+        try:
+            busy = process_next_compliance_job(worker_id)
+        except Exception as e:
+            print(f"Compliance worker {worker_id} error: {e}")
+            busy = False
+        if not busy:
+            time.sleep(COMPLIANCE_WORKER_POLL * random.uniform(0.5, 1.5))
 
-Example of good explanation for compliant: "This transaction complies with {name} policy requirements. The {transaction.get('category', 'expense')} expense is necessary for the research project as described, falls within acceptable policy limits, and follows the procurement guidelines specified in Section 2. The amount is reasonable and allocable to the award, and the transaction does not violate any policy restrictions. It is properly categorized and meets all applicable policy requirements."
 
-Example of good explanation for non-compliant: "This transaction violates {name} policy in Section 3 (Travel). The transaction exceeds the $5,000 per-trip threshold without prior approval as required by policy. Additionally, the description suggests personal travel expenses which are explicitly prohibited. These violations must be addressed before approval."
+@app.before_request
+def ensure_compliance_workers():
+    """Start this process's in-process worker threads on its first request."""
+    if COMPLIANCE_WORKER_THREADS <= 0 or _compliance_workers["pid"] == os.getpid():
+        return
+    with _compliance_workers_lock:
+        if _compliance_workers["pid"] == os.getpid():
+            return
+        _compliance_workers["pid"] = os.getpid()
+        for n in range(COMPLIANCE_WORKER_THREADS):
+            worker_id = f"{socket.gethostname()}:{os.getpid()}:{n}"
+            threading.Thread(target=run_compliance_worker, args=(worker_id,), daemon=True,
+                             name=f"compliance-worker-{n}").start()
 
-Only return the JSON object, nothing else."""
 
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a policy compliance officer. Provide comprehensive, human-like explanations that explain policy compliance in context. Always respond with valid JSON only."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.4,  # Slightly higher for more natural language
-                max_tokens=600  # Increased for more comprehensive explanations
-            )
-            
-            # Parse JSON response
-            response_text = response.choices[0].message.content.strip()
-            # Remove markdown code blocks if present
-            if response_text.startswith("```"):
-                response_text = response_text.split("```")[1]
-                if response_text.startswith("json"):
-                    response_text = response_text[4:]
-                response_text = response_text.strip()
-            
-            compliance_result = json.loads(response_text)
-            results[key] = compliance_result
-            
-        except json.JSONDecodeError as e:
-            print(f"Error parsing JSON response for {name} policy: {e}")
-            response_text_str = response_text if 'response_text' in locals() else "No response received"
-            print(f"Response was: {response_text_str}")
-            results[key] = {"result": "unknown", "reason": f"Error parsing LLM response: {str(e)}"}
-        except Exception as e:
-            print(f"Error checking {name} policy compliance: {e}")
-            import traceback
-            traceback.print_exc()
-            results[key] = {"result": "unknown", "reason": f"Error: {str(e)}"}
-    
-    return results
+@app.cli.command("compliance-worker")
+def compliance_worker_command():
+    """Run a standalone compliance job worker."""
+    run_compliance_worker(f"{socket.gethostname()}:{os.getpid()}:cli")
 
 
-@app.route("/awards/<int:award_id>/check-compliance", methods=["POST"])
-def check_award_compliance(award_id):
-    """Check policy compliance for an award using LLM."""
+@app.route("/admin/compliance-jobs")
+def admin_compliance_jobs():
+    """Queue depth by status, oldest due job, recent failures; ?transaction_id= shows one transaction's jobs."""
     u = session.get("user")
-    if not u:
-        return make_response(json.dumps({"error": "Not authenticated"}), 401, {"Content-Type": "application/json"})
-    
-    # Only Admin can check compliance
-    if u.get("role") != "Admin":
+    if not u or u.get("role") not in ("Admin", "Finance"):
         return make_response(json.dumps({"error": "Unauthorized"}), 403, {"Content-Type": "application/json"})
     
     conn = get_db()
     if conn is None:
         return make_response(json.dumps({"error": "DB connection failed"}), 500, {"Content-Type": "application/json"})
     
+    transaction_id = request.args.get("transaction_id", type=int)
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Get award
-        cur.execute("SELECT * FROM awards WHERE award_id=%s", (award_id,))
-        award = cur.fetchone()
-        
-        if not award:
-            cur.close()
-            conn.close()
-            return make_response(json.dumps({"error": "Award not found"}), 404, {"Content-Type": "application/json"})
-        
-        # Parse JSON fields
-        def parse_json(field_name):
-            raw = award.get(field_name)
-            if raw is None:
-                return []
-            if isinstance(raw, (dict, list)):
-                return raw
-            try:
-                return json.loads(raw)
-            except Exception:
-                return []
-        
-        personnel = parse_json("personnel_json")
-        domestic_travel = parse_json("domestic_travel_json")
-        international_travel = parse_json("international_travel_json")
-        materials = parse_json("materials_json")
-        equipment = parse_json("equipment_json")
-        other_direct = parse_json("other_direct_json")
-        
+        if transaction_id:
+            cur.execute(
+                """
+                SELECT job_id, status, attempts, max_attempts, run_after, locked_by, last_error,
+                       created_at, finished_at, result
+                FROM compliance_jobs
+                WHERE kind = 'transaction' AND subject_id = %s
+                ORDER BY job_id DESC
+                """,
+                (transaction_id,),
+            )
+            body = {"transaction_id": transaction_id, "jobs": cur.fetchall()}
+        else:
+            cur.execute("SELECT status, COUNT(*) AS count FROM compliance_jobs GROUP BY status")
+            counts = {row["status"]: row["count"] for row in cur.fetchall()}
+            cur.execute(
+                """
+                SELECT EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - MIN(run_after)) AS oldest_due_seconds
+                FROM compliance_jobs
+                WHERE status IN ('queued', 'running') AND run_after <= CURRENT_TIMESTAMP
+                """
+            )
+            oldest = cur.fetchone()["oldest_due_seconds"]
+            cur.execute(
+                """
+                SELECT job_id, kind, subject_id, attempts, last_error, finished_at
+                FROM compliance_jobs WHERE status = 'failed'
+                ORDER BY finished_at DESC LIMIT 20
+                """
+            )
+            body = {
+                "counts": {status: counts.get(status, 0) for status in ("queued", "running", "done", "failed")},
+                "oldest_due_seconds": float(oldest) if oldest is not None else None,
+                "recent_failures": cur.fetchall(),
+                "worker_threads_per_process": COMPLIANCE_WORKER_THREADS,
+            }
         cur.close()
-        conn.close()
-        
-        # Check compliance
-        compliance_results = check_policy_compliance(award, personnel, domestic_travel, international_travel, materials, equipment, other_direct)
-        
-        # Store results in database (optional - update ai_review_notes)
-        if "error" not in compliance_results:
-            conn = get_db()
-            if conn:
-                try:
-                    cur = conn.cursor()
-                    notes = json.dumps(compliance_results)
-                    cur.execute(
-                        "UPDATE awards SET ai_review_notes = %s WHERE award_id = %s",
-                        (notes, award_id)
-                    )
-                    conn.commit()
-                    cur.close()
-                except Exception as e:
-                    print(f"Error saving compliance results: {e}")
-                finally:
-                    conn.close()
-        
-        return make_response(json.dumps(compliance_results, indent=2), 200, {"Content-Type": "application/json"})
-        
     except Exception as e:
-        print(f"Error checking compliance: {e}")
+        print(f"Compliance jobs stats error: {e}")
         return make_response(json.dumps({"error": str(e)}), 500, {"Content-Type": "application/json"})
+    finally:
+        conn.close()
+    
+    return make_response(json.dumps(body, indent=2, default=str), 200, {"Content-Type": "application/json"})
 
 
-@app.route("/transactions/<int:transaction_id>/check-compliance", methods=["POST"])
-def check_transaction_compliance_route(transaction_id):
-    """Check policy compliance for a transaction using LLM."""
+@app.route("/admin/init-db", methods=["POST"])
+def admin_init_db():
+    """
+    Admin route to bring the database schema up to date (no-op when already at head).
+    POST only, so a link or image loaded cross-site can't change the schema;
+    GET /admin/migrations shows what would run.
+    """
     u = session.get("user")
-    if not u:
-        return make_response(json.dumps({"error": "Not authenticated"}), 401, {"Content-Type": "application/json"})
+    if not u or u.get("role") != "Admin":
+        return "Unauthorized - Admin access required", 403
     
-    # Only Admin/Finance can check compliance
-    if u.get("role") not in ("Admin", "Finance"):
+    try:
+        migrate()
+    except MigrationError as e:
+        print(f"DB init error: {e}")
+        return f"Error initializing database: {str(e)}", 500
+    
+    # Redirect to subawards page after successful initialization
+    return redirect(url_for("subawards"))
+
+
+@app.route("/admin/migrations")
+def admin_migrations():
+    """Applied and pending schema migrations."""
+    u = session.get("user")
+    if not u or u.get("role") != "Admin":
+        return make_response(json.dumps({"error": "Unauthorized"}), 403, {"Content-Type": "application/json"})
+    status = migration_status()
+    if status is None:
+        return make_response(json.dumps({"error": "DB connection failed"}), 500, {"Content-Type": "application/json"})
+    return make_response(json.dumps(status, indent=2), 200, {"Content-Type": "application/json"})
+
+
+@app.route("/admin/budget-rollups/reconcile", methods=["GET", "POST"])
+def admin_reconcile_rollups():
+    """Compare transaction_rollups with the raw transactions; POST also repairs drift."""
+    u = session.get("user")
+    if not u or u.get("role") != "Admin":
+        return make_response(json.dumps({"error": "Unauthorized"}), 403, {"Content-Type": "application/json"})
+    
+    award_id = request.values.get("award_id", type=int)
+    repair = request.method == "POST"
+    mismatches = reconcile_transaction_rollups(award_id=award_id, repair=repair)
+    if mismatches is None:
+        return make_response(json.dumps({"error": "Reconciliation failed"}), 500, {"Content-Type": "application/json"})
+    
+    body = {
+        "award_id": award_id,
+        "consistent": not mismatches,
+        "repaired": repair and bool(mismatches),
+        "mismatches": mismatches,
+    }
+    return make_response(json.dumps(body, indent=2), 200, {"Content-Type": "application/json"})
+
+
+@app.route("/admin/db-pool")
+def admin_db_pool():
+    """Connection pool saturation stats for this worker process."""
+    u = session.get("user")
+    if not u or u.get("role") != "Admin":
+        return make_response(json.dumps({"error": "Unauthorized"}), 403, {"Content-Type": "application/json"})
+    return make_response(json.dumps(get_db_pool().stats(), indent=2), 200, {"Content-Type": "application/json"})
+
+
+@app.route("/admin/compliance-cache", methods=["GET", "POST"])
+def admin_compliance_cache():
+    """
+    GET: verdict cache hit/miss counters for this worker plus persistent-tier totals.
+    POST: purge expired rows (or everything with ?all=1).
+    """
+    u = session.get("user")
+    if not u or u.get("role") != "Admin":
         return make_response(json.dumps({"error": "Unauthorized"}), 403, {"Content-Type": "application/json"})
     
     conn = get_db()
@@ -4611,166 +7535,125 @@ def check_transaction_compliance_route(transaction_id):
     
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Get transaction with award info
+        purged = None
+        if request.method == "POST":
+            if request.args.get("all") == "1":
+                cur.execute("DELETE FROM compliance_cache")
+                compliance_cache.clear_local()
+            else:
+                cur.execute("DELETE FROM compliance_cache WHERE expires_at <= CURRENT_TIMESTAMP")
+            purged = cur.rowcount
+            conn.commit()
         cur.execute(
             """
-            SELECT t.*, a.title, a.sponsor_type, a.amount as award_amount,
-                   a.start_date, a.end_date
-            FROM transactions t
-            JOIN awards a ON t.award_id = a.award_id
-            WHERE t.transaction_id = %s
-            """,
-            (transaction_id,)
+            SELECT COUNT(*) AS rows,
+                   COUNT(*) FILTER (WHERE expires_at > CURRENT_TIMESTAMP) AS live_rows,
+                   COALESCE(SUM(hit_count), 0) AS total_hits
+            FROM compliance_cache
+            """
         )
-        txn = cur.fetchone()
-        
-        if not txn:
-            cur.close()
-            conn.close()
-            return make_response(json.dumps({"error": "Transaction not found"}), 404, {"Content-Type": "application/json"})
-        
-        # Format award data for compliance check
-        award_data = {
-            'title': txn.get('title', ''),
-            'sponsor_type': txn.get('sponsor_type', ''),
-            'amount': float(txn.get('award_amount', 0) or 0),
-            'start_date': txn.get('start_date', ''),
-            'end_date': txn.get('end_date', '')
-        }
-        
+        persistent = cur.fetchone()
         cur.close()
-        conn.close()
-        
-        # Check compliance
-        compliance_results = check_transaction_compliance(txn, award_data)
-        
-        # Store results in database (update compliance_notes)
-        if "error" not in compliance_results:
-            conn = get_db()
-            if conn:
-                try:
-                    cur = conn.cursor()
-                    notes = json.dumps(compliance_results)
-                    cur.execute(
-                        "UPDATE transactions SET compliance_notes = %s WHERE transaction_id = %s",
-                        (notes, transaction_id)
-                    )
-                    conn.commit()
-                    cur.close()
-                except Exception as e:
-                    print(f"Error saving transaction compliance results: {e}")
-                finally:
-                    conn.close()
-        
-        return make_response(json.dumps(compliance_results, indent=2), 200, {"Content-Type": "application/json"})
-        
     except Exception as e:
-        print(f"Error checking transaction compliance: {e}")
-        import traceback
-        traceback.print_exc()
+        print(f"Compliance cache stats error: {e}")
+        conn.rollback()
         return make_response(json.dumps({"error": str(e)}), 500, {"Content-Type": "application/json"})
+    finally:
+        conn.close()
+    
+    body = {"process": compliance_cache.stats(), "persistent": persistent}
+    if purged is not None:
+        body["purged"] = purged
+    return make_response(json.dumps(body, indent=2, default=str), 200, {"Content-Type": "application/json"})
 
 
-@app.route("/admin/init-db", methods=["GET", "POST"])
-def admin_init_db():
-    """Admin route to manually initialize database schema."""
+@app.route("/admin/llm-client")
+def admin_llm_client():
+    """
+    Breaker state, retry/error counters and recent call latency for this worker's LLM
+    client, with its rate-limit waits and the shared bucket all workers draw from.
+    """
     u = session.get("user")
     if not u or u.get("role") != "Admin":
-        return "Unauthorized - Admin access required", 403
-    
-    if request.method == "POST":
-        conn = get_db()
-        if conn is None:
-            return "Database connection failed", 500
-        
-        try:
-            cur = conn.cursor()
-            schema_file = os.path.join(os.path.dirname(__file__), "schema_postgresql.sql")
-            if os.path.exists(schema_file):
-                with open(schema_file, 'r') as f:
-                    schema_sql = f.read()
-                
-                # Remove comments and execute
-                lines = schema_sql.split('\n')
-                cleaned_lines = []
-                for line in lines:
-                    stripped = line.strip()
-                    if stripped and not stripped.startswith('--'):
-                        cleaned_lines.append(line)
-                cleaned_sql = '\n'.join(cleaned_lines)
-                
-                try:
-                    cur.execute(cleaned_sql)
-                    conn.commit()
-                    message = "✓ Database schema initialized successfully!"
-                except Exception as full_error:
-                    # Try statement by statement
-                    statements = schema_sql.split(';')
-                    executed = 0
-                    for statement in statements:
-                        statement = statement.strip()
-                        if statement and not statement.startswith('--') and not statement.upper().startswith('SELECT'):
-                            try:
-                                cur.execute(statement)
-                                executed += 1
-                            except Exception as stmt_error:
-                                error_msg = str(stmt_error)
-                                if 'already exists' not in error_msg.lower():
-                                    print(f"Statement error: {stmt_error}")
-                    conn.commit()
-                    message = f"✓ Database schema initialized! ({executed} statements executed)"
-                
-                # Update status constraints after schema initialization
-                update_transactions_status_constraint()
-                update_subawards_status_constraint()
-                
-                cur.close()
-                conn.close()
-                # Redirect to subawards page after successful initialization
-                return redirect(url_for("subawards"))
-            else:
-                return f"Schema file not found: {schema_file}", 404
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            return f"Error initializing database: {str(e)}", 500
-    
-    # GET request - automatically initialize and redirect
-    # No confirmation page, just do it
+        return make_response(json.dumps({"error": "Unauthorized"}), 403, {"Content-Type": "application/json"})
+
+    client = get_llm_client()
+    if client is None:
+        return make_response(json.dumps({"error": "OpenAI API key not configured"}), 503, {"Content-Type": "application/json"})
+    return make_response(json.dumps(client.stats(), indent=2, default=str), 200, {"Content-Type": "application/json"})
+
+
+LLM_USAGE_SQL = """
+    SELECT {select_cols},
+           COUNT(*) AS calls,
+           COUNT(*) FILTER (WHERE error IS NOT NULL) AS errors,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY latency_ms) AS p50_latency_ms,
+           percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms) AS p95_latency_ms,
+           COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+           COALESCE(SUM(completion_tokens), 0) AS completion_tokens,
+           COALESCE(SUM(cached_tokens), 0) AS cached_tokens,
+           COALESCE(SUM(cached_tokens)::float / NULLIF(SUM(prompt_tokens), 0), 0) AS cached_share,
+           COALESCE(SUM(cost_usd), 0) AS cost_usd
+    FROM llm_responses
+    WHERE timestamp >= CURRENT_DATE - make_interval(days => %s) AND latency_ms IS NOT NULL
+    GROUP BY {group_by}
+    ORDER BY {order}
+"""
+
+
+@app.route("/admin/llm-usage")
+def admin_llm_usage():
+    """
+    LLM calls, p50/p95 latency, tokens (with the share served from the provider's prompt
+    cache) and spend per day and per route over the last ?days=N (default 14).
+    """
+    u = session.get("user")
+    if not u or u.get("role") != "Admin":
+        return make_response(json.dumps({"error": "Unauthorized"}), 403, {"Content-Type": "application/json"})
+
+    try:
+        days = min(max(int(request.args.get("days", 14)), 1), 365)
+    except ValueError:
+        return make_response(json.dumps({"error": "days must be an integer"}), 400, {"Content-Type": "application/json"})
+
     conn = get_db()
     if conn is None:
-        return "Database connection failed", 500
-    
+        return make_response(json.dumps({"error": "DB connection failed"}), 500, {"Content-Type": "application/json"})
+
     try:
-        cur = conn.cursor()
-        schema_file = os.path.join(os.path.dirname(__file__), "schema_postgresql.sql")
-        if os.path.exists(schema_file):
-            with open(schema_file, 'r') as f:
-                schema_sql = f.read()
-            
-            # Execute statements
-            statements = schema_sql.split(';')
-            for statement in statements:
-                statement = statement.strip()
-                if statement and not statement.startswith('--') and not statement.upper().startswith('SELECT'):
-                    try:
-                        cur.execute(statement)
-                    except Exception:
-                        pass  # Ignore errors (tables might already exist)
-            conn.commit()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(LLM_USAGE_SQL.format(select_cols="timestamp::date AS day, route", group_by="day, route",
+                                         order="day DESC, cost_usd DESC"), (days,))
+        by_day = cur.fetchall()
+        cur.execute(LLM_USAGE_SQL.format(select_cols="route", group_by="route", order="cost_usd DESC"), (days,))
+        by_route = cur.fetchall()
         cur.close()
+    except Exception as e:
+        print(f"LLM usage stats error: {e}")
+        conn.rollback()
+        return make_response(json.dumps({"error": str(e)}), 500, {"Content-Type": "application/json"})
+    finally:
         conn.close()
-    except Exception:
-        pass
-    
-    # Always redirect to subawards
-    return redirect(url_for("subawards"))
+
+    body = {"days": days, "by_route": by_route, "by_day": by_day}
+    return make_response(json.dumps(body, indent=2, default=str), 200, {"Content-Type": "application/json"})
+
+
+@app.route("/admin/policies", methods=["GET", "POST"])
+def admin_policies():
+    """
+    GET: the policy documents this worker has loaded (hash, mtime, token counts per section).
+    POST: re-read the policy files now instead of waiting for the mtime check.
+    """
+    u = session.get("user")
+    if not u or u.get("role") != "Admin":
+        return make_response(json.dumps({"error": "Unauthorized"}), 403, {"Content-Type": "application/json"})
+
+    if request.method == "POST":
+        policy_store.reload()
+    return make_response(json.dumps(policy_store.info(), indent=2), 200, {"Content-Type": "application/json"})
 
 
 if __name__ == "__main__":
     init_db_if_needed()
-    # Ensure transactions and subawards constraints include 'Paid' status
-    update_transactions_status_constraint()
-    update_subawards_status_constraint()
     app.run(debug=True, port=8000)
@@ -0,0 +1,77 @@
+"""
+Compliance check wall time: policy levels one after another (old) vs concurrently (new).
+
+Starts the mock LLM on a local port with a fixed per-call latency, then times
+check_transaction_compliance with a single-worker executor (the old sequential
+behaviour) and with the app's shared pool. Concurrent wall time should be close
+to one call's latency instead of three.
+
+Usage:
+    python benchmarks/bench_compliance_latency.py --latency 1.5 --repeat 3
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_llm import start_mock_llm  # noqa: E402
+
+# Personnel charges always need the LLM's judgment, so the rule engine can't short-circuit this one
+TRANSACTION = {
+    "category": "Personnel",
+    "description": "Graduate research assistant stipend, spring term",
+    "amount": 1850.00,
+    "date_submitted": "2026-03-02",
+}
+AWARD = {
+    "title": "Soil Microbiome Resilience",
+    "sponsor_type": "NSF",
+    "amount": 250000.00,
+    "start_date": "2026-01-01",
+    "end_date": "2028-12-31",
+}
+
+
+def timed(app, executor, repeat):
+    app.compliance_executor = executor
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = app.check_transaction_compliance(TRANSACTION, AWARD)
+        samples.append(time.perf_counter() - start)
+        assert all(results[key]["result"] == "compliant" for key, _ in app.POLICY_LEVELS), results
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--latency", type=float, default=1.0, help="mock seconds per LLM call")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    server, base_url = start_mock_llm(latency=args.latency)
+    os.environ["LLM_BASE_URL"] = base_url
+    os.environ["OPENAI_API_KEY"] = "mock"
+    os.environ["COMPLIANCE_CACHE"] = "off"  # every repeat must reach the (mock) LLM
+    os.environ["LLM_CALL_LOG"] = "off"  # no database needed
+    os.environ["LLM_RATE_LIMIT"] = "off"
+    import app  # noqa: E402
+
+    try:
+        shared = app.compliance_executor
+        sequential_s = timed(app, ThreadPoolExecutor(max_workers=1), args.repeat)
+        concurrent_s = timed(app, shared, args.repeat)
+        print(f"mock latency per call: {args.latency:.2f} s")
+        print(f"sequential:  {sequential_s:6.2f} s")
+        print(f"concurrent:  {concurrent_s:6.2f} s  ({sequential_s / concurrent_s:.1f}x faster)")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
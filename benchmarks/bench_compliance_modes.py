@@ -0,0 +1,147 @@
+"""
+Compliance modes: one request per policy level (per-level) vs all levels in one request (combined).
+
+Runs check_transaction_compliance over transactions the rule engine can't decide,
+once per COMPLIANCE_MODE, and reports LLM requests, prompt/completion tokens, median
+wall time and how often the two modes agree on each level's verdict, plus the share of
+prompt tokens served from the provider's prompt cache. By default it
+runs against the mock LLM: requests and prompt tokens are meaningful there, while
+latency is just the mock's and agreement is trivially 100%. Use --live (with
+OPENAI_API_KEY set) to measure real generation time and verdict agreement.
+
+Usage:
+    python benchmarks/bench_compliance_modes.py --latency 1.5 --repeat 3
+    OPENAI_API_KEY=sk-... python benchmarks/bench_compliance_modes.py --live
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_llm import start_mock_llm  # noqa: E402
+
+# Each of these needs the LLM's judgment, so no level is short-circuited by the rule engine
+TRANSACTIONS = [
+    {"category": "Personnel", "description": "Graduate research assistant stipend, spring term",
+     "amount": 1850.00, "date_submitted": "2026-03-02"},
+    {"category": "Travel", "description": "Field sampling trip, airfare and lodging",
+     "amount": 2400.00, "date_submitted": "2026-03-09"},
+    {"category": "Materials", "description": "Coffee and snacks for weekly lab meeting",
+     "amount": 85.00, "date_submitted": "2026-03-11"},
+    {"category": "Other Direct Costs", "description": "Professional society membership dues",
+     "amount": 240.00, "date_submitted": "2026-03-16"},
+]
+AWARD = {
+    "title": "Soil Microbiome Resilience",
+    "sponsor_type": "NSF",
+    "amount": 250000.00,
+    "start_date": "2026-01-01",
+    "end_date": "2028-12-31",
+}
+
+
+class UsageRecorder:
+    """Stands in for app.OpenAI and tallies the usage block of every completion."""
+
+    def __init__(self, openai_cls):
+        self.openai_cls = openai_cls
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+
+    def __call__(self, *args, **kwargs):
+        client = self.openai_cls(*args, **kwargs)
+        create = client.chat.completions.create
+
+        def recorded_create(*a, **kw):
+            response = create(*a, **kw)
+            with self.lock:
+                self.calls += 1
+                if response.usage:
+                    self.prompt_tokens += response.usage.prompt_tokens
+                    self.completion_tokens += response.usage.completion_tokens
+                    details = getattr(response.usage, "prompt_tokens_details", None)
+                    self.cached_tokens += getattr(details, "cached_tokens", None) or 0
+            return response
+
+        client.chat.completions.create = recorded_create
+        return client
+
+
+def run_mode(app, recorder, mode, repeat):
+    app.COMPLIANCE_MODE = mode
+    recorder.reset()
+    samples, verdicts = [], []
+    for _ in range(repeat):
+        verdicts = []
+        for transaction in TRANSACTIONS:
+            start = time.perf_counter()
+            results = app.check_transaction_compliance(transaction, AWARD)
+            samples.append(time.perf_counter() - start)
+            verdicts.append({key: results[key]["result"] for key, _ in app.POLICY_LEVELS})
+    checks = repeat * len(TRANSACTIONS)
+    return {
+        "calls": recorder.calls / checks,
+        "prompt_tokens": recorder.prompt_tokens / checks,
+        "completion_tokens": recorder.completion_tokens / checks,
+        "cached_share": recorder.cached_tokens / recorder.prompt_tokens if recorder.prompt_tokens else 0.0,
+        "median_s": statistics.median(samples),
+        "verdicts": verdicts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--latency", type=float, default=1.0, help="mock seconds per LLM call")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--live", action="store_true", help="call the real API instead of the mock")
+    args = parser.parse_args()
+
+    server = None
+    if args.live:
+        if not os.getenv("OPENAI_API_KEY"):
+            sys.exit("--live needs OPENAI_API_KEY")
+    else:
+        server, base_url = start_mock_llm(latency=args.latency)
+        os.environ["LLM_BASE_URL"] = base_url
+        os.environ["OPENAI_API_KEY"] = "mock"
+    os.environ["COMPLIANCE_CACHE"] = "off"  # every repeat must reach the LLM
+    os.environ["LLM_CALL_LOG"] = "off"  # no database needed
+    os.environ["LLM_RATE_LIMIT"] = "off"
+    import app  # noqa: E402
+
+    recorder = UsageRecorder(app.OpenAI)
+    app.OpenAI = recorder
+    try:
+        per_level = run_mode(app, recorder, "per-level", args.repeat)
+        combined = run_mode(app, recorder, "combined", args.repeat)
+        pairs = [(a[key], b[key]) for a, b in zip(per_level["verdicts"], combined["verdicts"]) for key in a]
+        agreement = sum(a == b for a, b in pairs) / len(pairs)
+
+        print(f"{'mode':<10} {'calls/check':>12} {'prompt tok':>11} {'cached':>7} {'completion tok':>15} {'median (s)':>11}")
+        for mode, stats in (("per-level", per_level), ("combined", combined)):
+            print(f"{mode:<10} {stats['calls']:>12.1f} {stats['prompt_tokens']:>11.0f} {stats['cached_share']:>6.0%} "
+                  f"{stats['completion_tokens']:>15.0f} {stats['median_s']:>11.2f}")
+        print(f"prompt tokens saved: {1 - combined['prompt_tokens'] / per_level['prompt_tokens']:.0%}")
+        print(f"verdict agreement (last repeat, {len(pairs)} level verdicts): {agreement:.0%}")
+        for transaction, a, b in zip(TRANSACTIONS, per_level["verdicts"], combined["verdicts"]):
+            for key in a:
+                if a[key] != b[key]:
+                    print(f"  differs: {transaction['description']!r} {key}: per-level={a[key]} combined={b[key]}")
+    finally:
+        if server:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Compliance throughput: checks per second and tail latency at increasing concurrency.
+
+Drives check_transaction_compliance from N client threads for a fixed duration at each
+concurrency level, against the mock LLM started in-process (or any OpenAI-compatible
+server given with --base-url, e.g. mock_llm.py --replay). Reports throughput,
+p50/p95/p99 check latency and the share of checks with a level that came back
+'unknown' (provider errors, timeouts, open breaker, rate limit), plus the mock's
+injected errors and the app's retry counters. --rpm/--tpm turn on the shared Postgres
+rate limiter (DATABASE_URL must point at a migrated database) and report its queue waits;
+run several copies at once to see them share one budget.
+
+Usage:
+    python benchmarks/load_compliance.py --concurrency 1 4 16 64 --duration 20
+    python benchmarks/load_compliance.py --distribution lognormal --latency 1.5 --rate-429 0.05
+    python benchmarks/load_compliance.py --base-url http://127.0.0.1:8089/v1
+    python benchmarks/load_compliance.py --concurrency 16 --rpm 120 --tpm 200000
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_compliance_modes import AWARD, TRANSACTIONS  # noqa: E402
+from mock_llm import start_mock_llm  # noqa: E402
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else float("nan")
+
+
+def run_level(app, concurrency, duration):
+    """Closed loop: each thread starts its next check as soon as the last one returns."""
+    latencies, degraded = [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        while time.monotonic() < deadline:
+            transaction = random.choice(TRANSACTIONS)
+            start = time.perf_counter()
+            results = app.check_transaction_compliance(transaction, AWARD)
+            elapsed = time.perf_counter() - start
+            unknown = any(results[key]["result"] == "unknown" for key, _ in app.POLICY_LEVELS)
+            with lock:
+                latencies.append(elapsed)
+                degraded.append(unknown)
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.monotonic() - start
+    return {
+        "checks": len(latencies),
+        "per_s": len(latencies) / wall,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "unknown": sum(degraded) / len(degraded) if degraded else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per concurrency level")
+    parser.add_argument("--base-url", help="use an already running OpenAI-compatible server")
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--distribution", choices=["fixed", "uniform", "lognormal"])
+    parser.add_argument("--sigma", type=float, default=0.5)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-500", type=float, default=0.0)
+    parser.add_argument("--rate-timeout", type=float, default=0.0)
+    parser.add_argument("--replay", help="serve replies from a mock_llm.py recording")
+    parser.add_argument("--workers", type=int, help="COMPLIANCE_WORKERS (default: 3 x the highest concurrency)")
+    parser.add_argument("--call-timeout", type=float, default=10.0, help="LLM_CALL_TIMEOUT for the app")
+    parser.add_argument("--rpm", type=float, help="LLM_RATE_LIMIT_RPM; enables the shared rate limiter")
+    parser.add_argument("--tpm", type=float, help="LLM_RATE_LIMIT_TPM; enables the shared rate limiter")
+    args = parser.parse_args()
+
+    server = None
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        server, base_url = start_mock_llm(
+            latency=args.latency, jitter=args.jitter, distribution=args.distribution, sigma=args.sigma,
+            rate_429=args.rate_429, rate_500=args.rate_500, rate_timeout=args.rate_timeout,
+            hang=args.call_timeout * 3, replay=args.replay,
+        )
+    os.environ["LLM_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    os.environ["COMPLIANCE_CACHE"] = "off"  # every check must reach the LLM
+    os.environ["LLM_CALL_LOG"] = "off"  # no database needed
+    os.environ["LLM_CALL_TIMEOUT"] = str(args.call_timeout)
+    os.environ["COMPLIANCE_WORKERS"] = str(args.workers or 3 * max(args.concurrency))
+    os.environ["LLM_RATE_LIMIT"] = "on" if args.rpm or args.tpm else "off"
+    if args.rpm:
+        os.environ["LLM_RATE_LIMIT_RPM"] = str(args.rpm)
+    if args.tpm:
+        os.environ["LLM_RATE_LIMIT_TPM"] = str(args.tpm)
+    import app  # noqa: E402
+
+    try:
+        print(f"LLM endpoint: {base_url}   compliance workers: {app.COMPLIANCE_WORKERS}")
+        print(f"{'clients':>8} {'checks':>8} {'checks/s':>9} {'p50 (s)':>8} {'p95 (s)':>8} {'p99 (s)':>8} {'unknown':>8}")
+        for concurrency in args.concurrency:
+            row = run_level(app, concurrency, args.duration)
+            print(f"{concurrency:>8} {row['checks']:>8} {row['per_s']:>9.2f} {row['p50']:>8.2f} "
+                  f"{row['p95']:>8.2f} {row['p99']:>8.2f} {row['unknown']:>7.1%}")
+        if server:
+            mock_stats = Counter(server.RequestHandlerClass.config.stats)
+            print("mock:", ", ".join(f"{k}={v}" for k, v in sorted(mock_stats.items())))
+        client = app.get_llm_client()
+        if client:
+            stats = client.stats()
+            print(f"app client: breaker={stats['breaker']}, "
+                  + ", ".join(f"{k}={v}" for k, v in sorted(stats["counters"].items())))
+            limit = stats["rate_limit"]
+            if limit:
+                print(f"rate limit: {limit['requests_per_minute']:.0f} rpm / {limit['tokens_per_minute']:.0f} tpm, "
+                      f"wait p50={limit['wait_ms']['p50']}ms p95={limit['wait_ms']['p95']}ms "
+                      f"max={limit['wait_ms']['max']}ms, "
+                      + ", ".join(f"{k}={v}" for k, v in sorted(limit["counters"].items())))
+    finally:
+        if server:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint.
+
+Answers POST /v1/chat/completions with a canned compliance verdict, so LLM-bound code
+paths can be timed and load-tested without network calls or API spend. Requests with
+a json_schema response_format get one verdict per schema property, and prompts listing
+[Item n] or [Transaction id] entries get {"results": [...]} with one verdict per entry,
+the shape the per-item award and batch transaction checks ask for; "stream": true
+requests get the reply as SSE chunks spread over the latency. Usage is estimated at
+four characters per token. Prompt caching is simulated like OpenAI's: the longest
+prompt prefix seen before, from 1,024 tokens in 128-token steps, is reported as
+usage.prompt_tokens_details.cached_tokens (--no-prompt-cache turns this off).
+
+Latency is fixed, uniform (latency ± jitter) or lognormal (median latency, --sigma).
+Errors can be injected: a share of requests answered 429 (with Retry-After) or 500,
+or left hanging past the client's timeout.
+
+--record FILE forwards every request to a real OpenAI-compatible API (--upstream) and
+appends the response to FILE as JSON lines; --replay FILE answers requests seen in a
+recording with the recorded reply (and, with --replay-timing, its recorded latency),
+falling back to the canned verdict for anything not recorded. GET /stats returns
+request, error and replay counters.
+
+Point the app at it with LLM_BASE_URL (or the SDK's OPENAI_BASE_URL).
+
+Usage:
+    python benchmarks/mock_llm.py --port 8089 --latency 2.0
+    python benchmarks/mock_llm.py --distribution lognormal --latency 1.5 --sigma 0.4 --rate-429 0.05
+    OPENAI_API_KEY=sk-... python benchmarks/mock_llm.py --record recordings.jsonl
+    python benchmarks/mock_llm.py --replay recordings.jsonl --replay-timing
+    LLM_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=mock python app.py
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+VERDICT = {
+    "result": "compliant",
+    "reason": "Mock verdict: the request follows the policy text provided.",
+}
+DEFAULT_UPSTREAM = "https://api.openai.com/v1"
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_STEP_TOKENS = 128
+# Entry headers of the per-item award and batch transaction prompts, and the id field each answer carries
+RESULT_ENTRY_PATTERNS = (
+    ("item", re.compile(r"^\[Item (\d+)\]", re.MULTILINE)),
+    ("transaction_id", re.compile(r"^\[Transaction (\d+)\]", re.MULTILINE)),
+)
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def mock_content(body):
+    """Canned reply shaped like what the request asked for."""
+    schema = ((body.get("response_format") or {}).get("json_schema") or {}).get("schema")
+    if schema and schema.get("properties"):
+        return json.dumps({key: VERDICT for key in schema["properties"]})
+    prompt = "".join(m.get("content") or "" for m in body.get("messages", []) if m.get("role") == "user")
+    for field, pattern in RESULT_ENTRY_PATTERNS:
+        ids = pattern.findall(prompt)
+        if ids:
+            return json.dumps({"results": [{field: int(entry_id), **VERDICT} for entry_id in ids]})
+    return json.dumps(VERDICT)
+
+
+def request_key(body):
+    """Recordings are matched on what determines the reply, not on sampling or streaming options."""
+    material = json.dumps(
+        [body.get("model"), body.get("messages"), body.get("response_format")],
+        sort_keys=True, ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class MockConfig:
+    """Everything a handler needs; shared by all handler threads of one server."""
+
+    def __init__(self, latency=1.0, jitter=0.0, distribution=None, sigma=0.5,
+                 rate_429=0.0, rate_500=0.0, rate_timeout=0.0, hang=120.0, retry_after=1.0,
+                 record=None, replay=None, replay_timing=False, upstream=DEFAULT_UPSTREAM, upstream_key=None,
+                 prompt_cache=True):
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution or ("uniform" if jitter else "fixed")
+        self.sigma = sigma
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.rate_timeout = rate_timeout
+        self.hang = hang
+        self.retry_after = retry_after
+        self.record = record
+        self.replay_timing = replay_timing
+        self.upstream = upstream.rstrip("/")
+        self.upstream_key = upstream_key
+        self.prompt_cache = prompt_cache
+        self.prefixes = set()  # hashes of every cacheable prompt prefix served so far
+        self.recordings = {}
+        if replay:
+            with open(replay, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.recordings[entry["key"]] = entry
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def sample_latency(self):
+        if self.distribution == "lognormal":
+            return random.lognormvariate(math.log(max(self.latency, 1e-6)), self.sigma)
+        if self.distribution == "uniform":
+            return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        return self.latency
+
+    def cached_tokens(self, body):
+        """Tokens of the longest prompt prefix served before, counted the way the provider does."""
+        text = body.get("model", "") + "".join(m.get("content") or "" for m in body.get("messages", []))
+        digest, start, keys = hashlib.sha256(), 0, []
+        for end in range(PROMPT_CACHE_MIN_TOKENS * 4, len(text) + 1, PROMPT_CACHE_STEP_TOKENS * 4):
+            digest.update(text[start:end].encode("utf-8"))
+            start = end
+            keys.append((end // 4, digest.hexdigest()))
+        hit = 0
+        with self.lock:
+            for tokens, key in keys:
+                if key not in self.prefixes:
+                    break
+                hit = tokens
+            self.prefixes.update(key for _, key in keys)
+        return hit
+
+    def append_recording(self, entry):
+        with self.lock:
+            with open(self.record, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.recordings[entry["key"]] = entry
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    config = MockConfig()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.config.lock:
+                stats = dict(self.config.stats)
+            self.send_json(200, stats)
+        else:
+            self.send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        config = self.config
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        config.count("requests")
+
+        roll = random.random()
+        if roll < config.rate_429:
+            config.count("injected_429")
+            self.send_json(429, {"error": {"message": "Mock rate limit", "type": "rate_limit_exceeded"}},
+                           {"Retry-After": f"{config.retry_after:g}"})
+            return
+        if roll < config.rate_429 + config.rate_500:
+            config.count("injected_500")
+            time.sleep(config.sample_latency())
+            self.send_json(500, {"error": {"message": "Mock server error", "type": "server_error"}})
+            return
+        if roll < config.rate_429 + config.rate_500 + config.rate_timeout:
+            config.count("injected_timeouts")
+            time.sleep(config.hang)  # the client gives up long before this
+            return
+
+        latency = config.sample_latency()
+        key = request_key(body)
+        recorded = config.recordings.get(key)
+        if config.record:
+            start = time.monotonic()
+            try:
+                content, usage = self.forward(body)
+            except urllib.error.HTTPError as e:
+                config.count(f"upstream_{e.code}")
+                self.send_json(e.code, json.loads(e.read() or b"{}"))
+                return
+            config.append_recording({"key": key, "model": body.get("model"), "content": content,
+                                     "usage": usage, "latency": round(time.monotonic() - start, 3)})
+            config.count("recorded")
+            latency = 0.0  # the upstream call already took the real time
+        elif recorded:
+            config.count("replay_hits")
+            content, usage = recorded["content"], recorded["usage"]
+            if config.replay_timing:
+                latency = recorded["latency"]
+        else:
+            if config.recordings:
+                config.count("replay_misses")
+            content = mock_content(body)
+            prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in body.get("messages", []))
+            completion_tokens = estimate_tokens(content)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+            if config.prompt_cache:
+                cached = config.cached_tokens(body)
+                usage["prompt_tokens_details"] = {"cached_tokens": cached}
+                if cached:
+                    config.count("prompt_cache_hits")
+
+        if body.get("stream"):
+            self.stream_completion(body, content, usage, latency)
+            return
+        time.sleep(latency)
+        self.send_json(200, {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    def forward(self, body):
+        """Send the request upstream without streaming. Returns (content, usage)."""
+        upstream_body = {k: v for k, v in body.items() if k not in ("stream", "stream_options")}
+        api_key = self.config.upstream_key
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}" if api_key else self.headers.get("Authorization", ""),
+        }
+        req = urllib.request.Request(f"{self.config.upstream}/chat/completions",
+                                     data=json.dumps(upstream_body).encode("utf-8"), headers=headers, method="POST")
+        with urllib.request.urlopen(req, timeout=120) as resp:
+            reply = json.loads(resp.read())
+        return reply["choices"][0]["message"]["content"], reply.get("usage")
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream_completion(self, body, content, usage, latency):
+        """First chunk after half the latency, the rest spread evenly over the other half."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        pieces = [content[i:i + 16] for i in range(0, len(content), 16)] or [""]
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+        def send(choices, chunk_usage=None):
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": choices,
+                "usage": chunk_usage,
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        time.sleep(latency / 2)
+        for piece in pieces:
+            send([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+            time.sleep(latency / 2 / len(pieces))
+        send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if include_usage:
+            send([], usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_llm(port=0, latency=1.0, jitter=0.0, **options):
+    """
+    Serve the mock on a background thread. options are MockConfig's (distribution,
+    sigma, rate_429, rate_500, rate_timeout, record, replay, ...). Returns (server, base_url).
+    """
+    config = MockConfig(latency=latency, jitter=jitter, **options)
+    handler = type("Handler", (MockLLMHandler,), {"config": config})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds per completion (median for lognormal)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds of uniform random latency")
+    parser.add_argument("--distribution", choices=["fixed", "uniform", "lognormal"])
+    parser.add_argument("--sigma", type=float, default=0.5, help="lognormal shape; 0.5 puts p95 at ~2.3x the median")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of requests answered 429")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="share of requests answered 500")
+    parser.add_argument("--rate-timeout", type=float, default=0.0, help="share of requests left hanging")
+    parser.add_argument("--hang", type=float, default=120.0, help="seconds a hanging request is held")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--record", help="proxy to --upstream and append replies to this JSONL file")
+    parser.add_argument("--upstream", default=DEFAULT_UPSTREAM)
+    parser.add_argument("--replay", help="answer from a recording made with --record")
+    parser.add_argument("--replay-timing", action="store_true", help="replay recorded latency instead of --latency")
+    parser.add_argument("--no-prompt-cache", action="store_true", help="never report cached prompt tokens")
+    args = parser.parse_args()
+
+    server, base_url = start_mock_llm(
+        args.port, args.latency, args.jitter, distribution=args.distribution, sigma=args.sigma,
+        rate_429=args.rate_429, rate_500=args.rate_500, rate_timeout=args.rate_timeout, hang=args.hang,
+        retry_after=args.retry_after, record=args.record, replay=args.replay, replay_timing=args.replay_timing,
+        upstream=args.upstream, upstream_key=os.getenv("OPENAI_API_KEY") if args.record else None,
+        prompt_cache=not args.no_prompt_cache,
+    )
+    config = server.RequestHandlerClass.config
+    if args.record:
+        mode = f"recording to {args.record}"
+    elif args.replay:
+        mode = f"replaying {len(config.recordings)} recorded replies"
+    else:
+        mode = "canned replies"
+    print(f"Mock LLM listening on {base_url} ({config.distribution} latency {args.latency:.2f}s, {mode})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 -- PostgreSQL Schema for GrantGuard
 -- Converted from MySQL to PostgreSQL syntax
+-- Baseline schema. Later changes live in the numbered migrations that follow.
 
 -- Enable UUID extension if needed
 -- CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
@@ -106,15 +107,24 @@ ALTER TABLE transactions ADD COLUMN IF NOT EXISTS travel_other DECIMAL(12,2);
 ALTER TABLE transactions
   ADD COLUMN IF NOT EXISTS compliance_notes TEXT;
 
--- Update status constraint to include 'Paid' if it doesn't already
--- Drop the old constraint if it exists
-ALTER TABLE transactions
-  DROP CONSTRAINT IF EXISTS transactions_status_check;
-
--- Add the new constraint with 'Paid' status
-ALTER TABLE transactions
-  ADD CONSTRAINT transactions_status_check
-  CHECK (status IN ('Pending', 'Approved', 'Paid', 'Declined'));
+-- Update status constraint to include 'Paid' if it doesn't already.
+-- Only rebuilt when missing or outdated, since adding a CHECK scans the whole table.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'transactions'::regclass
+          AND conname = 'transactions_status_check'
+          AND pg_get_constraintdef(oid) LIKE '%Paid%'
+    ) THEN
+        ALTER TABLE transactions
+          DROP CONSTRAINT IF EXISTS transactions_status_check;
+        ALTER TABLE transactions
+          ADD CONSTRAINT transactions_status_check
+          CHECK (status IN ('Pending', 'Approved', 'Paid', 'Declined'));
+    END IF;
+END
+$$;
 
 -- ======================
 -- BUDGET_LINES TABLE (generic)
@@ -266,12 +276,22 @@ CREATE INDEX IF NOT EXISTS subawards_award_id_idx ON subawards(award_id);
 CREATE INDEX IF NOT EXISTS subawards_status_idx ON subawards(status);
 
 -- Update subawards status constraint to include 'Paid' if it doesn't already
-ALTER TABLE subawards
-  DROP CONSTRAINT IF EXISTS subawards_status_check;
-
-ALTER TABLE subawards
-  ADD CONSTRAINT subawards_status_check
-  CHECK (status IN ('Pending', 'Approved', 'Paid', 'Declined'));
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'subawards'::regclass
+          AND conname = 'subawards_status_check'
+          AND pg_get_constraintdef(oid) LIKE '%Paid%'
+    ) THEN
+        ALTER TABLE subawards
+          DROP CONSTRAINT IF EXISTS subawards_status_check;
+        ALTER TABLE subawards
+          ADD CONSTRAINT subawards_status_check
+          CHECK (status IN ('Pending', 'Approved', 'Paid', 'Declined'));
+    END IF;
+END
+$$;
 
 -- Budget lines for subawards (similar to main awards)
 CREATE TABLE IF NOT EXISTS subaward_budget_lines (
@@ -0,0 +1,6 @@
+-- Partial indexes backing the admin dashboard's pending counts
+CREATE INDEX IF NOT EXISTS transactions_pending_award_idx
+    ON transactions(award_id) WHERE status = 'Pending';
+
+CREATE INDEX IF NOT EXISTS subawards_pending_award_idx
+    ON subawards(award_id) WHERE status = 'Pending';
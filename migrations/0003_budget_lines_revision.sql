@@ -0,0 +1,14 @@
+-- One line per (award, category) so allocations can be written with a single upsert.
+-- Collapse duplicates left by the old select-then-insert code before adding the constraint.
+DELETE FROM budget_lines b
+USING budget_lines keep
+WHERE b.award_id = keep.award_id
+  AND b.category = keep.category
+  AND b.line_id > keep.line_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS budget_lines_award_category_key
+    ON budget_lines(award_id, category);
+
+-- Hash of the award budget columns the current budget_lines were computed from
+ALTER TABLE awards
+  ADD COLUMN IF NOT EXISTS budget_lines_revision VARCHAR(64);
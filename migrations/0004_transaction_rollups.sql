@@ -0,0 +1,76 @@
+-- ======================
+-- TRANSACTION_ROLLUPS TABLE
+-- ======================
+-- Per award x category x status totals of transactions, kept current by the
+-- trigger below so budget status is an indexed read instead of a scan.
+-- Category/status normalization matches get_budget_status(): empty -> 'Other'.
+CREATE TABLE IF NOT EXISTS transaction_rollups (
+    award_id INTEGER NOT NULL,
+    category VARCHAR(100) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    total_amount DECIMAL(15,2) NOT NULL DEFAULT 0.00,
+    txn_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (award_id, category, status),
+    CONSTRAINT transaction_rollups_award_id_fkey FOREIGN KEY (award_id)
+        REFERENCES awards(award_id) ON DELETE CASCADE
+);
+
+CREATE OR REPLACE FUNCTION transaction_rollups_add(
+    p_award_id INTEGER, p_category TEXT, p_status TEXT, p_amount NUMERIC
+) RETURNS void AS $$
+BEGIN
+    IF p_award_id IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO transaction_rollups (award_id, category, status, total_amount, txn_count)
+    VALUES (p_award_id, COALESCE(NULLIF(p_category, ''), 'Other'), COALESCE(p_status, ''),
+            COALESCE(p_amount, 0), 1)
+    ON CONFLICT (award_id, category, status) DO UPDATE
+        SET total_amount = transaction_rollups.total_amount + EXCLUDED.total_amount,
+            txn_count = transaction_rollups.txn_count + 1;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Subtracting never inserts: during an award delete the cascade may already have
+-- removed the award row, and an insert would then fail the foreign key.
+CREATE OR REPLACE FUNCTION transaction_rollups_subtract(
+    p_award_id INTEGER, p_category TEXT, p_status TEXT, p_amount NUMERIC
+) RETURNS void AS $$
+BEGIN
+    UPDATE transaction_rollups
+    SET total_amount = total_amount - COALESCE(p_amount, 0),
+        txn_count = txn_count - 1
+    WHERE award_id = p_award_id
+      AND category = COALESCE(NULLIF(p_category, ''), 'Other')
+      AND status = COALESCE(p_status, '');
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION transactions_rollup_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM transaction_rollups_subtract(OLD.award_id, OLD.category, OLD.status, OLD.amount);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM transaction_rollups_add(NEW.award_id, NEW.category, NEW.status, NEW.amount);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS transactions_rollup ON transactions;
+CREATE TRIGGER transactions_rollup
+    AFTER INSERT OR DELETE OR UPDATE OF award_id, category, status, amount
+    ON transactions
+    FOR EACH ROW EXECUTE FUNCTION transactions_rollup_trigger();
+
+-- Rebuild from existing rows. CREATE TRIGGER holds off writers on transactions
+-- until this migration commits, so nothing is double-counted or missed.
+DELETE FROM transaction_rollups;
+
+INSERT INTO transaction_rollups (award_id, category, status, total_amount, txn_count)
+SELECT award_id, COALESCE(NULLIF(category, ''), 'Other'), COALESCE(status, ''),
+       COALESCE(SUM(amount), 0), COUNT(*)
+FROM transactions
+WHERE award_id IS NOT NULL
+GROUP BY 1, 2, 3;
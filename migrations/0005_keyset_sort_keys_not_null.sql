@@ -0,0 +1,10 @@
+-- Keyset pagination for list pages: the sort keys are NOT NULL so row-value comparisons
+-- never drop rows. The matching indexes are built concurrently in 0012.
+-- Rows with no recorded date get 1970-01-01, an obvious "unknown" that sorts last on the
+-- newest-first lists; stamping them with the migration date would present old rows as new.
+UPDATE transactions SET date_submitted = DATE '1970-01-01' WHERE date_submitted IS NULL;
+ALTER TABLE transactions ALTER COLUMN date_submitted SET NOT NULL;
+UPDATE awards SET created_at = TIMESTAMP '1970-01-01' WHERE created_at IS NULL;
+ALTER TABLE awards ALTER COLUMN created_at SET NOT NULL;
+UPDATE subawards SET created_at = TIMESTAMP '1970-01-01' WHERE created_at IS NULL;
+ALTER TABLE subawards ALTER COLUMN created_at SET NOT NULL;
@@ -0,0 +1,14 @@
+-- Persistent tier of the LLM compliance verdict cache, keyed by a hash of everything
+-- that determines the verdict (prompt version, model, policy level, full prompt).
+CREATE TABLE IF NOT EXISTS compliance_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    policy_level VARCHAR(20) NOT NULL,
+    model VARCHAR(100) NOT NULL,
+    result JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    hit_count INTEGER NOT NULL DEFAULT 0,
+    last_hit_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS compliance_cache_expires_at_idx ON compliance_cache(expires_at);
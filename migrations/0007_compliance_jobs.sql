@@ -0,0 +1,31 @@
+-- Durable queue for LLM compliance checks taken off the request path.
+-- Workers claim rows with FOR UPDATE SKIP LOCKED and hold a lease (locked_until);
+-- a running job whose lease expires is picked up again by another worker.
+CREATE TABLE IF NOT EXISTS compliance_jobs (
+    job_id SERIAL PRIMARY KEY,
+    kind VARCHAR(30) NOT NULL,
+    subject_id INTEGER NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_by VARCHAR(100),
+    locked_until TIMESTAMP,
+    last_error TEXT,
+    result JSONB,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    CONSTRAINT compliance_jobs_status_check
+        CHECK (status IN ('queued', 'running', 'done', 'failed'))
+);
+
+-- At most one live job per subject, so repeated approvals/clicks don't stack up work
+CREATE UNIQUE INDEX IF NOT EXISTS compliance_jobs_live_subject_key
+    ON compliance_jobs (kind, subject_id) WHERE status IN ('queued', 'running');
+
+-- Claim scan: only live jobs are indexed
+CREATE INDEX IF NOT EXISTS compliance_jobs_claim_idx
+    ON compliance_jobs (run_after, job_id) WHERE status IN ('queued', 'running');
+
+CREATE INDEX IF NOT EXISTS compliance_jobs_subject_idx ON compliance_jobs (kind, subject_id);
@@ -0,0 +1,30 @@
+-- llm_responses becomes the log of every LLM call: which award/transaction and route
+-- it was made for, the policy level, model, prompt hash, token usage, latency and cost.
+-- Batch calls cover several transactions, so transaction_id stays NULL for them.
+ALTER TABLE llm_responses
+    ADD COLUMN IF NOT EXISTS award_id INTEGER,
+    ADD COLUMN IF NOT EXISTS route VARCHAR(100),
+    ADD COLUMN IF NOT EXISTS policy_level VARCHAR(30),
+    ADD COLUMN IF NOT EXISTS model VARCHAR(100),
+    ADD COLUMN IF NOT EXISTS prompt_hash CHAR(64),
+    ADD COLUMN IF NOT EXISTS prompt_tokens INTEGER,
+    ADD COLUMN IF NOT EXISTS completion_tokens INTEGER,
+    ADD COLUMN IF NOT EXISTS latency_ms INTEGER,
+    ADD COLUMN IF NOT EXISTS cost_usd NUMERIC(12, 6),
+    ADD COLUMN IF NOT EXISTS error TEXT;
+
+ALTER TABLE llm_responses DROP CONSTRAINT IF EXISTS llm_responses_award_id_fkey;
+ALTER TABLE llm_responses ADD CONSTRAINT llm_responses_award_id_fkey
+    FOREIGN KEY (award_id) REFERENCES awards(award_id) ON DELETE CASCADE;
+
+-- Compliance verdicts are logged as-is alongside the original decision values
+ALTER TABLE llm_responses DROP CONSTRAINT IF EXISTS llm_responses_llm_decision_check;
+ALTER TABLE llm_responses ADD CONSTRAINT llm_responses_llm_decision_check
+    CHECK (llm_decision IN ('Allow', 'Allow with Prior Approval', 'Disallow',
+                            'compliant', 'non-compliant', 'unknown'));
+
+UPDATE llm_responses SET timestamp = CURRENT_TIMESTAMP WHERE timestamp IS NULL;
+ALTER TABLE llm_responses ALTER COLUMN timestamp SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS llm_responses_timestamp_idx ON llm_responses (timestamp);
+CREATE INDEX IF NOT EXISTS llm_responses_award_id_idx ON llm_responses (award_id);
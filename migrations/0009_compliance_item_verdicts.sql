@@ -0,0 +1,13 @@
+-- Per-line-item compliance verdicts for incremental award re-checks. item_key hashes
+-- the item's content, the award context it is judged in and the policy section text
+-- it is judged against, so an unchanged item under unchanged policy is never re-sent.
+CREATE TABLE IF NOT EXISTS compliance_item_verdicts (
+    award_id INTEGER NOT NULL REFERENCES awards(award_id) ON DELETE CASCADE,
+    policy_level VARCHAR(20) NOT NULL,
+    item_key CHAR(64) NOT NULL,
+    section VARCHAR(30) NOT NULL,
+    label TEXT NOT NULL,
+    result JSONB NOT NULL,
+    checked_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (award_id, policy_level, item_key)
+);
@@ -0,0 +1,3 @@
+-- Prompt tokens the provider served from its prompt cache (usage.prompt_tokens_details.cached_tokens);
+-- NULL when the provider doesn't report them.
+ALTER TABLE llm_responses ADD COLUMN IF NOT EXISTS cached_tokens INTEGER;
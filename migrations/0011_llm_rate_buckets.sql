@@ -0,0 +1,13 @@
+-- Token buckets shared by every process that calls the LLM, one row per model. requests
+-- and tokens are the budget left as of updated_at; callers refill them by elapsed time
+-- under the row lock, then take what a call costs. granted/waited/wait_ms count calls
+-- admitted across all processes and how long the delayed ones queued.
+CREATE TABLE IF NOT EXISTS llm_rate_buckets (
+    name VARCHAR(100) PRIMARY KEY,
+    requests DOUBLE PRECISION NOT NULL,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp(),
+    granted BIGINT NOT NULL DEFAULT 0,
+    waited BIGINT NOT NULL DEFAULT 0,
+    wait_ms BIGINT NOT NULL DEFAULT 0
+);
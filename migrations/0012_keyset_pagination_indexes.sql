@@ -0,0 +1,24 @@
+-- migrate: no-transaction
+-- Composite indexes matching each paged ORDER BY (sort keys made NOT NULL in 0005), built
+-- CONCURRENTLY so transactions and awards stay writable while they build. A failed build
+-- leaves an INVALID index that IF NOT EXISTS would skip; drop it before re-running.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_submitted_keyset_idx
+    ON transactions (date_submitted DESC, transaction_id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_award_submitted_keyset_idx
+    ON transactions (award_id, date_submitted DESC, transaction_id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_status_submitted_keyset_idx
+    ON transactions (status, date_submitted DESC, transaction_id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS awards_created_keyset_idx
+    ON awards (created_at DESC, award_id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS awards_owner_created_keyset_idx
+    ON awards (created_by_email, created_at DESC, award_id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS awards_status_title_keyset_idx
+    ON awards (status, title, award_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS subawards_award_created_keyset_idx
+    ON subawards (award_id, created_at DESC, subaward_id DESC);
+
+-- Plain award_id indexes are now prefixes of the keyset indexes above
+DROP INDEX CONCURRENTLY IF EXISTS transactions_award_id_idx;
+DROP INDEX CONCURRENTLY IF EXISTS subawards_award_id_idx;
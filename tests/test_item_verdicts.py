@@ -0,0 +1,130 @@
+"""
+Incremental per-item award checks: stored verdicts are reused, edited items are re-checked
+and rows for removed items are dropped. The LLM is a fake client answering with the
+benchmark mock's canned reply. Run from the repo root with:
+    python -m unittest discover tests
+"""
+import os
+import re
+import sys
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+import app  # noqa: E402
+from mock_llm import mock_content  # noqa: E402
+
+ITEM_HEADER_RE = re.compile(r"^\[Item \d+\]", re.MULTILINE)
+
+
+class FakeLLMClient:
+    """Stands in for LLMClient; counts the items each request asks about."""
+
+    def __init__(self):
+        self.items_per_call = []
+
+    def complete(self, **body):
+        prompt = body["messages"][-1]["content"]
+        self.items_per_call.append(len(ITEM_HEADER_RE.findall(prompt)))
+        message = SimpleNamespace(content=mock_content(body))
+        return SimpleNamespace(model="mock", usage=None, choices=[SimpleNamespace(message=message)])
+
+
+class ItemVerdictStore:
+    """In-memory compliance_item_verdicts, with _store_item_verdicts' upsert/delete semantics."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def load(self, award_id):
+        return dict(self.rows)
+
+    def store(self, award_id, current_keys, fresh):
+        for level, key, _section, _label, verdict in fresh:
+            if verdict.get("result") in ("compliant", "non-compliant"):
+                self.rows[(level, key)] = verdict
+        for level, keys in current_keys.items():
+            for row in [row for row in self.rows if row[0] == level and row[1] not in keys]:
+                del self.rows[row]
+
+
+class IncrementalAwardCheckTest(unittest.TestCase):
+    def setUp(self):
+        self.store = ItemVerdictStore()
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.addCleanup(self.executor.shutdown)
+        for name, value in (("_load_item_verdicts", self.store.load), ("_store_item_verdicts", self.store.store),
+                            ("record_llm_calls", lambda *args, **kwargs: None),
+                            ("RULES_DECIDE_COMPLIANT", False)):  # send every item to the LLM
+            patcher = mock.patch.object(app, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.levels = [key for key, _ in app.POLICY_LEVELS if (app.policy_store.get(key) or {}).get("text")]
+        self.award = {"award_id": 1, "title": "Imaging study", "sponsor_type": "Federal", "amount": 250000}
+        self.materials = [
+            {"description": "Pipette tips", "cost": "120"},
+            {"description": "Reagents", "cost": "900"},
+            {"description": "Slides", "cost": "300"},
+            {"type": "equipment", "description": "Centrifuge", "cost": "6500"},
+        ]
+
+    def run_check(self, materials):
+        client = FakeLLMClient()
+        items = app.award_line_items([], [], [], materials)
+        verdicts = {key: value for kind, key, value in
+                    app.iter_award_item_checks(client, self.award, items, executor=self.executor)
+                    if kind == "verdict"}
+        return client, verdicts
+
+    def test_mock_reply_gives_every_item_a_verdict(self):
+        client, verdicts = self.run_check(self.materials)
+        self.assertEqual(sum(client.items_per_call), len(self.materials) * len(self.levels))
+        for key in self.levels:
+            self.assertEqual(verdicts[key]["result"], "compliant", verdicts[key]["reason"])
+        self.assertEqual(len(self.store.rows), len(self.materials) * len(self.levels))
+
+    def test_unchanged_award_makes_no_llm_calls(self):
+        self.run_check(self.materials)
+        client, verdicts = self.run_check(self.materials)
+        self.assertEqual(client.items_per_call, [])
+        for key in self.levels:
+            self.assertEqual(verdicts[key]["items_reused"], len(self.materials))
+            self.assertEqual(verdicts[key]["items_checked"], 0)
+
+    def test_editing_one_item_rechecks_only_that_item(self):
+        self.run_check(self.materials)
+        rows_before = set(self.store.rows)
+        edited = [dict(row) for row in self.materials]
+        edited[1]["cost"] = "950"
+        client, verdicts = self.run_check(edited)
+        self.assertEqual(client.items_per_call, [1] * len(self.levels))
+        for key in self.levels:
+            self.assertEqual(verdicts[key]["items_checked"], 1)
+            self.assertEqual(verdicts[key]["items_reused"], len(self.materials) - 1)
+        # The edited item's old rows are replaced, not left behind
+        self.assertEqual(len(self.store.rows), len(self.materials) * len(self.levels))
+        self.assertEqual(len(rows_before - set(self.store.rows)), len(self.levels))
+
+    def test_removed_item_rows_are_deleted(self):
+        self.run_check(self.materials)
+        client, _ = self.run_check(self.materials[:-1])
+        self.assertEqual(client.items_per_call, [])
+        self.assertEqual(len(self.store.rows), (len(self.materials) - 1) * len(self.levels))
+
+
+class BatchTransactionMockTest(unittest.TestCase):
+    def test_mock_reply_answers_every_transaction(self):
+        transactions = [{"transaction_id": txn_id, "category": "Materials", "description": "Reagents", "amount": 90}
+                        for txn_id in (7, 12, 31)]
+        prompt = app.build_batch_transaction_prompt("University", "1. Materials", "", {"title": "Study"},
+                                                    [(txn, []) for txn in transactions])
+        reply = app.parse_compliance_response(mock_content({"messages": [{"role": "user", "content": prompt}]}))
+        self.assertEqual([entry["transaction_id"] for entry in reply["results"]], [7, 12, 31])
+
+
+if __name__ == "__main__":
+    unittest.main()
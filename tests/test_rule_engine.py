@@ -0,0 +1,80 @@
+"""
+Rule-engine checks on award line items. Run from the repo root with:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+def rule_results(items):
+    """{level key: rule_verdict() result (None when the LLM must decide)} for items."""
+    results = {}
+    for key, name in app.POLICY_LEVELS:
+        doc = app.policy_store.get(key)
+        violations, escalate = app.evaluate_policy_rules(doc["rules"], items)
+        results[key] = app.rule_verdict(name, violations, escalate, len(items))
+    return results
+
+
+class AwardLineItemsTest(unittest.TestCase):
+    def test_materials_rows_are_split_by_type(self):
+        items = app.award_line_items([], [], [], [
+            {"type": "equipment", "cost": "6500", "description": "Centrifuge"},
+            {"type": "other", "cost": "300", "description": "Publication fee"},
+            {"cost": "120", "description": "Pipette tips"},
+        ])
+        self.assertEqual([i["category"] for i in items], ["equipment", "materials", "other_direct"])
+
+    def test_equipment_row_in_materials_json_is_held_to_the_equipment_limit(self):
+        # $6,500 is over the $5,000 materials limit but under the $8,000 equipment limit
+        items = app.award_line_items([], [], [], [{"type": "equipment", "cost": "6500", "description": "Centrifuge"}])
+        for key, verdict in rule_results(items).items():
+            if verdict is not None:
+                self.assertNotEqual(verdict["result"], "non-compliant", f"{key}: {verdict['reason']}")
+
+    def test_dedicated_equipment_list_takes_priority(self):
+        items = app.award_line_items([], [], [], [{"type": "equipment", "cost": "6500", "description": "Old row"}],
+                                     equipment=[{"cost": "7000", "description": "Microscope"}])
+        self.assertEqual([(i["category"], i["amount"]) for i in items], [("equipment", 7000.0)])
+
+
+class AmountParsingTest(unittest.TestCase):
+    def test_formatted_cost_strings_are_parsed(self):
+        items = app.award_line_items([], [], [], [
+            {"cost": "6,500", "description": "Microscope lens"},
+            {"cost": "$6,500.00", "description": "Microscope stage"},
+        ])
+        self.assertEqual([i["amount"] for i in items], [6500.0, 6500.0])
+
+    def test_formatted_cost_over_the_limit_is_not_passed_by_the_rules(self):
+        items = app.award_line_items([], [], [], [{"description": "Microscope lens", "cost": "6,500"}])
+        for key, verdict in rule_results(items).items():
+            if verdict is not None:
+                self.assertNotEqual(verdict["result"], "compliant", f"{key}: {verdict['reason']}")
+
+    def test_missing_or_unparseable_cost_escalates(self):
+        items = app.award_line_items([], [], [], [
+            {"description": "Microscope lens"},
+            {"cost": "about 6500", "description": "Microscope stage"},
+        ])
+        self.assertEqual([i["amount"] for i in items], [None, None])
+        for key, name in app.POLICY_LEVELS:
+            _, escalate = app.evaluate_policy_rules(app.policy_store.get(key)["rules"], items)
+            self.assertEqual(len(escalate), 2, key)
+            self.assertIsNone(app.rule_verdict(name, [], escalate, len(items)), key)
+
+    def test_trip_with_unparseable_cost_has_no_amount(self):
+        items = app.award_line_items([], [{"travel_name": "Conference", "flight_cost": "TBD", "days": "3"}], [], [])
+        self.assertIsNone(items[0]["amount"])
+
+    def test_transaction_amount_is_parsed_strictly(self):
+        txn = {"category": "Materials", "description": "Lens", "amount": "n/a"}
+        self.assertIsNone(app.transaction_line_items(txn)[0]["amount"])
+
+
+if __name__ == "__main__":
+    unittest.main()